@@ -1,54 +1,172 @@
 import re
 import os
+import codecs
 import itertools
 from collections import Counter
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from numpy.polynomial.polynomial import polyfit
+from page_store import open_store
+
+chunk_size = 1 << 20
+word_re = re.compile(r'\w+')
+
+worker_store = None
+
+def init_worker(repo):
+	'''
+	Runs once in each worker process: opens the store
+	'''
+	global worker_store
+	worker_store = open_store(repo)
+
+def count_worker(keys):
+	return count_files(worker_store, keys)
+
+def count_files(store, keys, size=chunk_size):
+	'''
+	Counts the lowercased words of the files keys in store
+	'''
+	counter = Counter()
+	for key in keys:
+		with store.open(key) as f:
+			count_stream(f, counter, size)
+	return counter
+
+def count_stream(f, counter, size=chunk_size):
+	'''
+	Adds the lowercased words of binary file f to counter, reading size bytes at a time
+	A word cut by the end of a chunk is carried over to the next chunk
+	'''
+	decoder = codecs.getincrementaldecoder('utf-8')('replace')
+	carry = ''
+	while True:
+		chunk = f.read(size)
+		text = carry + decoder.decode(chunk, final=not chunk)
+		carry = ''
+		if chunk:
+			# same characters as \w
+			end = len(text)
+			while end and (text[end - 1].isalnum() or text[end - 1] == '_'):
+				end -= 1
+			carry = text[end:]
+			text = text[:end]
+		counter.update(word_re.findall(text.lower()))
+		if not chunk:
+			return counter
 
 class Analyze:
-	def __init__(self):
-		self.repo = 'processed'
-		self.counter = Counter([])
-		self.process_text()
+	'''
+	Word statistics of the processed page store
+	Files are read in chunks of chunk_size bytes, so memory is bounded by the
+		vocabulary rather than the corpus; with workers > 1 the files are split
+		into shards counted in worker processes and the partial counts merged
+	'''
+	def __init__(self, repo='processed', workers=1, shards=None, cache='analysis_stats.npz'):
+		self.repo = repo
+		self.workers = workers
+		self.shards = shards
+		self.cache = cache
+		self.counter = Counter()
+		if not self.load_cache():
+			self.process_text()
+			self.save_cache()
 
 	def process_text(self):
-		for filename in os.listdir(self.repo):
-			with open(os.path.join(self.repo, filename), 'r') as f:
-				text = f.read().lower()
-				word_list = re.findall(r'\w+', text)
-				self.counter += Counter(word_list)
+		store = open_store(self.repo)
+		self.version = store.version()
+		keys = sorted(store.keys())
+		if self.workers > 1 and len(keys) > 1:
+			shards = self.shards or self.workers * 4
+			size = -(-len(keys) // shards)
+			with ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(self.repo,)) as pool:
+				# in order, so ties rank as in a serial run
+				for counter in pool.map(count_worker, [keys[i:i + size] for i in range(0, len(keys), size)]):
+					self.counter.update(counter)
+		else:
+			self.counter = count_files(store, keys)
+		store.close()
 
-		# orders by highest frequency
-		self.counter = self.counter.most_common(len(self.counter))
+		# orders by highest frequency, ties in first seen order like Counter.most_common
+		counts = np.fromiter(self.counter.values(), dtype=np.int64, count=len(self.counter))
+		order = np.argsort(-counts, kind='stable')
+		self.frequencies = counts[order]
+		top = order[:100].tolist()
+		words = list(self.counter)
+		self.most_frequent_words = [words[i] for i in top]
+		self.compute_stats()
 
-		self.ranks = range(1, len(self.counter) + 1)
-		self.frequencies = []
-		self.most_frequent_words = []
-		for i, (word, frequency) in enumerate(self.counter):
-			if i < 100:
-				self.most_frequent_words.append(word)
-			self.frequencies.append(frequency)
-		self.total_words = sum(self.frequencies)
-		self.probabilities = [(self.frequencies[i]/self.total_words)*self.ranks[i] for i in range(100)]
+	def compute_stats(self):
+		'''
+		Ranks, total, rank * probability of the most frequent words and the Zipf fit,
+			from the sorted frequencies array
+		'''
+		self.ranks = np.arange(1, len(self.frequencies) + 1)
+		self.total_words = int(self.frequencies.sum())
+		top = len(self.most_frequent_words)
+		self.probabilities = self.frequencies[:top] / self.total_words * self.ranks[:top]
+		# intercept (b) and slope (m) of the least squares line through (log(rank), log(frequency))
+		if len(self.frequencies) > 1:
+			self.fit = polyfit(np.log(self.ranks), np.log(self.frequencies), 1)
+		else:
+			self.fit = np.zeros(2)
 
+	def load_cache(self):
+		'''
+		Loads the statistics saved by save_cache if the store has not changed since
+		Only the 100 most frequent words are cached, so counter is left empty
+		'''
+		if not self.cache or not os.path.isfile(self.cache):
+			return False
+		store = open_store(self.repo)
+		self.version = store.version()
+		store.close()
+		with np.load(self.cache) as data:
+			if str(data['repo']) != self.repo or str(data['version']) != self.version:
+				return False
+			self.frequencies = data['frequencies']
+			self.most_frequent_words = data['most_frequent_words'].tolist()
+		self.compute_stats()
+		return True
 
-	def plot_graph(self, title):
-		x = np.log(np.array(self.ranks))
-		y = np.log(np.array(self.frequencies))
+	def save_cache(self):
+		if not self.cache:
+			return
+		tmp = f'{self.cache}.tmp.npz'
+		np.savez(tmp, repo=self.repo, version=self.version, frequencies=self.frequencies,
+			most_frequent_words=np.array(self.most_frequent_words, dtype=str))
+		os.replace(tmp, self.cache)
 
-        # intercept (b) and slope (m) for best fit line of scatter plot
-		b, m = polyfit(x, y, 1)
+	def plot_graph(self, title, max_points=2000, path=None):
+		'''
+		Plots log(frequency) against log(rank) with the Zipf fit
+		Ranks are sampled at max_points log spaced positions, which keeps every
+			distinct point of the head and thins out the long tail
+		The plot is shown, or saved to path if given
+		'''
+		import matplotlib.pyplot as plt
+
+		b, m = self.fit
+		points = np.unique(np.geomspace(1, max(len(self.ranks), 1), max_points).astype(np.int64)) - 1
+		x = np.log(self.ranks[points])
+		y = np.log(self.frequencies[points])
 
 		plt.plot(x,y,'.')
 		plt.plot(x,b+m*x,'-')
 		plt.title(title)
 		plt.xlabel('log(rank)')
 		plt.ylabel('log(frequency)')
-		plt.show()
+		if path:
+			plt.savefig(path)
+			plt.close()
+		else:
+			plt.show()
 
 	def plot_most_frequent(self):
-		data = np.array([self.most_frequent_words, self.ranks[:100], self.frequencies[:100], self.probabilities]).transpose()
+		import matplotlib.pyplot as plt
+
+		data = [[word, rank, frequency, probability] for word, rank, frequency, probability in
+			zip(self.most_frequent_words, self.ranks.tolist(), self.frequencies.tolist(), self.probabilities.tolist())]
 
 		fig, axes = plt.subplots(1,1)
 		collabel = ('Words', 'Rank', 'Frequency', 'rPr')
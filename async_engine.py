@@ -0,0 +1,265 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+from politeness import RETRY_STATUSES, parse_retry_after
+
+
+class AsyncCrawlEngine:
+    '''
+    asyncio fetch engine for WebCrawler
+    Keeps up to max_in_flight requests open across all hosts. Politeness is
+        enforced by the crawler's throttle (see politeness.AutoThrottle): a host is
+        only dispatched once its next allowed time is reached, so no worker ever
+        sleeps for a crawl delay; a request throttled by the host (429, 503) is
+        queued again at the front of its host's queue while the throttle allows
+    Uses the crawler's repo_files, file_count, num_pages and domain exactly as
+        the serial and threaded modes do
+    Connection limits, timeouts and compression follow the crawler's ConnectionPool:
+        requests dispatched beyond its max_connections wait for a free connection
+    Saving a page (disk write, link parsing, near duplicate check) runs on a
+        thread, so a large page does not hold up the other requests
+    Requires aiohttp
+    '''
+    def __init__(self, crawler, max_in_flight=1000):
+        self.crawler = crawler
+        self.max_in_flight = max_in_flight
+        # urls are moved from the crawler's (bounded) frontier into host queues
+        # only while fewer than this many are waiting to be dispatched
+        self.max_buffered = 4 * max_in_flight
+        self.scheduler = crawler.throttle
+        self.host_queues = {}
+        self.attempts = {}
+        # the crawler checkpoints these as urls taken from the frontier but not crawled yet
+        crawler.domain_dict = self.host_queues
+        self.robots_pending = set()
+        self.buffered = 0
+        self.in_flight = 0
+
+    def run(self):
+        '''
+        Runs the crawl to completion
+        Inside a running event loop (e.g. jupyter), the crawl runs on a separate thread
+        '''
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(self.crawl())
+            return
+        thread = threading.Thread(target=asyncio.run, args=(self.crawl(),))
+        thread.start()
+        thread.join()
+
+    def budget_left(self):
+        return self.crawler.file_count < self.crawler.num_pages
+
+    def enqueue(self, url, depth):
+        '''
+        Adds url to its host's queue if it passes the crawler's domain, extension and repo checks
+        Hosts seen for the first time get their robots.txt fetched before any page
+        '''
+        parsed_url = urlparse(url)
+        if url in self.crawler.repo_files:
+            return
+        if not self.crawler.check_domain(parsed_url.netloc) or not self.crawler.check_ext(url):
+            return
+        host = f'{parsed_url.scheme}://{parsed_url.netloc}'
+        if host not in self.host_queues:
+            self.host_queues[host] = deque()
+            self.robots_pending.add(host)
+            self.spawn(self.fetch_robot(host))
+        queue = self.host_queues[host]
+        queue.append((url, depth))
+        self.buffered += 1
+        if len(queue) == 1 and host not in self.robots_pending:
+            self.scheduler.push(host)
+
+    def host(self, url):
+        parsed_url = urlparse(url)
+        return f'{parsed_url.scheme}://{parsed_url.netloc}'
+
+    def drain_frontier(self):
+        frontier = self.crawler.frontier
+        # pages saved on other threads add their links to the frontier
+        with self.crawler.lock:
+            while frontier and self.buffered < self.max_buffered:
+                self.enqueue(*frontier.pop())
+
+    def spawn(self, coro):
+        self.in_flight += 1
+        task = asyncio.ensure_future(coro)
+        task.add_done_callback(self.task_done)
+
+    def task_done(self, task):
+        self.in_flight -= 1
+        self.wakeup.set()
+
+    async def fetch_robot(self, host):
+        '''
+        Fetches robots.txt for host into the crawler's robots cache (unless cached),
+            then makes the host schedulable at its crawl delay
+        The robots request itself takes the host's first slot
+        On the first visit of a host, its sitemaps seed the frontier (see WebCrawler.seed_sitemaps)
+        '''
+        robots = self.crawler.robots
+        metrics = self.crawler.metrics
+        rules = robots.lookup(host)
+        if rules is None:
+            self.scheduler.reserve(host)
+            metrics.inc('robots_fetched')
+            st = time.perf_counter()
+            try:
+                with metrics.timer('robots_fetch'):
+                    async with self.session.get(f'{host}/robots.txt') as r:
+                        self.scheduler.observe(host, time.perf_counter() - st, r.status)
+                        body = await r.read()
+                        status = r.status
+                if status >= 500:
+                    rules = robots.store(host, ok=False)
+                elif status >= 400:
+                    rules = robots.store(host)
+                else:
+                    rules = robots.store(host, body.decode('utf-8', 'replace'))
+            except Exception:
+                metrics.inc('request_errors')
+                rules = robots.store(host, ok=False)
+        first_visit = host not in self.crawler.visited_robots
+        self.crawler.visited_robots.add(host)
+        self.scheduler.set_delay(host, rules.crawl_delay or self.scheduler.default_delay)
+        if first_visit and self.crawler.sitemap_urls:
+            # sitemaps are read with the crawler's blocking pool on a thread, so the
+            # other hosts keep crawling; the host waits for them like for its robots.txt
+            urls = await asyncio.to_thread(self.crawler.read_sitemaps, host, rules)
+            self.crawler.add_sitemap_urls(urls)
+        self.robots_pending.discard(host)
+        if self.host_queues[host]:
+            self.scheduler.push(host)
+
+    async def fetch_page(self, url, depth):
+        '''
+        Gets url and, for html responses, saves the file and queues its links
+        Timed as page, like WebCrawler.process_url, from the request to the saved file
+        '''
+        with self.crawler.metrics.timer('page'):
+            await self.get_page(url, depth)
+
+    async def get_page(self, url, depth):
+        '''
+        The whole request, body included, is timed as http_fetch; the time to the
+            response headers and the status go to the throttle
+        '''
+        metrics = self.crawler.metrics
+        host = self.host(url)
+        observed = False
+        st = time.perf_counter()
+        try:
+            async with self.session.get(url, headers=self.crawler.conditional_headers(url)) as r:
+                status = r.status
+                headers = r.headers
+                self.scheduler.observe(host, time.perf_counter() - st, status)
+                observed = True
+                if status in RETRY_STATUSES:
+                    metrics.inc('throttled')
+                    self.retry(host, url, depth, parse_retry_after(headers.get('Retry-After')))
+                    return
+                if status == 304 and url in self.crawler.previous_files:
+                    content = None
+                elif 'text/html' in headers.get('Content-Type', ''):
+                    content = await r.read()
+                else:
+                    return
+        except Exception:
+            if not observed:
+                self.scheduler.observe(host, time.perf_counter() - st)
+            metrics.inc('request_errors')
+            return
+        finally:
+            metrics.observe('http_fetch', time.perf_counter() - st)
+        if not self.budget_left() or url in self.crawler.repo_files:
+            return
+        if content is None:
+            await asyncio.to_thread(self.crawler.reuse_file, url, depth)
+        else:
+            await asyncio.to_thread(self.crawler.save_file, url, status, [content], depth, headers)
+
+    def retry(self, host, url, depth, retry_after=None):
+        '''
+        Queues a throttled url again at the front of its host's queue, if the
+            throttle allows another attempt
+        '''
+        attempt = self.attempts.get(url, 0)
+        if not self.scheduler.retry(host, attempt, retry_after):
+            self.attempts.pop(url, None)
+            self.crawler.metrics.inc('retries_exhausted')
+            return
+        self.attempts[url] = attempt + 1
+        self.crawler.metrics.inc('retries')
+        queue = self.host_queues[host]
+        queue.appendleft((url, depth))
+        self.buffered += 1
+        if len(queue) == 1:
+            self.scheduler.push(host)
+
+    async def count_request(self, session, context, params):
+        self.crawler.pool.stats.add_request()
+
+    async def count_connection(self, session, context, params):
+        self.crawler.pool.stats.add_connection()
+
+    async def wait(self, timeout=None):
+        self.wakeup.clear()
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def crawl(self):
+        import aiohttp
+
+        self.wakeup = asyncio.Event()
+        pool = self.crawler.pool
+        connector = aiohttp.TCPConnector(limit=min(self.max_in_flight, pool.max_connections),
+                                         limit_per_host=pool.max_per_host)
+        timeout = aiohttp.ClientTimeout(sock_connect=pool.timeout[0], sock_read=pool.timeout[1])
+        headers = {'Accept-Encoding': pool.headers['Accept-Encoding']}
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(self.count_request)
+        trace.on_connection_create_end.append(self.count_connection)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers,
+                                         trace_configs=[trace]) as self.session:
+            self.crawler.frontier.mark_seen(self.crawler.seed)
+            self.enqueue(self.crawler.seed, 0)
+            while self.budget_left():
+                self.drain_frontier()
+                head = self.scheduler.peek()
+                if head is None:
+                    if not self.in_flight:
+                        break
+                    await self.wait()
+                    continue
+                # never have more page requests open than pages left in the budget
+                remaining = self.crawler.num_pages - self.crawler.file_count
+                if self.in_flight >= min(self.max_in_flight, remaining + len(self.robots_pending)):
+                    await self.wait()
+                    continue
+                ready_at, host = head
+                now = time.monotonic()
+                if ready_at > now:
+                    await self.wait(ready_at - now)
+                    continue
+                self.scheduler.pop()
+                if self.scheduler.ready_at(host) > now:
+                    # held back (Retry-After or backoff) since it was pushed
+                    self.scheduler.push(host)
+                    continue
+                url, depth = self.host_queues[host].popleft()
+                self.buffered -= 1
+                if self.crawler.check_robot_allowed(url):
+                    self.scheduler.reserve(host, now)
+                    self.spawn(self.fetch_page(url, depth))
+                if self.host_queues[host]:
+                    self.scheduler.push(host)
+            while self.in_flight:
+                await self.wait()
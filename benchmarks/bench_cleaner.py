@@ -0,0 +1,51 @@
+'''
+Compares ContentProcessor.clean_html (one traversal) with clean_html_multipass
+    (remove_attrs, remove_tags, serialize, parse again, remove_div_extra)
+    on the saved pages in analysis/, for each available parser
+Checks that both produce the same html
+Run from the repository root: python benchmarks/bench_cleaner.py
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup, FeatureNotFound
+from content_processor import ContentProcessor
+
+PAGES = ['analysis/Wiki_Main.html']
+PARSERS = ['html.parser', 'lxml']
+ROUNDS = 10
+
+
+def bench(clean, content, parser):
+    e = 0.0
+    for _ in range(ROUNDS):
+        soup = BeautifulSoup(content, parser)
+        st = time.perf_counter()
+        result = clean(soup)
+        e += time.perf_counter() - st
+    return e / ROUNDS, str(result)
+
+
+def main():
+    print(f'{"page":25} {"parser":12} {"multipass ms":>13} {"single ms":>10} {"speedup":>8}')
+    for page in PAGES:
+        with open(page, 'rb') as f:
+            content = f.read()
+        for parser in PARSERS:
+            try:
+                BeautifulSoup('', parser)
+            except FeatureNotFound:
+                continue
+            processor = ContentProcessor(parser=parser)
+            old = bench(processor.clean_html_multipass, content, parser)
+            new = bench(processor.clean_html, content, parser)
+            if old[1] != new[1]:
+                raise AssertionError(f'{page} ({parser}): clean_html and clean_html_multipass differ')
+            print(f'{page:25} {parser:12} {old[0] * 1000:13.2f} {new[0] * 1000:10.2f} {old[0] / new[0]:7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
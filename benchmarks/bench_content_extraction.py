@@ -0,0 +1,63 @@
+'''
+Benchmarks body text extraction (ContentProcessor extractor='bte') on long pages,
+    built by repeating the body of analysis/Wiki_Main.html
+    loop score: one window scored by O(n) loops over the tokens, as the old
+        lst_score helpers did for every step of a random search
+    O(1) score: one window scored with window_score from prefix sums
+    best window: the exact O(n) NumPy scan over all windows
+    extract: tokenizing, scanning and pruning a cleaned page
+Run from the repository root: python benchmarks/bench_content_extraction.py
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from content_processor import ContentProcessor, best_window, tag_prefix_sums, window_score
+
+PAGE = 'analysis/Wiki_Main.html'
+REPEATS = [1, 4, 16, 64]
+
+
+def loop_score(tokens, i, j):
+    below = sum(tokens[k] for k in range(i))
+    between = sum(1 - tokens[k] for k in range(i, j + 1))
+    above = sum(tokens[k] for k in range(j + 1, len(tokens)))
+    return below + between + above
+
+
+def timed(f, *args, rounds=1):
+    st = time.perf_counter()
+    for _ in range(rounds):
+        result = f(*args)
+    return (time.perf_counter() - st) / rounds, result
+
+
+def main():
+    with open(PAGE, 'rb') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+    body = ''.join(str(child) for child in soup.body.contents)
+    processor = ContentProcessor(extractor='bte')
+    print(f'{"repeats":>7} {"tokens":>8} {"loop score ms":>14} {"O(1) score us":>14} '
+          f'{"best window ms":>15} {"extract ms":>11}')
+    for repeats in REPEATS:
+        page = BeautifulSoup(f'<html><body>{body * repeats}</body></html>', 'html.parser')
+        processor.clean_tree(page.body, prune_divs=False)
+        tokens, _, _ = processor.tokenize(page.body)
+        prefix = tag_prefix_sums(tokens)
+        n = len(tokens)
+        i, j, score = best_window(tokens)
+        loop = timed(loop_score, tokens, i, j)
+        fast = timed(window_score, prefix, i, j, rounds=1000)
+        if not loop[1] == fast[1] == score:
+            raise AssertionError(f'scores differ: {loop[1]} {fast[1]} {score}')
+        scan = timed(best_window, tokens, rounds=10)
+        extract = timed(processor.extract_window, page.body)
+        print(f'{repeats:7} {n:8} {loop[0] * 1000:14.2f} {fast[0] * 1e6:14.2f} '
+              f'{scan[0] * 1000:15.2f} {extract[0] * 1000:11.2f}')
+
+
+if __name__ == '__main__':
+    main()
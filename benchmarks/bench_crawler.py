@@ -0,0 +1,159 @@
+'''
+Offline crawler benchmark suite
+Each scenario starts a SyntheticWeb (see synthetic_web.py) and crawls it with
+    WebCrawler in each engine, in a fresh process and working directory, reporting
+    pages/sec, page and fetch latency percentiles (from crawler.metrics) and peak RSS
+Scenarios:
+    baseline  4 hosts, 20 KB pages, out degree 8, Crawl-delay 0.01
+    large     200 KB pages
+    slow      10% of the pages answer after 100 ms
+    errors    10% of the pages answer 500
+    dedup     25 pages per host, 30% of them near duplicates, crawled with near_duplicates=3
+    sitemaps  hosts with a gzipped sitemap index, crawled with sitemap_urls=1000
+    throttled hosts answer 429 to page requests less than 50 ms apart
+Results can be saved with --output and compared with a saved run with --baseline;
+    a drop in pages/sec larger than --tolerance exits with status 1
+Run from the repository root:
+    python benchmarks/bench_crawler.py --pages 100 --output bench.json
+    python benchmarks/bench_crawler.py --pages 100 --baseline bench.json
+'''
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_web import SyntheticWeb
+
+SCENARIOS = {
+    'baseline': {},
+    'large': {'page_size': 200000},
+    'slow': {'slow_fraction': 0.1, 'slow_delay': 0.1},
+    'errors': {'error_fraction': 0.1},
+    'dedup': {'pages': 25, 'duplicate_fraction': 0.3},
+    'sitemaps': {'sitemaps': True},
+    'throttled': {'rate_limit': 0.05, 'retry_after': 0},
+}
+# WebCrawler arguments of a scenario
+CRAWLER = {
+    'dedup': {'near_duplicates': 3},
+    'sitemaps': {'sitemap_urls': 1000},
+}
+WEB = {'hosts': 4, 'pages': 200, 'out_degree': 8, 'page_size': 20000, 'crawl_delay': 0.01}
+
+
+def crawl(seed_url, pages, engine, options, results):
+    '''
+    Runs one crawl in a child process, in a temporary working directory
+    '''
+    from web_crawler import WebCrawler
+
+    with tempfile.TemporaryDirectory() as path:
+        os.chdir(path)
+        st = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            crawler = WebCrawler(seed=seed_url, num_pages=pages, domain='', engine=engine, **options)
+        e = time.perf_counter() - st
+    snapshot = crawler.metrics.snapshot()
+    result = {'pages': crawler.file_count, 'seconds': e, 'pages_per_sec': crawler.file_count / e,
+              # the largest process: the crawler or one of its workers
+              'peak_rss_mb': max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                                 resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024,
+              'counters': snapshot['counters']}
+    if crawler.near_index is not None:
+        result['dedup'] = crawler.duplicate_summary()
+    for stage in ('page', 'http_fetch'):
+        timer = snapshot['timers'].get(stage, {})
+        for q in ('p50', 'p95', 'p99'):
+            result[f'{stage}_{q}_ms'] = timer.get(q, 0.0) * 1000
+    results.put(result)
+
+
+def run(scenario, engine, pages, workers=None):
+    context = multiprocessing.get_context('spawn')
+    with SyntheticWeb(**dict(WEB, **SCENARIOS[scenario])) as web:
+        results = context.Queue()
+        options = dict(CRAWLER.get(scenario, {}))
+        if engine == 'processes':
+            options['workers'] = workers
+        process = context.Process(target=crawl, args=(web.seed_url, pages, engine, options, results))
+        process.start()
+        result = results.get()
+        process.join()
+        result['requests'] = web.requests
+    return result
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline crawler benchmarks')
+    parser.add_argument('--pages', type=int, default=100, help='crawl budget per run')
+    parser.add_argument('--engines', default='serial,threaded', help='serial, threaded, async, processes')
+    parser.add_argument('--workers', type=int, help='worker processes of the processes engine (default: all cores)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--output', help='save the results to this json file')
+    parser.add_argument('--baseline', help='compare with the results saved in this json file')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed pages/sec drop (fraction)')
+    args = parser.parse_args()
+
+    report = {'commit': commit(), 'python': platform.python_version(), 'pages': args.pages,
+              'web': WEB, 'results': {}}
+    print(f'{"scenario":10} {"engine":9} {"pages":>5} {"pages/s":>8} {"page p50":>9} {"p95":>8} {"p99":>8} '
+          f'{"fetch p50":>9} {"p95":>8} {"p99":>8} {"RSS MB":>7}')
+    for scenario in args.scenarios.split(','):
+        for engine in args.engines.split(','):
+            result = run(scenario, engine, args.pages, args.workers)
+            report['results'][f'{scenario}/{engine}'] = result
+            print(f'{scenario:10} {engine:9} {result["pages"]:5} {result["pages_per_sec"]:8.1f} '
+                  f'{result["page_p50_ms"]:9.1f} {result["page_p95_ms"]:8.1f} {result["page_p99_ms"]:8.1f} '
+                  f'{result["http_fetch_p50_ms"]:9.1f} {result["http_fetch_p95_ms"]:8.1f} '
+                  f'{result["http_fetch_p99_ms"]:8.1f} {result["peak_rss_mb"]:7.1f}')
+            if 'dedup' in result:
+                dedup = result['dedup']
+                print(f'{"":20} {dedup["duplicates"]} near duplicates of {dedup["pages"]} pages '
+                      f'({dedup["dedup_rate"]:.1%}), {dedup["duplicate_bytes"] / 1e6:.1f} MB not stored, '
+                      f'{dedup["detection_seconds"]:.3f} s detecting')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f'\ncompared with {args.baseline} (commit {baseline.get("commit")})')
+        if baseline.get('pages') != args.pages:
+            print(f'warning: the baseline crawled {baseline.get("pages")} pages per run, not {args.pages}')
+        regressions = 0
+        for name, result in report['results'].items():
+            old = baseline['results'].get(name)
+            if old is None:
+                continue
+            change = result['pages_per_sec'] / old['pages_per_sec'] - 1
+            regressed = change < -args.tolerance
+            regressions += regressed
+            print(f'{name:20} {old["pages_per_sec"]:8.1f} -> {result["pages_per_sec"]:8.1f} pages/s '
+                  f'{change:+7.1%}{"  REGRESSION" if regressed else ""}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
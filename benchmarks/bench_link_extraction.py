@@ -0,0 +1,86 @@
+'''
+Compares link extraction on the saved pages in analysis/
+    find_links: write the page, reopen it and build a BeautifulSoup tree
+    streaming: feed the response chunks to a LinkExtractor while writing them
+Run from the repository root: python benchmarks/bench_link_extraction.py
+'''
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web_crawler import WebCrawler
+from frontier import Frontier
+from page_store import open_store
+from metrics import Metrics
+
+PAGES = ['analysis/Wiki_Main.html', 'analysis/Wiki_Main_computer_processed.html', 'analysis/Wiki_Main_hand_processed.html']
+URL = 'https://en.wikipedia.org/wiki/Main_Page'
+CHUNK = 64 * 1024
+ROUNDS = 20
+
+
+def crawler_stub(repo):
+    # skips __init__, which would start a crawl
+    crawler = WebCrawler.__new__(WebCrawler)
+    crawler.repo = repo
+    crawler.store = open_store(repo, 'files')
+    crawler.repo_files = {}
+    crawler.frontier = Frontier()
+    crawler.previous_files = {}
+    crawler.duplicates = {}
+    crawler.near_index = None
+    crawler.file_count = 0
+    crawler.file_number = 0
+    crawler.lock = threading.RLock()
+    crawler.checkpoint_every = 0
+    crawler.metrics = Metrics()
+    return crawler
+
+
+def chunks(content):
+    return (content[i:i + CHUNK] for i in range(0, len(content), CHUNK))
+
+
+def find_links_path(crawler, content):
+    crawler.file_count += 1
+    crawler.repo_files[URL] = {'filename': f'{crawler.file_count}.html', 'status': 200}
+    with crawler.store.writer(crawler.repo_files[URL]['filename']) as f:
+        for chunk in chunks(content):
+            f.write(chunk)
+    crawler.find_links(URL)
+
+
+def streaming_path(crawler, content):
+    crawler.repo_files.pop(URL, None)
+    crawler.save_file(URL, 200, chunks(content))
+
+
+def bench(path, content, repo):
+    crawler = crawler_stub(repo)
+    st = time.perf_counter()
+    for _ in range(ROUNDS):
+        path(crawler, content)
+    e = (time.perf_counter() - st) / ROUNDS
+    entry = crawler.repo_files[URL]
+    return e, entry['links'], entry['images'], len(crawler.frontier)
+
+
+def main():
+    print(f'{"page":45} {"KB":>6} {"find_links ms":>14} {"streaming ms":>13} {"speedup":>8}')
+    for page in PAGES:
+        with open(page, 'rb') as f:
+            content = f.read()
+        with tempfile.TemporaryDirectory() as repo:
+            old = bench(find_links_path, content, repo)
+            new = bench(streaming_path, content, repo)
+        if old[1:] != new[1:]:
+            raise AssertionError(f'{page}: find_links found {old[1:]}, streaming found {new[1:]}')
+        print(f'{page:45} {len(content) / 1024:6.0f} {old[0] * 1000:14.2f} {new[0] * 1000:13.2f} {old[0] / new[0]:7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+'''
+Measures near duplicate detection on a synthetic repository where a fraction of
+    the pages are print views of other pages (same text, different chrome)
+    crawl time: the duplicates are never stored, so ContentProcessor and Analyze
+        run on fewer pages (WebCrawler(near_duplicates=...))
+    processing time: ContentProcessor(near_duplicates=...) drops them after cleaning,
+        so only Analyze runs on fewer pages
+Reports the dedup rate, the time spent on signatures, the processing time saved,
+    how much the duplicates inflate the word counts, and SimHashIndex lookups
+    against a linear scan of the signatures
+Run from the repository root: python benchmarks/bench_near_duplicates.py [pages] [duplicate fraction]
+'''
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analyze import Analyze
+from content_processor import ContentProcessor
+from link_extractor import LinkExtractor
+from near_duplicates import SimHashIndex, hamming, simhash
+from page_store import open_store
+
+VOCABULARY = 20000
+WORDS_PER_PAGE = 1500
+
+
+def page(words, title, chrome):
+    # markup like an article page: a paragraph with a link every 20 words, a linked navigation
+    paragraphs = ''.join(f'<p class="text">{" ".join(words[i:i + 20])} <a href="/wiki/{words[i]}">{words[i]}</a></p>'
+                         for i in range(0, len(words), 20))
+    navigation = ''.join(f'<li><a href="/wiki/{word}">{word}</a></li>' for word in chrome.split())
+    return (f'<html><head><title>{title}</title><script>var page = "{title}";</script></head><body>'
+            f'<div id="nav"><ul>{navigation}</ul></div><div id="content"><h1>{title}</h1>{paragraphs}</div>'
+            f'<footer>{chrome}</footer></body></html>').encode('utf-8')
+
+
+def build_repository(path, pages, fraction):
+    '''
+    Returns {key: number of the original page} (a page is its own original)
+    '''
+    rng = random.Random(1)
+    vocabulary = [f'w{i}' for i in range(VOCABULARY)]
+    weights = [1 / (i + 1) for i in range(VOCABULARY)]
+    store = open_store(path, 'files')
+    texts = []
+    originals = {}
+    for i in range(pages):
+        key = f'{i + 1}.html'
+        if texts and rng.random() < fraction:
+            original = rng.randrange(len(texts))
+            words = list(texts[original])
+            words[rng.randrange(len(words))] = 'printable'
+            store.put(key, page(words, f'Print view {i}', 'print this page'))
+        else:
+            original = len(texts)
+            words = rng.choices(vocabulary, weights, k=WORDS_PER_PAGE)
+            texts.append(words)
+            store.put(key, page(words, f'Article {i}', ' '.join(rng.choices(vocabulary, k=30))))
+        originals[key] = original
+    store.close()
+    return originals
+
+
+def accuracy(originals, found):
+    '''
+    Pages wrongly reported as duplicates and duplicates missed, given found
+        {key: key of the page it duplicates}
+    '''
+    wrong = sum(originals[key] != originals[original] for key, original in found.items())
+    kept = len({originals[key] for key in originals if key not in found})
+    missed = len(originals) - len(found) - kept
+    return wrong, missed
+
+
+def timed(function, *args, repeat=3):
+    '''
+    Result of function(*args) and its best time of repeat runs
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        st = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - st)
+    return result, best
+
+
+def process(near_duplicates=None):
+    processor = ContentProcessor(near_duplicates=near_duplicates)
+    processor.process_repository('repository')
+    return processor
+
+
+def analyze():
+    return Analyze('processed', cache=None)
+
+
+def page_text(content):
+    # the text the crawler hashes, collected by the LinkExtractor it already runs
+    extractor = LinkExtractor('http://localhost/', collect_text=True)
+    extractor.feed_bytes(content)
+    extractor.finish()
+    return extractor.text()
+
+
+def lookups(signatures, queries, max_distance=3):
+    '''
+    Seconds per lookup with SimHashIndex and with a linear scan (on the first 100 queries)
+    '''
+    index = SimHashIndex(max_distance)
+    for i, signature in enumerate(signatures):
+        index.add(signature, i)
+    st = time.perf_counter()
+    found = [index.find(query) for query in queries]
+    indexed = (time.perf_counter() - st) / len(queries)
+    queries = queries[:100]
+    st = time.perf_counter()
+    scanned = [next((i for i, signature in enumerate(signatures) if hamming(signature, query) <= max_distance), None)
+               for query in queries]
+    linear = (time.perf_counter() - st) / len(queries)
+    return indexed, linear, [a is not None for a in found[:100]] == [a is not None for a in scanned]
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    fraction = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    os.chdir(tempfile.mkdtemp())
+    originals = build_repository('repository', pages, fraction)
+    duplicates = pages - len(set(originals.values()))
+    print(f'{pages} pages, {duplicates} print view duplicates ({duplicates / pages:.1%})')
+
+    _, process_all = timed(process)
+    stats_all, analyze_all = timed(analyze)
+    counts_all = dict(zip(stats_all.most_frequent_words, stats_all.frequencies))
+
+    processor, process_dedup = timed(process, 3)
+    stats_dedup, analyze_dedup = timed(analyze)
+    wrong, missed = accuracy(originals, processor.duplicates)
+    counts = dict(zip(stats_dedup.most_frequent_words, stats_dedup.frequencies))
+    inflation = sum(counts_all[word] for word in counts if word in counts_all) / sum(counts.values()) - 1
+    print(f'processing time: found {len(processor.duplicates)} duplicates (rate {processor.dedup_rate:.1%}, '
+          f'{wrong} false positives, {missed} missed)')
+    print(f'    ContentProcessor {process_all:.2f} s -> {process_dedup:.2f} s, '
+          f'Analyze {analyze_all:.2f} s -> {analyze_dedup:.2f} s')
+
+    # the crawler would not have stored the duplicates it found
+    store = open_store('repository')
+    signatures = {}
+    texts = [(key, page_text(store.get(key))) for key in sorted(store.keys(), key=lambda key: int(key.split('.')[0]))]
+    st = time.perf_counter()
+    for key, text in texts:
+        signatures[key] = simhash(text)
+    detection = time.perf_counter() - st
+    index = SimHashIndex(3)
+    skipped = {}
+    for key, signature in signatures.items():
+        original = index.check(signature, key)
+        if original is not None:
+            skipped[key] = original
+    store.close()
+    wrong, missed = accuracy(originals, skipped)
+    for key in skipped:
+        os.remove(os.path.join('repository', key))
+    _, process_crawled = timed(process)
+    _, analyze_crawled = timed(analyze)
+    saved = process_all + analyze_all - process_crawled - analyze_crawled
+    print(f'crawl time: {len(skipped)} pages not stored ({wrong} false positives, {missed} missed), '
+          f'signatures {detection:.2f} s, '
+          f'ContentProcessor + Analyze {process_all + analyze_all:.2f} s -> '
+          f'{process_crawled + analyze_crawled:.2f} s ({saved:.2f} s saved)')
+    print(f'duplicates inflate the counts of the 100 most frequent words by {inflation:.1%}')
+
+    rng = random.Random(2)
+    signatures = [rng.getrandbits(64) for _ in range(100000)]
+    queries = []
+    for signature in rng.sample(signatures, 500):
+        queries += [signature ^ (1 << rng.randrange(64)), rng.getrandbits(64)]
+    indexed, linear, agree = lookups(signatures, queries)
+    print(f'lookups among {len(signatures)} signatures: index {indexed * 1e6:.1f} us, '
+          f'linear scan {linear * 1e3:.1f} ms{"" if agree else " (results differ!)"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+'''
+Measures writing the crawl report for a large synthetic repo_files: the table
+    built in memory by string concatenation (as WebCrawler.output did) against
+    CrawlReport streaming it row by row, in html (one file and paginated), csv and jsonl
+Reports seconds and peak traced memory of each
+Run from the repository root: python benchmarks/bench_report.py [pages]
+'''
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from report import CrawlReport
+
+
+def repo_files(pages):
+    return {f'http://host{i % 50}.example.com/articles/{i}/': {'filename': f'{i + 1}.html', 'status': 200,
+                                                               'links': i % 97, 'images': i % 13}
+            for i in range(pages)}
+
+
+def concatenated(files, path):
+    html = '<html><body><table><tr><td>Live URL</td><td>File</td><td>Status</td><td># Links</td><td># Images</td></tr>'
+    for key in files:
+        skey = key.rstrip('/')
+        status = files[key]['status']
+        filename = f'repository/{files[key]["filename"]}'
+        links = files[key]['links']
+        images = files[key]['images']
+        html += f'<tr><td><a href={skey}>{skey}<td><a href={filename}>{key}</a></td><td>{status}</td><td>{links}</td><td>{images}</td></tr>'
+    html += '</table></body></html>'
+    with open(path, 'w') as f:
+        f.write(html)
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    st = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - st
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    files = repo_files(pages)
+    report = CrawlReport(files)
+    os.chdir(tempfile.mkdtemp())
+    print(f'{pages} pages')
+    for name, function, args in (('concatenated html', concatenated, (files, 'old.html')),
+                                 ('streamed html', report.write_html, ('report.html',)),
+                                 ('paginated html', report.write_html, ('paged.html', 10000)),
+                                 ('csv', report.write_csv, ('report.csv',)),
+                                 ('jsonl', report.write_jsonl, ('report.jsonl',))):
+        seconds, peak = measure(function, *args)
+        print(f'{name:18} {seconds:7.2f} s {peak / 2 ** 20:9.1f} MB peak')
+
+
+if __name__ == '__main__':
+    main()
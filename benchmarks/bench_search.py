@@ -0,0 +1,73 @@
+'''
+Query latency and QPS of search.Searcher over a synthetic corpus
+    Pages draw words from a Zipf-like vocabulary; queries mix 1 to 4 words,
+    mostly rare ones with the occasional very common word
+    pruned: MaxScore top-k, exhaustive: every posting scored; both must agree
+Run from the repository root: python benchmarks/bench_search.py [pages] [queries]
+'''
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from indexer import Indexer
+from page_store import open_store
+from search import Searcher
+
+VOCABULARY = 50000
+PAGE_WORDS = 300
+K = 10
+
+
+def build_corpus(path, pages, rng):
+    vocabulary = [f'w{i}' for i in range(VOCABULARY)]
+    weights = [1 / (i + 1) for i in range(VOCABULARY)]
+    store = open_store(os.path.join(path, 'processed'), 'files')
+    for i in range(pages):
+        store.put(f'{i}.html', ' '.join(rng.choices(vocabulary, weights, k=PAGE_WORDS)).encode('utf-8'))
+    store.close()
+
+
+def queries(count, rng):
+    return [' '.join(f'w{min(int(rng.paretovariate(0.5)) - 1, VOCABULARY - 1)}' for _ in range(rng.randint(1, 4)))
+            for _ in range(count)]
+
+
+def run(searcher, batch, prune):
+    latencies, results = [], []
+    for query in batch:
+        st = time.perf_counter()
+        results.append(searcher.search(query, K, prune=prune))
+        latencies.append(time.perf_counter() - st)
+    return np.array(latencies) * 1000, results
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as path:
+        build_corpus(path, pages, rng)
+        st = time.perf_counter()
+        indexer = Indexer(os.path.join(path, 'index'))
+        indexer.index_repository(os.path.join(path, 'processed'), urls={})
+        print(f'{pages} pages indexed in {time.perf_counter() - st:.1f} s: {indexer.stats()}')
+        searcher = Searcher(os.path.join(path, 'index'))
+        batch = queries(count, rng)
+        print(f'{"":12} {"mean ms":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"QPS":>8}')
+        outputs = []
+        for name, prune in (('pruned', True), ('exhaustive', False)):
+            latencies, results = run(searcher, batch, prune)
+            outputs.append([[round(score, 9) for _, score in result] for result in results])
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            print(f'{name:12} {latencies.mean():8.2f} {p50:8.2f} {p95:8.2f} {p99:8.2f} {1000 / latencies.mean():8.0f}')
+        if outputs[0] != outputs[1]:
+            raise AssertionError('pruned and exhaustive results differ')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+'''
+Measures cold start time: each command is run in a fresh interpreter, repeat
+    times, and the median wall time reported with the heavy dependencies it
+    loaded (IPython, matplotlib, bs4, numpy, requests, aiohttp)
+Commands are the imports of the crawler modules and python -m crawler --help
+    and its subcommands' --help; worker cold starts should stay close to the bare
+    interpreter, and a headless crawl should not load IPython or matplotlib
+Run from the repository root: python benchmarks/bench_startup.py [repeat]
+'''
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('IPython', 'matplotlib', 'bs4', 'numpy', 'requests', 'aiohttp')
+PROBE = f'import sys; print(",".join(m for m in {HEAVY!r} if m in sys.modules))'
+COMMANDS = {
+    'python': ['-c', PROBE],
+    'import web_crawler': ['-c', f'import web_crawler; {PROBE}'],
+    'import content_processor': ['-c', f'import content_processor; {PROBE}'],
+    'import analyze': ['-c', f'import analyze; {PROBE}'],
+    'import search': ['-c', f'import search; {PROBE}'],
+    'crawler --help': ['-m', 'crawler', '--help'],
+    'crawler crawl --help': ['-m', 'crawler', 'crawl', '--help'],
+}
+
+
+def run(args, repeat):
+    times = []
+    for _ in range(repeat):
+        st = time.perf_counter()
+        result = subprocess.run([sys.executable] + args, cwd=ROOT, capture_output=True, text=True, check=True)
+        times.append(time.perf_counter() - st)
+    loaded = result.stdout.strip() if args[0] == '-c' else ''
+    return statistics.median(times), loaded
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f'{"command":26} {"median ms":>10}  loaded')
+    for name, args in COMMANDS.items():
+        seconds, loaded = run(args, repeat)
+        print(f'{name:26} {seconds * 1000:10.1f}  {loaded}')
+
+
+if __name__ == '__main__':
+    main()
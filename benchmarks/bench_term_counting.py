@@ -0,0 +1,88 @@
+'''
+Compares term counting of Analyze on a synthetic processed/ corpus
+    legacy: read each file whole and do counter += Counter(words), as before
+    streaming: count_files, reading chunks into one Counter with update
+    sharded: Analyze(workers=...) counting shards in worker processes
+Reports MB/s and the peak Python memory of this process (tracemalloc, measured
+    in a separate run)
+Run from the repository root: python benchmarks/bench_term_counting.py [MB] [workers]
+'''
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analyze import Analyze, count_files
+from page_store import open_store
+
+FILE_SIZE = 256 * 1024
+VOCABULARY = 50000
+
+
+def build_corpus(path, megabytes):
+    rng = random.Random(1)
+    vocabulary = [f'w{i}' for i in range(VOCABULARY)]
+    weights = [1 / (i + 1) for i in range(VOCABULARY)]
+    store = open_store(path, 'files')
+    for i in range(megabytes * 1024 * 1024 // FILE_SIZE):
+        words = rng.choices(vocabulary, weights, k=FILE_SIZE // 7)
+        store.put(f'{i}.html', ' '.join(words).encode('utf-8'))
+    store.close()
+
+
+def legacy(path):
+    store = open_store(path)
+    counter = Counter()
+    for filename in store.keys():
+        text = store.get(filename).decode('utf-8').lower()
+        counter += Counter(re.findall(r'\w+', text))
+    store.close()
+    return counter
+
+
+def streaming(path):
+    store = open_store(path)
+    counter = count_files(store, sorted(store.keys()))
+    store.close()
+    return counter
+
+
+def sharded(path, workers):
+    return Counter(dict(Analyze(path, workers=workers).counter))
+
+
+def run(name, f, *args, megabytes):
+    st = time.perf_counter()
+    counter = f(*args)
+    e = time.perf_counter() - st
+    # a second, traced run: tracing slows allocations down too much to time
+    tracemalloc.start()
+    f(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{name:20} {megabytes / e:8.1f} {peak / 2 ** 20:10.1f}')
+    return counter
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    with tempfile.TemporaryDirectory() as path:
+        build_corpus(path, megabytes)
+        print(f'{megabytes} MB corpus, {workers} workers')
+        print(f'{"":20} {"MB/s":>8} {"peak MB":>10}')
+        expected = run('legacy', legacy, path, megabytes=megabytes)
+        results = [run('streaming', streaming, path, megabytes=megabytes),
+                   run(f'sharded ({workers})', sharded, path, workers, megabytes=megabytes)]
+        if any(counter != expected for counter in results):
+            raise AssertionError('counts differ')
+
+
+if __name__ == '__main__':
+    main()
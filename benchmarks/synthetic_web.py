@@ -0,0 +1,196 @@
+'''
+Local synthetic web for offline crawler benchmarks
+Serves a generated link graph from hosts HTTP servers on 127.0.0.1 (one port each)
+Pages, links, slow and failing responses all derive from seed, so every run
+    serves the same web:
+    /p/<n>        html page n of the host: page_size bytes of words and out_degree
+                  links to random pages of random hosts (a few into /private)
+    /robots.txt   Disallow rules and Crawl-delay (and Sitemap)
+    with sitemaps=True also a sitemap index /sitemap_index.xml of two sitemaps,
+    /sitemap-1.xml.gz (gzipped) and /sitemap-2.xml, listing every page (and a few
+    /private ones) with a lastmod
+    anything else 404
+slow_fraction of the pages answer after slow_delay seconds and error_fraction
+    of them with a 500
+duplicate_fraction of the pages are near duplicates (a print view) of the page
+    before them, with their own links
+With rate_limit, a host answers a page request less than rate_limit seconds after
+    its last one with 429 and Retry-After: retry_after (counted in throttled)
+Usage:
+    with SyntheticWeb(hosts=4, pages=200) as web:
+        WebCrawler(seed=web.seed_url, num_pages=100, domain='')
+'''
+import gzip
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ['the', 'of', 'and', 'crawler', 'page', 'index', 'search', 'web', 'link', 'host', 'query', 'rank',
+         'document', 'term', 'frequency', 'robots', 'delay', 'server', 'graph', 'benchmark']
+
+
+class SyntheticWeb:
+    def __init__(self, hosts=4, pages=200, out_degree=8, page_size=20000, crawl_delay=0.01,
+                 disallow=('/private',), slow_fraction=0.0, slow_delay=0.1, error_fraction=0.0,
+                 duplicate_fraction=0.0, sitemaps=False, rate_limit=None, retry_after=1, seed=1):
+        self.hosts = hosts
+        self.pages = pages
+        self.out_degree = out_degree
+        self.page_size = page_size
+        self.crawl_delay = crawl_delay
+        self.disallow = list(disallow)
+        self.slow_fraction = slow_fraction
+        self.slow_delay = slow_delay
+        self.error_fraction = error_fraction
+        self.duplicate_fraction = duplicate_fraction
+        self.sitemaps = sitemaps
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.last_request = {}
+        self.throttled = 0
+        self.seed = seed
+        self.servers = []
+        self.threads = []
+        self.ports = []
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def seed_url(self):
+        return f'http://127.0.0.1:{self.ports[0]}/p/0'
+
+    def start(self):
+        for host in range(self.hosts):
+            server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler(host))
+            server.daemon_threads = True
+            self.servers.append(server)
+            self.ports.append(server.server_address[1])
+        for server in self.servers:
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def draw(self, host, page, salt):
+        # a deterministic value in [0, 1) per page, independent of request order
+        return zlib.crc32(f'{self.seed}:{host}:{page}:{salt}'.encode()) / 2 ** 32
+
+    def robots(self):
+        lines = ['User-agent: *'] + [f'Disallow: {path}' for path in self.disallow]
+        if self.crawl_delay is not None:
+            lines.append(f'Crawl-delay: {self.crawl_delay}')
+        if self.sitemaps:
+            lines.append('Sitemap: /sitemap_index.xml')
+        return '\n'.join(lines) + '\n'
+
+    def lastmod(self, host, page):
+        day = int(self.draw(host, page, 'lastmod') * 365)
+        return f'2024-{day // 28 % 12 + 1:02d}-{day % 28 + 1:02d}'
+
+    def sitemap_index(self, host):
+        base = f'http://127.0.0.1:{self.ports[host]}'
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                f'<sitemap><loc>{base}/sitemap-1.xml.gz</loc></sitemap>'
+                f'<sitemap><loc>{base}/sitemap-2.xml</loc><lastmod>2024-01-01</lastmod></sitemap>'
+                '</sitemapindex>').encode('utf-8')
+
+    def sitemap(self, host, number):
+        '''
+        Sitemap number (1 or 2) of host: half of its pages each, and a /private url
+        '''
+        base = f'http://127.0.0.1:{self.ports[host]}'
+        half = self.pages // 2
+        pages = range(half) if number == 1 else range(half, self.pages)
+        entries = [f'<url><loc>{base}/p/{page}</loc><lastmod>{self.lastmod(host, page)}</lastmod></url>'
+                   for page in pages]
+        entries.append(f'<url><loc>{base}/private/{number}</loc></url>')
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                f'{"".join(entries)}</urlset>').encode('utf-8')
+
+    def page(self, host, page):
+        rng = random.Random(f'{self.seed}:{host}:{page}')
+        links = []
+        for _ in range(self.out_degree):
+            target = rng.randrange(self.hosts)
+            path = '/private/x' if rng.random() < 0.05 else f'/p/{rng.randrange(self.pages)}'
+            links.append(f'<a href="http://127.0.0.1:{self.ports[target]}{path}">link</a>')
+        source = page
+        while source > 0 and self.draw(host, source, 'duplicate') < self.duplicate_fraction:
+            source -= 1
+        text_rng = random.Random(f'{self.seed}:{host}:{source}:text')
+        words = []
+        size = 0
+        while size < self.page_size:
+            word = text_rng.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+        heading = f'Page {source}' if source == page else f'Printable version of page {source}'
+        return (f'<html><head><title>Page {host}/{page}</title></head><body><div id="content">'
+                f'<h1>{heading}</h1><p>{" ".join(words)}</p>{"".join(links)}<img src="/i.png">'
+                f'</div></body></html>').encode('utf-8')
+
+    def handler(self, host):
+        web = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def send(self, status, body=b'', content_type='text/html; charset=utf-8', headers=()):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with web.lock:
+                    web.requests += 1
+                path = self.path.split('?')[0]
+                if path == '/robots.txt':
+                    return self.send(200, web.robots().encode('utf-8'), 'text/plain')
+                if web.sitemaps and path == '/sitemap_index.xml':
+                    return self.send(200, web.sitemap_index(host), 'application/xml')
+                if web.sitemaps and path == '/sitemap-1.xml.gz':
+                    return self.send(200, gzip.compress(web.sitemap(host, 1)), 'application/x-gzip')
+                if web.sitemaps and path == '/sitemap-2.xml':
+                    return self.send(200, web.sitemap(host, 2), 'application/xml')
+                if not path.startswith('/p/') or not path[3:].isdigit() or int(path[3:]) >= web.pages:
+                    return self.send(404)
+                page = int(path[3:])
+                if web.rate_limit is not None:
+                    with web.lock:
+                        now = time.monotonic()
+                        limited = now - web.last_request.get(host, float('-inf')) < web.rate_limit
+                        web.last_request[host] = now
+                        web.throttled += limited
+                    if limited:
+                        return self.send(429, headers=[('Retry-After', str(web.retry_after))])
+                # the seed page always answers at once
+                if (host, page) != (0, 0):
+                    if web.draw(host, page, 'slow') < web.slow_fraction:
+                        time.sleep(web.slow_delay)
+                    if web.draw(host, page, 'error') < web.error_fraction:
+                        return self.send(500)
+                self.send(200, web.page(host, page))
+
+        return Handler
@@ -0,0 +1,85 @@
+import threading
+
+
+class AtomicInt:
+    '''
+    Integer updated atomically by the threads of a process or, made with
+        shared(), by many processes (a multiprocessing Value)
+    '''
+    def __init__(self, value=0, shared=None):
+        if shared is None:
+            self.cell = [value]
+            self.lock = threading.Lock()
+        else:
+            self.cell = shared
+            self.lock = shared.get_lock()
+
+    @classmethod
+    def shared(cls, value, context):
+        return cls(shared=context.Array('q', [value]))
+
+    def add(self, n=1):
+        '''
+        Adds n and returns the new value
+        '''
+        with self.lock:
+            self.cell[0] += n
+            return self.cell[0]
+
+    @property
+    def value(self):
+        return self.cell[0]
+
+
+class PageBudget:
+    '''
+    The num_pages budget of a crawl, shared by its threads or, made with
+        shared(), its processes
+    A fetch first reserves a page with reserve(); a stored page is then
+        commit()ted and a page that was not stored release()d
+    While the pages stored and the pages being fetched make up the limit,
+        reserve() waits for a fetch to end, and fails once limit pages are stored
+    So concurrent fetches never store more than limit pages, and no url is
+        skipped while a fetch that may still fail holds the last pages
+    '''
+    def __init__(self, limit, used=0, shared=None, condition=None):
+        self.limit = limit
+        if shared is None:
+            # pages stored, pages reserved
+            self.counts = [used, 0]
+            self.condition = threading.Condition()
+        else:
+            self.counts = shared
+            self.condition = condition
+
+    @classmethod
+    def shared(cls, limit, used, context):
+        counts = context.Array('q', [used, 0])
+        return cls(limit, shared=counts, condition=context.Condition(counts.get_lock()))
+
+    def reserve(self):
+        with self.condition:
+            while self.counts[0] + self.counts[1] >= self.limit:
+                if self.counts[0] >= self.limit:
+                    return False
+                self.condition.wait()
+            self.counts[1] += 1
+            return True
+
+    def commit(self):
+        with self.condition:
+            self.counts[1] -= 1
+            self.counts[0] += 1
+            self.condition.notify_all()
+
+    def release(self):
+        with self.condition:
+            self.counts[1] -= 1
+            self.condition.notify_all()
+
+    @property
+    def used(self):
+        return self.counts[0]
+
+    def exhausted(self):
+        return self.counts[0] >= self.limit
@@ -0,0 +1,176 @@
+import itertools
+import json
+import os
+import sqlite3
+from array import array
+
+
+class CrawlCheckpoint:
+    '''
+    SQLite checkpoint of a crawl's state:
+        repo_files metadata and file_count, the frontier (including urls taken
+        from it but not crawled yet), the seen fingerprints, near duplicates,
+        visited robots and the robots cache
+    Each save is a single transaction, so a crash leaves the previous checkpoint intact
+    Saves only write what changed since the last save: repo_files and duplicates
+        added, urls queued and popped (from the frontier's journal) and new seen
+        fingerprints, appended as one blob per save
+    Only the urls taken from the frontier but not crawled yet, at most a batch,
+        are rewritten each time
+    A recrawl keeps the last crawl's repo_files as previous files until it ends,
+        so an interrupted recrawl does not lose them
+    '''
+    def __init__(self, path='crawl_state.sqlite'):
+        self.path = path
+        self.conn = None
+        self.saved_files = 0
+        self.saved_duplicates = 0
+        self.frontier = None  # the frontier whose journal holds the changes since the last save
+
+    def connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            with self.conn:
+                self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+                self.conn.execute('CREATE TABLE IF NOT EXISTS files (seq INTEGER PRIMARY KEY, url TEXT UNIQUE, data TEXT)')
+                self.conn.execute('CREATE TABLE IF NOT EXISTS previous (seq INTEGER PRIMARY KEY, url TEXT UNIQUE, data TEXT)')
+                self.conn.execute('CREATE TABLE IF NOT EXISTS duplicates (url TEXT PRIMARY KEY, original TEXT)')
+                self.conn.execute('CREATE TABLE IF NOT EXISTS queued (url TEXT PRIMARY KEY, priority INTEGER)')
+                self.conn.execute('CREATE TABLE IF NOT EXISTS taken (url TEXT, priority INTEGER)')
+                self.conn.execute('CREATE TABLE IF NOT EXISTS seen (seq INTEGER PRIMARY KEY, data BLOB)')
+        return self.conn
+
+    def exists(self):
+        if not os.path.isfile(self.path):
+            return False
+        return self.connect().execute("SELECT 1 FROM meta WHERE key = 'file_count'").fetchone() is not None
+
+    def reset(self, frontier=None, previous=False):
+        '''
+        Clears the checkpoint for a fresh crawl
+        With previous=True (a recrawl) the checkpointed repo_files are added to the
+            previous files (see load_previous) instead, until clear_previous()
+        frontier, if given and still empty, is journaled from now on, so the first
+            save does not have to write all of it
+        '''
+        conn = self.connect()
+        with conn:
+            if previous:
+                conn.execute('INSERT OR REPLACE INTO previous (url, data) SELECT url, data FROM files ORDER BY seq')
+            else:
+                conn.execute('DELETE FROM previous')
+            for table in ('meta', 'files', 'duplicates', 'queued', 'taken', 'seen'):
+                conn.execute(f'DELETE FROM {table}')
+        self.saved_files = self.saved_duplicates = 0
+        self.frontier = None
+        if frontier is not None and not frontier and not frontier.seen:
+            frontier.start_journal()
+            self.frontier = frontier
+
+    def save(self, crawler, changes=None):
+        '''
+        Persists the crawler's state; callers must hold crawler.lock
+        The first save of a frontier writes all of it, later saves its journal
+        changes, if given, are frontier changes journaled elsewhere (e.g. by the
+            workers of process_engine), applied after the crawler's own
+        '''
+        conn = self.connect()
+        frontier = crawler.frontier
+        full = frontier is not self.frontier
+        if full:
+            own, seen = dict(frontier.pending()), list(frontier.seen)
+            frontier.start_journal()
+            self.frontier = frontier
+        else:
+            own, seen = frontier.take_journal()
+        meta = {
+            # file_count also counts the pages being written, which a resume crawls again
+            'file_count': str(len(crawler.repo_files)),
+            'file_number': str(crawler.file_number),
+            'seed': crawler.seed,
+            'num_pages': str(crawler.num_pages),
+            'domain': crawler.domain,
+            'visited_robots': json.dumps(sorted(crawler.visited_robots)),
+            'robots': json.dumps(crawler.robots.dump()),
+        }
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO files (url, data) VALUES (?, ?)',
+                             ((url, json.dumps(entry)) for url, entry in
+                              itertools.islice(crawler.repo_files.items(), self.saved_files, None)))
+            conn.executemany('INSERT OR REPLACE INTO duplicates (url, original) VALUES (?, ?)',
+                             itertools.islice(crawler.duplicates.items(), self.saved_duplicates, None))
+            if full:
+                conn.execute('DELETE FROM queued')
+                conn.execute('DELETE FROM seen')
+            self.write_frontier(conn, own, seen)
+            if changes:
+                self.write_frontier(conn, changes, ())
+            conn.execute('DELETE FROM taken')
+            conn.executemany('INSERT INTO taken (url, priority) VALUES (?, ?)', crawler.unprocessed_urls())
+            conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', meta.items())
+        self.saved_files = len(crawler.repo_files)
+        self.saved_duplicates = len(crawler.duplicates)
+
+    def write_frontier(self, conn, changes, seen):
+        '''
+        Applies frontier changes ({url: priority, or None if popped}) and appends
+            the new seen fingerprints
+        '''
+        conn.executemany('DELETE FROM queued WHERE url = ?',
+                         ((url,) for url, priority in changes.items() if priority is None))
+        conn.executemany('INSERT OR REPLACE INTO queued (url, priority) VALUES (?, ?)',
+                         ((url, priority) for url, priority in changes.items() if priority is not None))
+        if seen:
+            conn.execute('INSERT INTO seen (data) VALUES (?)', (sqlite3.Binary(array('Q', seen).tobytes()),))
+
+    def load_files(self, table='files'):
+        '''
+        Returns the checkpointed repo_files, in the order they were added
+        '''
+        conn = self.connect()
+        return {url: json.loads(data) for url, data in conn.execute(f'SELECT url, data FROM {table} ORDER BY seq')}
+
+    def load_previous(self):
+        '''
+        Returns the repo_files of the crawl before the current recrawl
+        '''
+        return self.load_files('previous')
+
+    def clear_previous(self):
+        conn = self.connect()
+        with conn:
+            conn.execute('DELETE FROM previous')
+
+    def load(self, crawler):
+        '''
+        Restores the crawler's state from the last save
+        '''
+        conn = self.connect()
+        meta = dict(conn.execute('SELECT key, value FROM meta'))
+        crawler.repo_files = self.load_files()
+        crawler.previous_files = self.load_previous()
+        crawler.file_count = int(meta['file_count'])
+        crawler.file_number = int(meta['file_number'])
+        crawler.visited_robots = set(json.loads(meta['visited_robots']))
+        crawler.robots.restore(json.loads(meta['robots']))
+        crawler.duplicates = dict(conn.execute('SELECT url, original FROM duplicates ORDER BY rowid'))
+        for (data,) in conn.execute('SELECT data FROM seen ORDER BY seq'):
+            seen = array('Q')
+            seen.frombytes(data)
+            for fp in seen:
+                crawler.frontier.seen.add(fp)
+        taken = conn.execute('SELECT url, priority FROM taken').fetchall()
+        for url, priority in itertools.chain(conn.execute('SELECT url, priority FROM queued ORDER BY rowid'), taken):
+            crawler.frontier.requeue(url, priority)
+        crawler.frontier.start_journal()
+        # taken urls are queued again, so the next save moves them to the queued table
+        crawler.frontier.journal.update(taken)
+        self.frontier = crawler.frontier
+        self.saved_files = len(crawler.repo_files)
+        self.saved_duplicates = len(crawler.duplicates)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -1,57 +1,150 @@
-from bs4 import BeautifulSoup
-import os
-import shutil
+from bs4 import BeautifulSoup, NavigableString, Tag
 import re
-from random import random
-
-def tags_below_index(lst, x):
-    cur_x = 0
-    count = 0
-    while cur_x < x:
-        count += lst[cur_x]
-    return count
-
-def tags_above_index(lst, x):
-    cur_x = x + 1
-    count = 0
-    while cur_x < len(lst):
-        count += lst[cur_x]
-    return count
-
-def non_tags_between_index(lst, i, j):
-    cur_x = i + 1
-    count = 0
-    while cur_x < j:
-        count += 1 - lst[cur_x]
-    return count
-
-def lst_score(lst, i, j):
-    return tags_below_index(lst, i) + non_tags_between_index(lst, i, j) + tags_above_index(lst, j)
-
-def neighbor(lst, i, j):
-    # find randomized neighbor
-    max_move_dist = round(len(lst) * .20)
-    new_i += i + (2*max_move_dist*random()) - max_move_dist
-    new_j += j + (2*max_move_dist*random()) - max_move_dist
-    if new_i < 0:
-        new_i = 0
-    if new_j >= len(lst):
-        new_j = len(lst) - 1
-    if new_i >= new_j and new_j > 0:
-        new_i = new_j - 1
-    else:
-        new_i = 0
-        new_j = 1
-    return new_i, new_j
+import time
+from concurrent.futures import ProcessPoolExecutor
+from page_store import open_store
+from near_duplicates import SimHashIndex, simhash
+import numpy as np
+
+def tag_prefix_sums(tokens):
+    '''
+    Prefix sums of a token sequence (1 for a tag, 0 for a word):
+        P[k] is the number of tags among the first k tokens
+    '''
+    if isinstance(tokens, (bytes, bytearray)):
+        tokens = np.frombuffer(tokens, dtype=np.uint8)
+    prefix = np.zeros(len(tokens) + 1, dtype=np.int64)
+    np.cumsum(tokens, out=prefix[1:])
+    return prefix
+
+def window_score(prefix, i, j):
+    '''
+    Body text extraction score of keeping tokens i..j (inclusive) in O(1):
+        tags before i + words from i to j + tags after j
+    '''
+    n = len(prefix) - 1
+    return prefix[i] + (j + 1 - i) - (prefix[j + 1] - prefix[i]) + (prefix[n] - prefix[j + 1])
+
+def best_window(tokens):
+    '''
+    Finds the window i..j maximizing window_score exactly (Body Text Extraction,
+        Finn et al.), for a token sequence of 1 for a tag and 0 for a word
+    window_score(i, j) = (2 P[i] - i) + (j + 1 - 2 P[j + 1]) + P[n], so for each j
+        the best i <= j is a running maximum and the scan is O(n) NumPy operations
+    Returns (i, j, score); an empty sequence gives (0, -1, 0)
+    '''
+    prefix = tag_prefix_sums(tokens)
+    n = len(prefix) - 1
+    if n == 0:
+        return 0, -1, 0
+    positions = np.arange(n + 1)
+    starts = 2 * prefix[:-1] - positions[:-1]
+    ends = positions[1:] - 2 * prefix[1:]
+    scores = np.maximum.accumulate(starts) + ends
+    j = int(np.argmax(scores))
+    i = int(np.argmax(starts[:j + 1]))
+    return i, j, int(scores[j] + prefix[n])
+
+tags_blacklist = {'script','nav','aside','video','footer','form','input','noscript'}
+link_tags = {'a','img'}
+link_attrs = {'id','src','href'}
+content_div_id = re.compile(".*(content|main).*")
+preserve_whitespace_tags = {'pre','textarea'}
+
+worker_processor = None
+worker_store = None
+
+def init_worker(processor, src_repo):
+    '''
+    Runs once in each worker process: keeps a processor and an open source store
+    '''
+    global worker_processor, worker_store
+    worker_processor = processor
+    worker_store = open_store(src_repo)
+
+def clean_worker(fname):
+    '''
+    Cleans one file in a worker process
+    Returns (fname, cleaned html, text, signature, error)
+    '''
+    try:
+        html, text = worker_processor.clean_file(worker_store.get(fname))
+        return fname, html, text, worker_processor.signature(text), None
+    except Exception as e:
+        return fname, None, None, None, f'{type(e).__name__}: {e}'
 
 class ContentProcessor:
+    '''
+    Cleans the pages of the src_repo page store, writing cleaned html to
+        html_processed and text to processed
+    The processed stores use the backend of src_repo unless dst_backend is given
+    With workers > 1 files are cleaned in a pool of worker processes, sent to
+        them in chunks of chunksize (by default about 4 chunks per worker);
+        outputs are written by this process in file order, so they do not
+        depend on the number of workers
+    After processing, errors maps each file that failed to its error and
+        pages_per_sec is the throughput
+    parser is the BeautifulSoup parser pages are parsed with, e.g. 'html.parser' or 'lxml'
+    extractor picks how the main content of a page is found:
+        'div' keeps the content/main div and drops its div siblings (remove_div_extra),
+        'bte' keeps the text window with the best body text extraction score (best_window)
+    With near_duplicates set to a number of bits, a file whose cleaned text SimHash
+        is within that Hamming distance of an earlier file's (in file order, among
+        the files of the same process_repository call) is not written;
+        duplicates maps it to that file and dedup_rate is the fraction skipped
+    '''
+
+    def __init__(self, workers=1, chunksize=None, parser='html.parser', extractor='div', near_duplicates=None):
+        if extractor not in ('div', 'bte'):
+            raise ValueError(f'unknown extractor {extractor}')
+        self.workers = workers
+        self.chunksize = chunksize
+        self.parser = parser
+        self.extractor = extractor
+        self.near_duplicates = near_duplicates
+        self.errors = {}
+        self.duplicates = {}
+        self.dedup_rate = 0.0
+        self.pages_per_sec = 0.0
 
-    def process_repository(self, src_repo='repository'):
+    def process_repository(self, src_repo='repository', files=None, dst_backend=None):
+        '''
+        Cleans every file in src_repo into html_processed and processed
+        If files is given (e.g. WebCrawler.changed_files() after a recrawl), only
+            those files are cleaned again and other processed files are kept
+        '''
+        st = time.time()
         self.src_repo = src_repo
-        self.initialize_dst_repo()
-        self.initialize_dst_html_repo()
-        for file in os.listdir(self.src_repo):
-            self.process_file(os.path.join(self.src_repo, file), file)
+        self.src = open_store(src_repo)
+        backend = dst_backend or self.src.backend
+        self.html_dst = open_store('html_processed', backend)
+        self.dst = open_store('processed', backend)
+        if files is None:
+            self.initialize_dst_repo()
+            self.initialize_dst_html_repo()
+            files = self.src.keys()
+        files = sorted(files)
+        self.errors = {}
+        self.duplicates = {}
+        self.near_index = SimHashIndex(self.near_duplicates) if self.near_duplicates is not None else None
+        if self.workers > 1 and len(files) > 1:
+            chunksize = self.chunksize or max(1, len(files) // (self.workers * 4))
+            with ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(self, src_repo)) as pool:
+                for fname, html, text, signature, error in pool.map(clean_worker, files, chunksize=chunksize):
+                    self.write_file(fname, html, text, error, signature)
+        else:
+            for file in files:
+                self.process_file(file)
+        for store in (self.src, self.html_dst, self.dst):
+            store.close()
+        e = time.time() - st
+        self.pages_per_sec = len(files) / e if e else 0.0
+        self.dedup_rate = len(self.duplicates) / len(files) if files else 0.0
+
+    def __getstate__(self):
+        # open stores stay in the parent process
+        return {key: value for key, value in self.__dict__.items()
+                if key not in ('src', 'html_dst', 'dst', 'near_index')}
 
     def remove_attrs(self, soup):
         whitelist = ['a','img']
@@ -92,29 +185,206 @@ class ContentProcessor:
 
         return soup
 
-    def process_file(self, filename, fname):
-        with open(filename, 'r') as f:
-            # f = open(filename) # file never gets closed otherwise
-            soup = BeautifulSoup(f, 'html.parser')
-            new_content = self.clean_html(soup)
+    def process_file(self, fname):
+        try:
+            html, text = self.clean_file(self.src.get(fname))
+        except Exception as e:
+            self.write_file(fname, None, None, f'{type(e).__name__}: {e}')
+        else:
+            self.write_file(fname, html, text, signature=self.signature(text))
 
-            with open (os.path.join('html_processed', fname), 'w') as f2:
-                f2.write(str(new_content))
+    def signature(self, text):
+        '''
+        SimHash of a cleaned text for near duplicate detection, None if it is off
+        '''
+        return simhash(text) if self.near_duplicates is not None else None
+
+    def clean_file(self, content):
+        '''
+        Cleans the bytes of one page
+        Returns (cleaned html, text)
+        '''
+        soup = BeautifulSoup(content.decode('utf-8', 'replace'), self.parser)
+        new_content = self.clean_html(soup)
 
-            clean_content = ''
-            for string_soup in new_content.stripped_strings:
-                clean_content += string_soup + " "
-            with open (os.path.join('processed', fname), 'w') as f3:
-                f3.write(clean_content)
+        clean_content = ''
+        for string_soup in new_content.stripped_strings:
+            clean_content += string_soup + " "
+        return str(new_content), clean_content
+
+    def write_file(self, fname, html, text, error=None, signature=None):
+        '''
+        Writes one file's outputs, or records its error or that it is a near duplicate
+        '''
+        if error is not None:
+            self.errors[fname] = error
+            return
+        if self.near_index is not None and signature is not None:
+            original = self.near_index.check(signature, fname)
+            if original is not None:
+                self.duplicates[fname] = original
+                return
+        self.html_dst.put(fname, html.encode('utf-8'))
+        self.dst.put(fname, text.encode('utf-8'))
 
     def clean_html(self, soup):
+        '''
+        Cleans a parsed page in a single traversal of its body:
+            blacklisted tags are dropped, attributes not in the whitelist removed and
+            the div siblings of the content div pruned, as remove_tags, remove_attrs
+            and remove_div_extra do over several passes (see clean_html_multipass)
+        With the 'bte' extractor the content div is not used; extract_window then
+            keeps the best text window instead
+        Returns a document holding only the cleaned title and body
+        '''
+        title, body = soup.title, soup.body
+        new_body = BeautifulSoup('', self.parser)
+        head = root = new_body
+        if self.parser != 'html.parser':
+            # other parsers wrap a document in html and head tags
+            root = new_body.new_tag('html')
+            head = new_body.new_tag('head')
+            root.append(head)
+            new_body.append(root)
+        if title is not None:
+            self.filter_attrs(title)
+            head.append(title.extract())
+        if body is not None:
+            self.clean_tree(body, prune_divs=self.extractor == 'div')
+            if self.extractor == 'bte':
+                self.extract_window(body)
+            root.append(body.extract())
+        return new_body
 
+    def filter_attrs(self, tag):
+        keep = link_attrs if tag.name in link_tags else ('id',)
+        for attr in [attr for attr in tag.attrs if attr not in keep]:
+            del tag.attrs[attr]
+
+    def clean_tree(self, root, prune_divs=True):
+        '''
+        Drops blacklisted tags and filters attributes in one traversal of root
+        Divs with the id delete and, with prune_divs, the div siblings of the first
+            content div are removed once the traversal is done: the multipass cleaner
+            removes them after parsing the page again, so the strings around them stay apart
+        '''
+        self.filter_attrs(root)
+        content_div = None if prune_divs else root
+        merged, pruned, skipped = [], [], set()
+        self.merge_adjacent(root, merged)
+        stack = [child for child in reversed(root.contents) if isinstance(child, Tag)]
+        while stack:
+            tag = stack.pop()
+            if id(tag) in skipped:
+                # a content div sibling, pruned without cleaning it
+                continue
+            if tag.name in tags_blacklist:
+                previous, following = tag.previous_sibling, tag.next_sibling
+                tag.decompose()
+                if type(previous) is NavigableString and type(following) is NavigableString:
+                    self.merge_strings(previous, following, merged)
+                continue
+            self.filter_attrs(tag)
+            if tag.name == 'div':
+                if tag.get('id') == 'delete':
+                    # still searched, a content div found inside it is used as in the multipass cleaner
+                    pruned.append(tag)
+                elif content_div is None and content_div_id.search(tag.get('id', '')):
+                    content_div = tag
+                    pruned.extend(sibling for sibling in tag.previous_siblings if sibling.name == 'div')
+                    following = [sibling for sibling in tag.next_siblings if sibling.name == 'div']
+                    pruned.extend(following)
+                    skipped.update(id(sibling) for sibling in following)
+            self.merge_adjacent(tag, merged)
+            stack.extend(child for child in reversed(tag.contents) if isinstance(child, Tag))
+        self.collapse_whitespace(merged)
+        for tag in pruned:
+            if tag.parent is not None:
+                tag.decompose()
+
+    def tokenize(self, root):
+        '''
+        Tokenizes the tree under root for body text extraction: every start and
+            end tag is a tag token (1) and every word of text a word token (0)
+        Returns (tokens, strings, tags) where tokens is a bytearray, strings holds (string, first token, word count)
+            and tags holds (tag, start token) in document order
+        '''
+        tokens, strings, tags = bytearray(), [], []
+        stack = [(child, False) for child in reversed(root.contents)]
+        while stack:
+            node, closing = stack.pop()
+            if closing:
+                tokens.append(1)
+            elif isinstance(node, Tag):
+                tags.append((node, len(tokens)))
+                tokens.append(1)
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node.contents))
+            else:
+                words = node.split() if type(node) is NavigableString else []
+                strings.append((node, len(tokens), len(words)))
+                tokens.extend(bytes(len(words)))
+        return tokens, strings, tags
+
+    def extract_window(self, root):
+        '''
+        Keeps only the text of the best body text extraction window under root
+        Strings outside the window are removed and strings crossing its edges cut
+            to the words inside; tags outside the window are removed once empty
+        '''
+        tokens, strings, tags = self.tokenize(root)
+        i, j, _ = best_window(tokens)
+        for string, start, count in strings:
+            end = start + count - 1
+            if start > j or end < i or (count == 0 and not i <= start <= j):
+                string.extract()
+            elif start < i or end > j:
+                words = string.split()[max(i - start, 0):j - start + 1]
+                string.replace_with(NavigableString(' '.join(words)))
+        for tag, start in reversed(tags):
+            if not i <= start <= j and not tag.contents:
+                tag.decompose()
+
+    def merge_adjacent(self, tag, merged):
+        '''
+        Joins the strings of tag that are next to each other, as parsing the cleaned
+            html again would: the parser splits text at tags it ignores
+        '''
+        contents = tag.contents
+        for i in range(len(contents) - 1, 0, -1):
+            if type(contents[i]) is NavigableString and type(contents[i - 1]) is NavigableString:
+                self.merge_strings(contents[i - 1], contents[i], merged)
+
+    def merge_strings(self, previous, following, merged):
+        '''
+        Joins two strings left next to each other, adding the result to merged
+        '''
+        joined = NavigableString(previous + following)
+        previous.replace_with(joined)
+        following.extract()
+        merged.append(joined)
+
+    def collapse_whitespace(self, merged):
+        '''
+        Collapses the joined strings holding only whitespace to a newline or a space,
+            as the parser does, once no more strings are joined to them
+        '''
+        for string in merged:
+            if string.parent is not None and not string.strip(' \n\t\x0c\r') and not any(
+                    parent.name in preserve_whitespace_tags for parent in string.parents):
+                string.replace_with(NavigableString('\n' if '\n' in string else ' '))
+
+    def clean_html_multipass(self, soup):
+        '''
+        The original cleaner: remove_attrs and remove_tags over the whole page,
+            then title and body are serialized and parsed again for remove_div_extra
+        '''
         new_body = ""
         soup = self.remove_attrs(soup)
         soup = self.remove_tags(soup)
         new_body += str(soup.title)
         new_body += str(soup.body)
-        new_body = BeautifulSoup(new_body)
+        new_body = BeautifulSoup(new_body, self.parser)
         new_body = self.remove_div_extra(new_body)
 
         return new_body
@@ -125,9 +395,7 @@ class ContentProcessor:
         Creates repository
         '''
         self.dst_repo = 'processed'
-        if os.path.isdir(self.dst_repo):
-            shutil.rmtree(self.dst_repo)
-        os.mkdir(self.dst_repo)
+        self.dst.reset()
 
     def initialize_dst_html_repo(self):
         '''
@@ -135,6 +403,4 @@ class ContentProcessor:
         Creates repository
         '''
         self.dst_repo = 'html_processed'
-        if os.path.isdir(self.dst_repo):
-            shutil.rmtree(self.dst_repo)
-        os.mkdir(self.dst_repo)
+        self.html_dst.reset()
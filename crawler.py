@@ -0,0 +1,119 @@
+'''
+Command line entry point for headless runs:
+    python -m crawler crawl specification.csv        crawl with a csv specification
+    python -m crawler crawl --seed URL --pages N     or with arguments
+    python -m crawler process                        clean repository into processed
+    python -m crawler analyze                        word statistics of processed
+Each subcommand imports only the modules it needs when it runs, so starting the
+    command (and --help) does not load requests, BeautifulSoup, numpy, IPython
+    or matplotlib; crawl never displays through IPython and analyze only loads
+    matplotlib with --plot
+'''
+import argparse
+import sys
+
+
+def crawl(args):
+    from report import CrawlReport
+    from web_crawler import WebCrawler
+
+    if not args.specification and not args.seed:
+        raise SystemExit('crawl needs a specification csv or --seed')
+    options = {'engine': args.engine, 'workers': args.workers, 'max_in_flight': args.max_in_flight,
+               'resume': args.resume, 'recrawl': args.recrawl, 'repo_backend': args.repo_backend,
+               'near_duplicates': args.near_duplicates, 'sitemap_urls': args.sitemap_urls,
+               'checkpoint': args.checkpoint or None, 'robots_cache': args.robots_cache or None,
+               'metrics': args.metrics or None, 'report': args.report, 'report_formats': args.report_formats.split(','),
+               'report_page_size': args.report_page_size, 'display_rows': 0}
+    if args.specification:
+        crawler = WebCrawler(args.specification, **options)
+    else:
+        crawler = WebCrawler(seed=args.seed, num_pages=args.pages, domain=args.domain or '', **options)
+    summary = CrawlReport(crawler.repo_files, crawler.repo).summary()
+    statuses = ', '.join(f'{status}: {count}' for status, count in sorted(summary['statuses'].items(), key=str))
+    print(f'{summary["pages"]} pages ({statuses}), {summary["links"]} links, {summary["images"]} images')
+    if crawler.duplicates:
+        print(f'{len(crawler.duplicates)} near duplicates not stored')
+
+
+def process(args):
+    from content_processor import ContentProcessor
+
+    processor = ContentProcessor(workers=args.workers, parser=args.parser, extractor=args.extractor,
+                                 near_duplicates=args.near_duplicates)
+    processor.process_repository(args.repo)
+    print(f'{processor.pages_per_sec:.1f} pages/sec, {len(processor.errors)} errors, '
+          f'{len(processor.duplicates)} near duplicates')
+    for fname, error in sorted(processor.errors.items()):
+        print(f'{fname}: {error}', file=sys.stderr)
+
+
+def analyze(args):
+    from analyze import Analyze
+
+    analysis = Analyze(args.repo, workers=args.workers, cache=args.cache or None)
+    b, m = analysis.fit
+    print(f'N = {analysis.total_words}, {len(analysis.frequencies)} distinct words, '
+          f'Zipf fit log(frequency) = {b:.3f} {m:+.3f} log(rank)')
+    print(f'{"word":20} {"rank":>6} {"frequency":>10} {"rPr":>7}')
+    for word, rank, frequency, probability in list(zip(analysis.most_frequent_words, analysis.ranks.tolist(),
+                                                       analysis.frequencies.tolist(),
+                                                       analysis.probabilities.tolist()))[:args.top]:
+        print(f'{word:20} {rank:6} {frequency:10} {probability:7.4f}')
+    if args.plot:
+        import matplotlib
+        matplotlib.use('Agg')
+        analysis.plot_graph(args.title, path=args.plot)
+
+
+def parser():
+    parser = argparse.ArgumentParser(prog='python -m crawler', description='Crawl, process and analyze pages')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('crawl', help='crawl pages into the repository')
+    command.add_argument('specification', nargs='?', help='csv file: seed,num_pages[,domain]')
+    command.add_argument('--seed')
+    command.add_argument('--pages', type=int, default=100)
+    command.add_argument('--domain', help='only crawl urls of this domain')
+    command.add_argument('--engine', choices=('serial', 'threaded', 'async', 'processes'), default='serial')
+    command.add_argument('--workers', type=int, help='worker processes of the processes engine')
+    command.add_argument('--max-in-flight', type=int, default=1000, help='open requests of the async engine')
+    command.add_argument('--resume', action='store_true', help='continue from the last checkpoint')
+    command.add_argument('--recrawl', action='store_true', help='refresh the pages of the last crawl')
+    command.add_argument('--repo-backend', choices=('files', 'segments'))
+    command.add_argument('--near-duplicates', type=int, help='SimHash distance of pages not stored')
+    command.add_argument('--sitemap-urls', type=int, default=0, help='urls seeded from each host\'s sitemaps')
+    command.add_argument('--checkpoint', default='crawl_state.sqlite', help='crawl state database, empty for none')
+    command.add_argument('--robots-cache', default='robots_cache.json', help='robots.txt cache, empty for none')
+    command.add_argument('--metrics', default='crawl_metrics.json', help='metrics file, empty for none')
+    command.add_argument('--report', default='report.html')
+    command.add_argument('--report-formats', default='html', help='comma separated: html, csv, jsonl')
+    command.add_argument('--report-page-size', type=int, help='rows per html report page')
+    command.set_defaults(run=crawl)
+
+    command = commands.add_parser('process', help='clean the repository into processed')
+    command.add_argument('--repo', default='repository')
+    command.add_argument('--workers', type=int, default=1)
+    command.add_argument('--parser', default='html.parser', help='BeautifulSoup parser, e.g. lxml')
+    command.add_argument('--extractor', choices=('div', 'bte'), default='div')
+    command.add_argument('--near-duplicates', type=int, help='SimHash distance of files not written')
+    command.set_defaults(run=process)
+
+    command = commands.add_parser('analyze', help='word statistics of processed')
+    command.add_argument('--repo', default='processed')
+    command.add_argument('--workers', type=int, default=1)
+    command.add_argument('--cache', default='analysis_stats.npz', help='statistics cache, empty for none')
+    command.add_argument('--top', type=int, default=20, help='most frequent words printed')
+    command.add_argument('--plot', help='save the Zipf plot to this file')
+    command.add_argument('--title', default="Zipf's law")
+    command.set_defaults(run=analyze)
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+import hashlib
+import heapq
+import itertools
+from array import array
+from collections import deque
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    '''
+    Canonical form of url used for dedup:
+        lowercase scheme and host, no default port, no fragment,
+        query parameters sorted, empty path becomes /
+    Query parameters are sorted as written, without decoding them again, so a
+        bare ?flag stays as it is
+    '''
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if ':' in host:
+        # an IPv6 literal, which hostname returns without its brackets
+        host = f'[{host}]'
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port is None or DEFAULT_PORTS.get(scheme) == port else f'{host}:{port}'
+    if parts.username or parts.password:
+        auth = parts.username or ''
+        if parts.password:
+            auth += f':{parts.password}'
+        netloc = f'{auth}@{netloc}'
+    pairs = [pair for pair in parts.query.split('&') if pair]
+    query = '&'.join(sorted(pairs, key=lambda pair: pair.partition('=')[::2]))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def fingerprint(url):
+    '''
+    64 bit fingerprint of an (already normalized) url
+    '''
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class FingerprintSet:
+    '''
+    Set of 64 bit fingerprints in an open addressing table of unsigned longs
+    Uses 8 bytes per slot (at most 2x the fingerprints held) instead of a Python
+        int object per entry, so millions of seen urls stay small
+    If log is a list, fingerprints added are also appended to it
+    '''
+    def __init__(self, capacity=1024):
+        size = 1
+        while size < capacity * 2:
+            size *= 2
+        self.table = array('Q', bytes(8 * size))
+        self.mask = size - 1
+        self.count = 0
+        self.log = None
+
+    def add(self, fp):
+        '''
+        Adds fp, returns False if it was already present
+        '''
+        fp = fp or 1  # 0 marks an empty slot
+        table, mask = self.table, self.mask
+        i = fp & mask
+        while table[i]:
+            if table[i] == fp:
+                return False
+            i = (i + 1) & mask
+        table[i] = fp
+        self.count += 1
+        if self.log is not None:
+            self.log.append(fp)
+        if self.count * 2 > mask:
+            self.grow()
+        return True
+
+    def __contains__(self, fp):
+        fp = fp or 1
+        table, mask = self.table, self.mask
+        i = fp & mask
+        while table[i]:
+            if table[i] == fp:
+                return True
+            i = (i + 1) & mask
+        return False
+
+    def grow(self):
+        old = self.table
+        self.table = array('Q', bytes(16 * len(old)))
+        self.mask = len(self.table) - 1
+        self.count = 0
+        log, self.log = self.log, None
+        for fp in old:
+            if fp:
+                self.add(fp)
+        self.log = log
+
+    def __iter__(self):
+        return (fp for fp in self.table if fp)
+
+    def __len__(self):
+        return self.count
+
+
+class Frontier:
+    '''
+    Crawl frontier
+    urls are normalized and deduplicated by fingerprint against every url ever
+        added, then kept in a FIFO queue per host
+    Hosts are ordered in a heap by the priority of the url at the front of
+        their queue (lower first, e.g. crawl depth), ties broken by insertion order
+    At most max_queued urls are held; further urls are dropped (and counted)
+    accept, if given, is called with each normalized url and can reject it
+    After start_journal(), urls queued and popped and new seen fingerprints are
+        recorded until take_journal(), so a checkpoint can save only the changes
+    '''
+    def __init__(self, max_queued=1000000, accept=None):
+        self.max_queued = max_queued
+        self.accept = accept
+        self.seen = FingerprintSet()
+        self.host_queues = {}
+        self.heap = []
+        self.order = itertools.count()
+        self.queued = 0
+        self.dropped = 0
+        self.journal = None
+
+    def mark_seen(self, url):
+        '''
+        Records url as seen without queueing it; returns False if already seen
+        '''
+        return self.seen.add(fingerprint(normalize_url(url)))
+
+    def add(self, url, priority=0):
+        '''
+        Queues url unless it was seen before, is rejected by accept or the frontier is full
+        Returns the normalized url if it was queued
+        '''
+        try:
+            url = normalize_url(url)
+        except ValueError:
+            return None
+        if not url.startswith(('http://', 'https://')):
+            return None
+        if self.accept and not self.accept(url):
+            return None
+        fp = fingerprint(url)
+        if fp in self.seen:
+            return None
+        if self.queued >= self.max_queued:
+            self.dropped += 1
+            return None
+        self.seen.add(fp)
+        self.requeue(url, priority)
+        return url
+
+    def requeue(self, url, priority=0):
+        '''
+        Queues an already normalized and seen url (e.g. restored from a checkpoint)
+        '''
+        host = urlsplit(url).netloc
+        queue = self.host_queues.get(host)
+        if queue is None:
+            queue = self.host_queues[host] = deque()
+        queue.append((priority, url))
+        if self.journal is not None:
+            self.journal[url] = priority
+        if len(queue) == 1:
+            heapq.heappush(self.heap, (priority, next(self.order), host))
+        self.queued += 1
+
+    def add_all(self, urls, priority=0):
+        for url in urls:
+            self.add(url, priority)
+
+    def pop(self):
+        '''
+        Returns (url, priority) from the host with the best priority
+        '''
+        _, _, host = heapq.heappop(self.heap)
+        queue = self.host_queues[host]
+        priority, url = queue.popleft()
+        if queue:
+            heapq.heappush(self.heap, (queue[0][0], next(self.order), host))
+        else:
+            del self.host_queues[host]
+        self.queued -= 1
+        if self.journal is not None:
+            self.journal[url] = None
+        return url, priority
+
+    def pop_batch(self, size):
+        '''
+        Pops up to size urls, grouped by host: {host: [(url, priority), ...]}
+        '''
+        batch = {}
+        while self.heap and size > 0:
+            url, priority = self.pop()
+            batch.setdefault(urlsplit(url).netloc, []).append((url, priority))
+            size -= 1
+        return batch
+
+    def pending(self):
+        '''
+        All queued (url, priority) pairs, without removing them
+        '''
+        return [(url, priority) for queue in self.host_queues.values() for priority, url in queue]
+
+    def start_journal(self):
+        self.journal = {}
+        self.seen.log = []
+
+    def take_journal(self):
+        '''
+        Returns the changes since start_journal() or the last call, and starts anew:
+            ({url: priority if queued, None if popped}, [new seen fingerprints])
+        '''
+        changes, self.journal = self.journal, {}
+        seen, self.seen.log = self.seen.log, []
+        return changes, seen
+
+    def __len__(self):
+        return self.queued
+
+    def __bool__(self):
+        return self.queued > 0
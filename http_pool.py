@@ -0,0 +1,131 @@
+import threading
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class ConnectionStats:
+    '''
+    Thread safe counters for requests sent and connections opened
+    Every request that did not open a new connection reused a kept-alive one
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def add_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def add_connection(self):
+        with self.lock:
+            self.new_connections += 1
+
+    def as_dict(self):
+        with self.lock:
+            reused = max(self.requests - self.new_connections, 0)
+            return {
+                'requests': self.requests,
+                'new_connections': self.new_connections,
+                'reused_connections': reused,
+                'reuse_ratio': reused / self.requests if self.requests else 0.0,
+            }
+
+
+def counting_pool_classes(stats):
+    '''
+    urllib3 connection pool classes that count every new connection in stats
+    '''
+    def _new_conn(base):
+        def new_conn(self):
+            stats.add_connection()
+            return base._new_conn(self)
+        return new_conn
+
+    return {
+        'http': type('CountingHTTPConnectionPool', (HTTPConnectionPool,), {'_new_conn': _new_conn(HTTPConnectionPool)}),
+        'https': type('CountingHTTPSConnectionPool', (HTTPSConnectionPool,), {'_new_conn': _new_conn(HTTPSConnectionPool)}),
+    }
+
+
+class CountingAdapter(HTTPAdapter):
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = counting_pool_classes(self.stats)
+
+    def send(self, request, **kwargs):
+        self.stats.add_request()
+        return super().send(request, **kwargs)
+
+
+class ConnectionPool:
+    '''
+    Crawler owned pool of keep-alive HTTP connections
+    max_per_host caps open connections to a single host (requests wait for a free one)
+    max_connections caps requests in flight across all hosts; a streamed response
+        holds its slot until it is closed (e.g. by a with block)
+    max_hosts is the number of per host pools kept alive at once
+    timeout is passed to every request as (connect, read) seconds
+    compression negotiates gzip/deflate bodies; when False asks for identity encoding
+    Safe to share between threads
+    '''
+    def __init__(self, max_connections=100, max_per_host=8, max_hosts=100, timeout=(5, 30), compression=True):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        if not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+        self.timeout = timeout
+        self.compression = compression
+        self.stats = ConnectionStats()
+        self.slots = threading.BoundedSemaphore(max_connections)
+
+        self.session = requests.Session()
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate' if compression else 'identity'
+        adapter = CountingAdapter(self.stats, pool_connections=max_hosts, pool_maxsize=max_per_host, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @property
+    def headers(self):
+        return dict(self.session.headers)
+
+    def get(self, url, **kwargs):
+        '''
+        requests.get through the pool
+        With stream=True the connection and the request's slot are held until the
+            response is closed (or garbage collected)
+        '''
+        kwargs.setdefault('timeout', self.timeout)
+        self.slots.acquire()
+        try:
+            r = self.session.get(url, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        if not kwargs.get('stream'):
+            self.slots.release()
+            return r
+        # a finalizer runs at most once, whether the response is closed or collected
+        release = weakref.finalize(r, self.slots.release)
+        close = r.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                release()
+        r.close = close_and_release
+        return r
+
+    def connection_stats(self):
+        return self.stats.as_dict()
+
+    def close(self):
+        self.session.close()
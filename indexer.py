@@ -0,0 +1,480 @@
+import heapq
+import json
+import os
+import numpy as np
+from array import array
+from collections import Counter
+from analyze import count_stream
+from checkpoint import CrawlCheckpoint
+from page_store import open_store
+
+MANIFEST = 'segments.json'
+ENCODE_BATCH = 1 << 20
+BLOCK = 128
+
+entry_dtype = np.dtype([('term_offset', '<u8'), ('term_length', '<u4'), ('df', '<u4'), ('max_tf', '<u4'),
+                        ('min_length', '<u4'), ('offset', '<u8'), ('length', '<u4'), ('block', '<u8')])
+block_dtype = np.dtype([('last_doc', '<u4'), ('max_tf', '<u4'), ('min_length', '<u4'), ('offset', '<u8'),
+                        ('length', '<u4')])
+
+
+def encode_varints(values):
+    '''
+    LEB128 varints of non negative integers (7 bits per byte, high bit set on all but the last byte)
+    Returns (bytes, number of bytes of each value)
+    '''
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        sizes += rest > 0
+        rest >>= np.uint64(7)
+    owner = np.repeat(np.arange(len(values)), sizes)
+    position = np.arange(len(owner)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    out = ((values[owner] >> (7 * position).astype(np.uint64)) & np.uint64(0x7f)).astype(np.uint8)
+    out[position < sizes[owner] - 1] |= 0x80
+    return out.tobytes(), sizes
+
+
+def decode_varints(data):
+    '''
+    Decodes a buffer of varints made by encode_varints into an int64 array
+    '''
+    data = np.frombuffer(data, dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, dtype=np.int64)
+    last = data < 0x80
+    starts = np.flatnonzero(np.concatenate(([True], last[:-1])))
+    owner = np.cumsum(np.concatenate(([0], last[:-1])))
+    position = np.arange(len(data)) - starts[owner]
+    weights = (data & 0x7f).astype(np.float64) * np.exp2(7 * position)
+    return np.bincount(owner, weights, minlength=len(starts)).astype(np.int64)
+
+
+def interleave_blocks(deltas, tfs):
+    '''
+    Lays out a term's postings in blocks of BLOCK: the block's doc id deltas, then its term frequencies
+    '''
+    full = len(deltas) // BLOCK * BLOCK
+    head = np.stack((deltas[:full].reshape(-1, BLOCK), tfs[:full].reshape(-1, BLOCK)), axis=1).ravel()
+    return np.concatenate((head, deltas[full:], tfs[full:]))
+
+
+def split_blocks(values, df):
+    '''
+    Inverse of interleave_blocks: returns (doc id deltas, term frequencies)
+    '''
+    full = df // BLOCK * BLOCK
+    head = values[:2 * full].reshape(-1, 2, BLOCK)
+    tail = values[2 * full:]
+    rest = df - full
+    return np.concatenate((head[:, 0].ravel(), tail[:rest])), np.concatenate((head[:, 1].ravel(), tail[rest:]))
+
+
+def load_urls(checkpoint='crawl_state.sqlite'):
+    '''
+    Maps each repository filename to its url, from the crawl checkpoint's repo_files
+    '''
+    files = CrawlCheckpoint(checkpoint)
+    urls = {entry['filename']: url for url, entry in files.load_files().items() if 'filename' in entry}
+    files.close()
+    return urls
+
+
+class SegmentBuilder:
+    '''
+    Writes one index segment, taking terms in sorted order
+    name.post holds each term's postings in blocks of BLOCK postings: varint doc id
+        deltas followed by varint term frequencies
+    name.skip holds one entry (block_dtype) per block: its last doc id, the
+        largest term frequency and smallest document length in it (which bound
+        its scores), and where it is in name.post, so a block is decoded alone
+    name.terms holds the utf-8 terms back to back and name.dict one fixed size
+        entry (entry_dtype) per term, so the dictionary is binary searched in place
+    name.docs holds [key, url] per document and name.lens the document lengths (uint32)
+    '''
+    def __init__(self, path, name, lengths):
+        self.prefix = os.path.join(path, name)
+        self.lengths = np.asarray(lengths, dtype=np.uint32)
+        self.post = open(f'{self.prefix}.post', 'wb')
+        self.terms = open(f'{self.prefix}.terms', 'wb')
+        self.entries = []
+        self.skips = []
+        self.blocks = 0
+        self.pending = []
+        self.pending_values = 0
+        self.offset = 0
+        self.term_offset = 0
+
+    def add_term(self, term, docs, tfs):
+        '''
+        Adds the postings of term: increasing doc ids and their term frequencies
+        '''
+        encoded = term.encode('utf-8')
+        self.terms.write(encoded)
+        lengths = self.lengths[docs]
+        self.entries.append((self.term_offset, len(encoded), len(docs), int(tfs.max()),
+                             int(lengths.min()), 0, 0, self.blocks))
+        starts = np.arange(0, len(docs), BLOCK)
+        skip = np.zeros(len(starts), dtype=block_dtype)
+        skip['last_doc'] = docs[np.minimum(starts + BLOCK, len(docs)) - 1]
+        skip['max_tf'] = np.maximum.reduceat(tfs, starts)
+        skip['min_length'] = np.minimum.reduceat(lengths, starts)
+        self.skips.append(skip)
+        self.blocks += len(skip)
+        self.term_offset += len(encoded)
+        self.pending.append((docs, tfs))
+        self.pending_values += 2 * len(docs)
+        if self.pending_values >= ENCODE_BATCH:
+            self.encode()
+
+    def encode(self):
+        # postings of many terms are encoded with one vectorized call
+        if not self.pending:
+            return
+        values = [interleave_blocks(np.diff(docs, prepend=0), tfs) for docs, tfs in self.pending]
+        data, sizes = encode_varints(np.concatenate(values))
+        counts = np.concatenate([np.minimum(len(docs) - np.arange(0, len(docs), BLOCK), BLOCK)
+                                 for docs, _ in self.pending])
+        # byte range of every block, from the sizes of its 2 * count values
+        ends = np.cumsum(sizes)[np.cumsum(2 * counts) - 1]
+        starts = np.concatenate(([0], ends[:-1]))
+        first = len(self.entries) - len(self.pending)
+        block = 0
+        for i, skip in enumerate(self.skips[first:]):
+            skip['offset'] = self.offset + starts[block:block + len(skip)]
+            skip['length'] = ends[block:block + len(skip)] - starts[block:block + len(skip)]
+            entry = self.entries[first + i]
+            self.entries[first + i] = entry[:5] + (int(skip['offset'][0]), int(skip['length'].sum()), entry[7])
+            block += len(skip)
+        self.offset += len(data)
+        self.post.write(data)
+        self.pending = []
+        self.pending_values = 0
+
+    def finish(self, docs):
+        self.encode()
+        self.post.close()
+        self.terms.close()
+        np.array(self.entries, dtype=entry_dtype).tofile(f'{self.prefix}.dict')
+        np.concatenate(self.skips or [np.zeros(0, dtype=block_dtype)]).tofile(f'{self.prefix}.skip')
+        self.lengths.tofile(f'{self.prefix}.lens')
+        with open(f'{self.prefix}.docs', 'w') as f:
+            json.dump(docs, f)
+
+
+class IndexSegment:
+    '''
+    Read only view of a segment written by SegmentBuilder; files are memory mapped
+    deleted holds the local ids of documents replaced by a later segment
+    '''
+    def __init__(self, path, name, deleted=()):
+        self.name = name
+        prefix = os.path.join(path, name)
+        with open(f'{prefix}.docs') as f:
+            self.docs = json.load(f)
+        self.lengths = self.map(f'{prefix}.lens', np.uint32)
+        self.entries = self.map(f'{prefix}.dict', entry_dtype)
+        self.skips = self.map(f'{prefix}.skip', block_dtype)
+        self.terms = self.map(f'{prefix}.terms', np.uint8)
+        self.post = self.map(f'{prefix}.post', np.uint8)
+        self.deleted = set(deleted)
+        self.live = np.ones(len(self.docs), dtype=bool)
+        self.live[list(self.deleted)] = False
+
+    @staticmethod
+    def map(path, dtype):
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        # a plain ndarray over the mapping slices without memmap's per slice overhead
+        return np.memmap(path, dtype=dtype, mode='r').view(np.ndarray)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def lookup(self, term):
+        '''
+        Returns the dictionary entry of term, or None
+        '''
+        encoded = term.encode('utf-8')
+        lo, hi = 0, len(self.entries)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self.entries[mid]
+            start = int(entry['term_offset'])
+            found = self.terms[start:start + int(entry['term_length'])].tobytes()
+            if found < encoded:
+                lo = mid + 1
+            elif found > encoded:
+                hi = mid
+            else:
+                return entry
+        return None
+
+    def postings(self, entry):
+        '''
+        Returns (doc ids, term frequencies) of a dictionary entry
+        '''
+        offset = int(entry['offset'])
+        deltas, tfs = split_blocks(decode_varints(self.post[offset:offset + int(entry['length'])]), int(entry['df']))
+        return np.cumsum(deltas), tfs
+
+    def blocks(self, entry):
+        '''
+        Skip entries (block_dtype) of the posting blocks of a dictionary entry
+        '''
+        first = int(entry['block'])
+        return self.skips[first:first + -(-int(entry['df']) // BLOCK)]
+
+    def block_postings(self, entry, numbers):
+        '''
+        Returns (doc ids, term frequencies) of only the posting blocks numbered
+            numbers (increasing) of a dictionary entry
+        '''
+        skips = self.blocks(entry)
+        numbers = np.asarray(numbers, dtype=np.int64)
+        if not len(numbers):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        if 2 * len(numbers) >= len(skips):
+            # most of the list: decoding it whole is cheaper than gathering its blocks
+            docs, tfs = self.postings(entry)
+            chosen = np.zeros(len(skips), dtype=bool)
+            chosen[numbers] = True
+            keep = np.repeat(chosen, BLOCK)[:len(docs)]
+            return docs[keep], tfs[keep]
+        chosen = skips[numbers]
+        offsets, lengths = chosen['offset'].astype(np.int64), chosen['length'].astype(np.int64)
+        # byte positions of the chosen blocks, gathered in one go
+        positions = np.arange(int(lengths.sum())) + np.repeat(offsets - (np.cumsum(lengths) - lengths), lengths)
+        values = decode_varints(self.post[positions])
+        counts = np.minimum(int(entry['df']) - numbers * BLOCK, BLOCK)
+        firsts = np.cumsum(counts) - counts
+        owner = np.repeat(np.arange(len(numbers)), counts)
+        within = np.arange(len(owner)) - firsts[owner]
+        deltas = values[2 * firsts[owner] + within]
+        tfs = values[2 * firsts[owner] + counts[owner] + within]
+        # a block's first delta is from the last doc id of the block before it
+        bases = np.where(numbers > 0, skips['last_doc'][np.maximum(numbers - 1, 0)].astype(np.int64), 0)
+        sums = np.cumsum(deltas)
+        return sums - np.repeat(sums[firsts] - deltas[firsts] - bases, counts), tfs
+
+    def iter_terms(self, tag=None, block=ENCODE_BATCH):
+        '''
+        Yields (term, tag, doc ids, term frequencies) in term order
+        Postings are decoded about block bytes at a time, as they are stored in term order
+        '''
+        entries = np.asarray(self.entries)
+        ends = entries['offset'] + entries['length']
+        i = 0
+        while i < len(entries):
+            j = max(int(np.searchsorted(ends, entries['offset'][i] + block, 'right')), i + 1)
+            base, term_base = int(entries['offset'][i]), int(entries['term_offset'][i])
+            values = decode_varints(self.post[base:int(ends[j - 1])])
+            terms = self.terms[term_base:int(entries['term_offset'][j - 1] + entries['term_length'][j - 1])].tobytes()
+            start = 0
+            for entry in entries[i:j]:
+                df = int(entry['df'])
+                term_start = int(entry['term_offset']) - term_base
+                term = terms[term_start:term_start + int(entry['term_length'])].decode('utf-8')
+                deltas, tfs = split_blocks(values[start:start + 2 * df], df)
+                yield term, tag, np.cumsum(deltas), tfs
+                start += 2 * df
+            i = j
+
+
+class Indexer:
+    '''
+    Inverted index of the processed page store, kept in segments under path
+    Documents are tokenized like Analyze (lowercased \\w+ words, streamed in chunks)
+        and buffered batch_docs at a time, then written as a new segment, so
+        memory does not grow with the corpus
+    A document indexed again (e.g. a page changed by a recrawl) replaces the
+        older copy, which is marked deleted until its segment is merged
+    Once merge_factor segments of similar size exist they are merged into one
+    segments.json lists the live segments and is replaced atomically
+    '''
+    def __init__(self, path='index', batch_docs=10000, merge_factor=10):
+        self.path = path
+        self.batch_docs = batch_docs
+        self.merge_factor = merge_factor
+        os.makedirs(path, exist_ok=True)
+        self.manifest = {'next': 1, 'segments': []}
+        if os.path.isfile(os.path.join(path, MANIFEST)):
+            with open(os.path.join(path, MANIFEST)) as f:
+                self.manifest = json.load(f)
+        self.segments = [IndexSegment(path, segment['name'], segment['deleted'])
+                         for segment in self.manifest['segments']]
+        self.locations = {}
+        for segment in self.segments:
+            for local, (key, _) in enumerate(segment.docs):
+                if local not in segment.deleted:
+                    self.locations[key] = (segment.name, local)
+        self.reset_buffer()
+
+    def reset_buffer(self):
+        self.buffer_docs = []
+        self.buffer_lengths = []
+        self.buffer_postings = {}
+
+    def index_repository(self, src_repo='processed', urls=None, keys=None):
+        '''
+        Indexes the files of src_repo (or only keys, e.g. WebCrawler.changed_files())
+        urls maps filenames to urls, by default from the crawl checkpoint (see load_urls)
+        '''
+        if urls is None:
+            urls = load_urls() if os.path.isfile('crawl_state.sqlite') else {}
+        store = open_store(src_repo)
+        for key in sorted(store.keys() if keys is None else keys):
+            with store.open(key) as f:
+                self.add_document(key, urls.get(key), f)
+        store.close()
+        self.flush()
+
+    def add_document(self, key, url, f):
+        '''
+        Indexes the text of binary file f as document key
+        '''
+        counts = count_stream(f, Counter())
+        doc = len(self.buffer_docs)
+        self.buffer_docs.append([key, url])
+        self.buffer_lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            postings = self.buffer_postings.get(term)
+            if postings is None:
+                postings = self.buffer_postings[term] = (array('I'), array('I'))
+            postings[0].append(doc)
+            postings[1].append(tf)
+        if len(self.buffer_docs) >= self.batch_docs:
+            self.flush()
+
+    def new_name(self):
+        name = f'seg-{self.manifest["next"]:05d}'
+        self.manifest['next'] += 1
+        return name
+
+    def flush(self):
+        '''
+        Writes the buffered documents as a new segment
+        '''
+        if not self.buffer_docs:
+            return
+        name = self.new_name()
+        builder = SegmentBuilder(self.path, name, self.buffer_lengths)
+        for term in sorted(self.buffer_postings):
+            docs, tfs = self.buffer_postings[term]
+            builder.add_term(term, np.frombuffer(docs, dtype=np.uint32).astype(np.int64),
+                             np.frombuffer(tfs, dtype=np.uint32).astype(np.int64))
+        builder.finish(self.buffer_docs)
+        replaced = [(key, self.locations[key]) for key, _ in self.buffer_docs if key in self.locations]
+        duplicates = []
+        for local, (key, _) in enumerate(self.buffer_docs):
+            if self.locations.get(key, (None,))[0] == name:
+                duplicates.append(self.locations[key][1])
+            self.locations[key] = (name, local)
+        self.reset_buffer()
+        for segment, entry in zip(self.segments, self.manifest['segments']):
+            for key, (old, local) in replaced:
+                if old == segment.name:
+                    segment.deleted.add(local)
+                    segment.live[local] = False
+            entry['deleted'] = sorted(segment.deleted)
+        self.segments.append(IndexSegment(self.path, name, duplicates))
+        self.manifest['segments'].append({'name': name, 'docs': len(self.segments[-1]), 'deleted': duplicates})
+        self.save()
+        self.maybe_merge()
+
+    def maybe_merge(self):
+        '''
+        Merges the smallest segments once merge_factor of them are within a factor 10 in size
+        '''
+        while len(self.segments) >= self.merge_factor:
+            by_size = sorted(self.segments, key=len)[:self.merge_factor]
+            if len(by_size[-1]) > 10 * max(len(by_size[0]), 1):
+                return
+            self.merge([segment.name for segment in by_size])
+
+    def merge(self, names=None):
+        '''
+        Merges the named segments (all by default) into one, dropping deleted documents
+        The merged segment takes the place of the first of them, keeping segments in indexing order
+        '''
+        names = set(names or [segment.name for segment in self.segments])
+        merging = [segment for segment in self.segments if segment.name in names]
+        if len(merging) < 2 and not any(segment.deleted for segment in merging):
+            return
+        docs, lengths, remaps = [], [], []
+        for segment in merging:
+            remap = np.full(len(segment), -1, dtype=np.int64)
+            live = np.flatnonzero(segment.live)
+            remap[live] = np.arange(len(docs), len(docs) + len(live))
+            docs.extend(segment.docs[i] for i in live)
+            lengths.append(np.asarray(segment.lengths)[live])
+            remaps.append(remap)
+        name = self.new_name()
+        builder = SegmentBuilder(self.path, name, np.concatenate(lengths) if lengths else [])
+        streams = [segment.iter_terms(number) for number, segment in enumerate(merging)]
+        current, parts = None, []
+        for term, number, segment_docs, tfs in heapq.merge(*streams, key=lambda item: item[:2]):
+            if term != current:
+                self.merge_term(builder, current, parts)
+                current, parts = term, []
+            segment_docs = remaps[number][segment_docs]
+            keep = segment_docs >= 0
+            parts.append((segment_docs[keep], tfs[keep]))
+        self.merge_term(builder, current, parts)
+        builder.finish(docs)
+
+        first = min(self.segments.index(segment) for segment in merging)
+        merged = IndexSegment(self.path, name)
+        entries = {entry['name']: entry for entry in self.manifest['segments']}
+        kept = [segment for segment in self.segments if segment.name not in names]
+        self.segments = kept[:first] + [merged] + kept[first:]
+        self.manifest['segments'] = [entries.get(segment.name) or {'name': name, 'docs': len(merged), 'deleted': []}
+                                     for segment in self.segments]
+        for local, (key, _) in enumerate(docs):
+            self.locations[key] = (name, local)
+        self.save()
+        for segment in merging:
+            self.remove_files(segment.name)
+
+    @staticmethod
+    def merge_term(builder, term, parts):
+        parts = [part for part in parts if len(part[0])]
+        if term is None or not parts:
+            return
+        builder.add_term(term, np.concatenate([docs for docs, _ in parts]), np.concatenate([tfs for _, tfs in parts]))
+
+    def remove_files(self, name):
+        for ext in ('post', 'skip', 'terms', 'dict', 'docs', 'lens'):
+            path = os.path.join(self.path, f'{name}.{ext}')
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def save(self):
+        '''
+        Atomically writes segments.json
+        '''
+        tmp = os.path.join(self.path, f'{MANIFEST}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp, os.path.join(self.path, MANIFEST))
+
+    def reset(self):
+        '''
+        Deletes every segment
+        '''
+        for segment in self.segments:
+            self.remove_files(segment.name)
+        self.manifest = {'next': 1, 'segments': []}
+        self.segments = []
+        self.locations = {}
+        self.reset_buffer()
+        self.save()
+
+    def stats(self):
+        '''
+        Number of segments, live documents and terms (summed over segments)
+        '''
+        return {'segments': len(self.segments),
+                'docs': sum(len(segment) - len(segment.deleted) for segment in self.segments),
+                'terms': sum(len(segment.entries) for segment in self.segments)}
@@ -0,0 +1,76 @@
+import codecs
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+
+
+def resolve_link(url, href):
+    '''
+    Turns an href found on url into the link queued by the crawler:
+        scheme://netloc/path, taking scheme and netloc from url for relative hrefs
+    '''
+    parsed_url = urlparse(href)
+    if parsed_url.scheme and parsed_url.netloc:
+        return f'{parsed_url.scheme}://{parsed_url.netloc}{parsed_url.path}'
+    parsed_host_url = urlparse(url)
+    return f'{parsed_host_url.scheme}://{parsed_host_url.netloc}{parsed_url.path}'
+
+
+# tags whose text ContentProcessor drops (its tags_blacklist), plus style
+text_skip_tags = {'script', 'style', 'nav', 'aside', 'video', 'footer', 'form', 'noscript'}
+
+
+class LinkExtractor(HTMLParser):
+    '''
+    Incremental tokenizer that finds links and images while a page is downloaded
+    Fed raw response chunks with feed_bytes; no tree is built and the page is
+        never reread from disk
+    Counts match find_links: every <a> with an href is a link, every <img> an image
+    With collect_text=True the page text outside text_skip_tags is kept in text()
+        (e.g. for near duplicate detection)
+    '''
+    def __init__(self, url, encoding='utf-8', collect_text=False):
+        super().__init__(convert_charrefs=True)
+        self.url = url
+        self.links = []
+        self.link_count = 0
+        self.image_count = 0
+        self.decoder = codecs.getincrementaldecoder(encoding)('replace')
+        self.collect_text = collect_text
+        self.strings = []
+        self.skipping = 0
+        self.finished = False
+
+    def feed_bytes(self, chunk):
+        self.feed(self.decoder.decode(chunk))
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.feed(self.decoder.decode(b'', final=True))
+        self.close()
+
+    def text(self):
+        return ' '.join(self.strings)
+
+    def handle_data(self, data):
+        if self.collect_text and not self.skipping:
+            self.strings.append(data)
+
+    def handle_endtag(self, tag):
+        if tag in text_skip_tags and self.skipping:
+            self.skipping -= 1
+
+    def handle_starttag(self, tag, attrs):
+        if tag in text_skip_tags:
+            self.skipping += 1
+        elif tag == 'a':
+            href = None
+            for name, value in attrs:
+                if name == 'href':
+                    href = value or ''
+            if href is not None:
+                self.links.append(resolve_link(self.url, href))
+                self.link_count += 1
+        elif tag == 'img':
+            self.image_count += 1
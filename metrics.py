@@ -0,0 +1,230 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+
+# histogram buckets grow by 2 ** (1 / 8), about 9%, starting at one microsecond
+BUCKET_MIN = 1e-6
+BUCKETS_PER_DOUBLING = 8
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    '''
+    Thread safe histogram of durations in seconds with log spaced buckets
+    Memory is a few hundred counts however many values are observed, and
+        quantiles are accurate to the bucket width (about 9%)
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = []
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value):
+        bucket = 0
+        if value > BUCKET_MIN:
+            bucket = int(math.log2(value / BUCKET_MIN) * BUCKETS_PER_DOUBLING) + 1
+        with self.lock:
+            if bucket >= len(self.buckets):
+                self.buckets.extend([0] * (bucket + 1 - len(self.buckets)))
+            self.buckets[bucket] += 1
+            self.count += 1
+            self.sum += value
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+
+    def quantile(self, q):
+        '''
+        Value below which a fraction q of the observations fall (the middle of its bucket)
+        '''
+        with self.lock:
+            if not self.count:
+                return 0.0
+            rank = q * self.count
+            seen = 0
+            for bucket, count in enumerate(self.buckets):
+                seen += count
+                if seen >= rank and count:
+                    break
+            smallest, largest = self.min, self.max
+        if bucket:
+            value = BUCKET_MIN * 2 ** ((bucket - 0.5) / BUCKETS_PER_DOUBLING)
+        else:
+            value = BUCKET_MIN / 2
+        return min(max(value, smallest), largest)
+
+    def dump(self):
+        with self.lock:
+            return [list(self.buckets), self.count, self.sum, self.min, self.max]
+
+    def merge(self, data):
+        '''
+        Adds the observations of a histogram dumped with dump()
+        '''
+        buckets, count, total, smallest, largest = data
+        with self.lock:
+            if len(buckets) > len(self.buckets):
+                self.buckets.extend([0] * (len(buckets) - len(self.buckets)))
+            for bucket, n in enumerate(buckets):
+                self.buckets[bucket] += n
+            self.count += count
+            self.sum += total
+            self.min = min(self.min, smallest)
+            self.max = max(self.max, largest)
+
+    def as_dict(self):
+        summary = {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count else 0.0,
+                   'min': self.min if self.count else 0.0, 'max': self.max}
+        for q in QUANTILES:
+            summary[f'p{round(q * 100)}'] = self.quantile(q)
+        return summary
+
+
+class Timer:
+    '''
+    Context manager adding the time spent in its block to a histogram
+    '''
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Metrics:
+    '''
+    Named counters and duration histograms, safe to update from many threads
+        with metrics.timer('http_fetch'): ...
+        metrics.observe('disk_write', seconds)
+        metrics.inc('pages')
+    snapshot() gives counts, sums, means and p50/p95/p99 per histogram; write()
+        saves it as json or, for a .prom path, as Prometheus text
+    export_every(path, interval) writes the metrics periodically from a
+        background thread until stop_export()
+    dump() and merge() carry the metrics of another process over exactly
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+        self.exporter = None
+        self.stop = threading.Event()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def timer(self, name):
+        return Timer(self.histogram(name))
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+        return {'elapsed': time.time() - self.started, 'counters': counters,
+                'timers': {name: histogram.as_dict() for name, histogram in sorted(histograms.items())}}
+
+    def dump(self):
+        '''
+        Returns the counters and raw histograms as a picklable dict, for merge()
+        '''
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+        return {'counters': counters, 'histograms': {name: histogram.dump() for name, histogram in histograms.items()}}
+
+    def merge(self, data):
+        '''
+        Adds the counters and histograms of a dict made by dump()
+        '''
+        for name, value in data['counters'].items():
+            self.inc(name, value)
+        for name, histogram in data['histograms'].items():
+            self.histogram(name).merge(histogram)
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix='crawler'):
+        '''
+        Prometheus text exposition: counters as <prefix>_<name>_total,
+            histograms as summaries <prefix>_<name>_seconds with quantiles
+        '''
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = f'{prefix}_{metric_name(name)}_total'
+            lines += [f'# TYPE {metric} counter', f'{metric} {value}']
+        for name, summary in snapshot['timers'].items():
+            metric = f'{prefix}_{metric_name(name)}_seconds'
+            lines.append(f'# TYPE {metric} summary')
+            for q in QUANTILES:
+                lines.append(f'{metric}{{quantile="{q}"}} {summary[f"p{round(q * 100)}"]:.9g}')
+            lines += [f'{metric}_sum {summary["sum"]:.9g}', f'{metric}_count {summary["count"]}']
+        metric = f'{prefix}_elapsed_seconds'
+        lines += [f'# TYPE {metric} gauge', f'{metric} {snapshot["elapsed"]:.9g}']
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        '''
+        Atomically writes the metrics to path, as Prometheus text if it ends in .prom, json otherwise
+        '''
+        text = self.to_prometheus() if path.endswith('.prom') else self.to_json()
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def export_every(self, path, interval):
+        self.stop.clear()
+
+        def export():
+            while not self.stop.wait(interval):
+                self.write(path)
+
+        self.exporter = threading.Thread(target=export, daemon=True)
+        self.exporter.start()
+
+    def stop_export(self):
+        if self.exporter is not None:
+            self.stop.set()
+            self.exporter.join()
+            self.exporter = None
+
+    def display(self):
+        '''
+        Prints one line per timer, slowest total first
+        '''
+        snapshot = self.snapshot()
+        print(f'{"stage":18} {"count":>7} {"total s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+        for name, summary in sorted(snapshot['timers'].items(), key=lambda item: -item[1]['sum']):
+            print(f'{name:18} {summary["count"]:7} {summary["sum"]:9.2f} {summary["p50"] * 1000:9.2f} '
+                  f'{summary["p95"] * 1000:9.2f} {summary["p99"] * 1000:9.2f}')
+        for name, value in sorted(snapshot['counters'].items()):
+            print(f'{name:18} {value:7}')
+
+
+def metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
@@ -0,0 +1,120 @@
+import hashlib
+import re
+import threading
+from functools import lru_cache
+import numpy as np
+
+word_re = re.compile(r'\w+')
+SHINGLE_SIZE = 3
+MIN_WORDS = 20
+# odd multipliers combining the word hashes of a shingle, and the splitmix64 finalizer
+SHINGLE_MULTIPLIERS = (np.uint64(0x9E3779B97F4A7C15), np.uint64(0xC2B2AE3D27D4EB4F), np.uint64(1))
+MIX_1, MIX_2 = np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB)
+
+
+@lru_cache(maxsize=1 << 16)
+def word_hash(word):
+    return int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def shingle_hashes(words, size=SHINGLE_SIZE):
+    '''
+    64 bit hashes of the overlapping size word shingles of words
+    Each word is hashed once; shingles combine the word hashes with NumPy
+    '''
+    hashes = np.fromiter(map(word_hash, words), dtype=np.uint64, count=len(words))
+    n = len(hashes) - size + 1
+    shingles = np.zeros(n, dtype=np.uint64)
+    for i, multiplier in enumerate(SHINGLE_MULTIPLIERS[-size:]):
+        shingles ^= hashes[i:i + n] * multiplier
+    shingles ^= shingles >> np.uint64(30)
+    shingles *= MIX_1
+    shingles ^= shingles >> np.uint64(27)
+    shingles *= MIX_2
+    shingles ^= shingles >> np.uint64(31)
+    return shingles
+
+
+def simhash(text, min_words=MIN_WORDS):
+    '''
+    64 bit SimHash (Charikar) of text: bit i is set if most of its distinct word
+        shingles have bit i set, so texts sharing most shingles differ in few bits
+    Shingles count once, so the common phrases every page shares do not
+        outweigh the rest of the text
+    Returns None for texts of fewer than min_words words, too short to compare
+    '''
+    words = word_re.findall(text.lower())
+    if len(words) < max(min_words, SHINGLE_SIZE):
+        return None
+    shingles = np.unique(shingle_hashes(words))
+    # byte b of a little endian uint64 holds bits 8b..8b+7
+    octets = shingles.astype('<u8', copy=False).view(np.uint8).reshape(-1, 8)
+    bits = np.unpackbits(octets, axis=1, bitorder='little')
+    majority = bits.sum(axis=0, dtype=np.int64) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(majority, bitorder='little').tobytes(), 'little')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class SimHashIndex:
+    '''
+    Finds stored SimHash signatures within max_distance bits of a signature
+    The 64 bits are split into max_distance + 1 bands: two signatures differing
+        in at most max_distance bits agree exactly on at least one band, so only
+        signatures sharing a band value are compared (a banded bit index, as
+        in Manku et al.) instead of every stored signature
+    Safe to use from many threads
+    '''
+    def __init__(self, max_distance=3):
+        if not 0 <= max_distance < 64:
+            raise ValueError(f'max_distance must be from 0 to 63, not {max_distance}')
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        # exactly max_distance + 1 bands, the first 64 % bands of them one bit wider
+        widths = [64 // bands + (band < 64 % bands) for band in range(bands)]
+        shifts = [sum(widths[:band]) for band in range(bands)]
+        self.bands = [(shift, (1 << width) - 1) for shift, width in zip(shifts, widths)]
+        self.tables = [{} for _ in self.bands]
+        self.lock = threading.Lock()
+        self.count = 0
+        self.comparisons = 0
+
+    def __len__(self):
+        return self.count
+
+    def find(self, signature):
+        '''
+        Key of a stored signature within max_distance bits of signature, or None
+        '''
+        with self.lock:
+            return self._find(signature)
+
+    def add(self, signature, key):
+        with self.lock:
+            self._add(signature, key)
+
+    def check(self, signature, key):
+        '''
+        Returns the key of a near duplicate of signature, or None after adding
+            signature under key
+        '''
+        with self.lock:
+            original = self._find(signature)
+            if original is None:
+                self._add(signature, key)
+            return original
+
+    def _find(self, signature):
+        for (shift, mask), table in zip(self.bands, self.tables):
+            for stored, key in table.get((signature >> shift) & mask, ()):
+                self.comparisons += 1
+                if hamming(stored, signature) <= self.max_distance:
+                    return key
+        return None
+
+    def _add(self, signature, key):
+        for (shift, mask), table in zip(self.bands, self.tables):
+            table.setdefault((signature >> shift) & mask, []).append((signature, key))
+        self.count += 1
@@ -0,0 +1,190 @@
+import re
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from bs4 import BeautifulSoup
+from content_processor import ContentProcessor
+from page_store import open_store
+
+stages = ('parse', 'clean', 'text', 'tokens', 'diff')
+
+def tokenize(text):
+    return re.findall(r'\w+', text.lower())
+
+def token_scores(candidate, reference):
+    '''
+    Bag of words precision, recall and F1 of candidate tokens against reference tokens
+    '''
+    overlap = sum((Counter(candidate) & Counter(reference)).values())
+    precision = overlap / len(candidate) if candidate else 0.0
+    recall = overlap / len(reference) if reference else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+def myers_diff(a, b, max_d=None):
+    '''
+    Myers' diff of sequences a and b, with insertions and deletions only
+    Runs in O((N + M) D) time and O(D) memory, so similar texts are cheap to compare
+    Returns (d, lcs): the edit distance and the LCS length, or, if the distance is
+        larger than max_d, (None, lcs) where lcs is the most matches on a path of
+        max_d edits, a lower bound of the LCS
+    '''
+    n, m = len(a), len(b)
+    max_d = n + m if max_d is None else min(max_d, n + m)
+    offset = max_d + 1
+    v = [0] * (2 * max_d + 3)
+    for d in range(max_d + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return d, (n + m - d) // 2
+    # each furthest reaching path ends at (x, x - k) after max_d edits
+    return None, max((2 * v[offset + k] - k - max_d) // 2 for k in range(-max_d, max_d + 1, 2))
+
+def edit_distance(a, b, max_d=None):
+    '''
+    Number of insertions and deletions turning sequence a into b (see myers_diff)
+    Returns None if the distance is larger than max_d
+    '''
+    return myers_diff(a, b, max_d)[0]
+
+def diff_similarity(a, b, max_d=1000):
+    '''
+    Similarity 2 * LCS / (N + M) of token sequences a and b
+    The common prefix and suffix are skipped, then the LCS follows from the
+        edit distance: LCS = (N + M - D) / 2
+    If D exceeds max_d, the matches on the furthest reaching paths of max_d edits
+        give a lower bound instead, still in O((N + M) max_d) time
+    Returns (similarity, exact)
+    '''
+    total = len(a) + len(b)
+    if not total:
+        return 1.0, True
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    ids = {}
+    a_ids = [ids.setdefault(token, len(ids)) for token in a[start:len(a) - end]]
+    b_ids = [ids.setdefault(token, len(ids)) for token in b[start:len(b) - end]]
+    d, lcs = myers_diff(a_ids, b_ids, max_d)
+    return 2 * (start + end + lcs) / total, d is not None
+
+worker_evaluator = None
+
+def init_worker(evaluator):
+    global worker_evaluator
+    worker_evaluator = evaluator
+
+def evaluate_worker(page):
+    name, content, reference = page
+    return [worker_evaluator.evaluate_page(cleaner, name, content, reference)
+            for cleaner in worker_evaluator.cleaners]
+
+class NoiseEvaluator:
+    '''
+    Scores the text ContentProcessor extracts from pages against reference extractions
+    cleaners maps a name to a ContentProcessor, so settings (parser, extractor) can be compared
+    Each page gets token precision/recall/F1 and a diff similarity (see diff_similarity),
+        and the time spent in each stage: parse, clean, text, tokens and diff
+    With workers > 1 pages are evaluated in a pool of worker processes
+    '''
+
+    def __init__(self, cleaners=None, workers=1, chunksize=None, max_d=1000):
+        self.cleaners = cleaners or {'div': ContentProcessor(), 'bte': ContentProcessor(extractor='bte')}
+        self.workers = workers
+        self.chunksize = chunksize
+        self.max_d = max_d
+        self.results = []
+
+    def evaluate_page(self, cleaner, name, content, reference):
+        processor = self.cleaners[cleaner]
+        timing = {}
+        st = time.perf_counter()
+        soup = BeautifulSoup(content.decode('utf-8', 'replace'), processor.parser)
+        timing['parse'] = time.perf_counter() - st
+        st = time.perf_counter()
+        cleaned = processor.clean_html(soup)
+        timing['clean'] = time.perf_counter() - st
+        st = time.perf_counter()
+        text = ' '.join(cleaned.stripped_strings)
+        timing['text'] = time.perf_counter() - st
+        st = time.perf_counter()
+        candidate, expected = tokenize(text), tokenize(reference)
+        precision, recall, f1 = token_scores(candidate, expected)
+        timing['tokens'] = time.perf_counter() - st
+        st = time.perf_counter()
+        similarity, exact = diff_similarity(candidate, expected, self.max_d)
+        timing['diff'] = time.perf_counter() - st
+        return {'cleaner': cleaner, 'page': name, 'precision': precision, 'recall': recall, 'f1': f1,
+                'similarity': similarity, 'exact': exact, 'timing': timing}
+
+    def evaluate(self, pages):
+        '''
+        Evaluates every cleaner on pages, an iterable of (name, html bytes, reference text)
+        Returns the summary; per page results are kept in results
+        '''
+        pages = list(pages)
+        self.results = []
+        if self.workers > 1 and len(pages) > 1:
+            chunksize = self.chunksize or max(1, len(pages) // (self.workers * 4))
+            with ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(self,)) as pool:
+                for results in pool.map(evaluate_worker, pages, chunksize=chunksize):
+                    self.results.extend(results)
+        else:
+            for name, content, reference in pages:
+                for cleaner in self.cleaners:
+                    self.results.append(self.evaluate_page(cleaner, name, content, reference))
+        return self.summary()
+
+    def evaluate_repository(self, src_repo='repository', reference_repo='reference'):
+        '''
+        Evaluates the pages of the src_repo page store that have a reference text
+            under the same key in the reference_repo page store
+        '''
+        src, references = open_store(src_repo), open_store(reference_repo)
+        keys = sorted(set(src.keys()) & set(references.keys()))
+        pages = [(key, src.get(key), references.get(key).decode('utf-8', 'replace')) for key in keys]
+        src.close()
+        references.close()
+        return self.evaluate(pages)
+
+    def summary(self):
+        '''
+        Per cleaner: mean scores over pages, total seconds per stage and pages per second
+        '''
+        summary = {}
+        for cleaner in self.cleaners:
+            results = [result for result in self.results if result['cleaner'] == cleaner]
+            if not results:
+                continue
+            entry = {key: sum(result[key] for result in results) / len(results)
+                     for key in ('precision', 'recall', 'f1', 'similarity')}
+            entry['pages'] = len(results)
+            entry['inexact'] = sum(not result['exact'] for result in results)
+            entry['timing'] = {stage: sum(result['timing'][stage] for result in results) for stage in stages}
+            cleaning = sum(entry['timing'][stage] for stage in ('parse', 'clean', 'text'))
+            entry['pages_per_sec'] = len(results) / cleaning if cleaning else 0.0
+            summary[cleaner] = entry
+        return summary
+
+    def display(self, summary=None):
+        summary = summary or self.summary()
+        header = f'{"cleaner":10} {"P":>6} {"R":>6} {"F1":>6} {"sim":>6} {"pages/s":>8}'
+        header += ''.join(f' {stage + " s":>9}' for stage in stages)
+        print(header)
+        for cleaner, entry in summary.items():
+            line = f'{cleaner:10} {entry["precision"]:6.3f} {entry["recall"]:6.3f} {entry["f1"]:6.3f} '
+            line += f'{entry["similarity"]:6.3f} {entry["pages_per_sec"]:8.1f}'
+            line += ''.join(f' {entry["timing"][stage]:9.4f}' for stage in stages)
+            print(line)
@@ -0,0 +1,289 @@
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import sqlite3
+import threading
+import zlib
+
+INDEX = 'index.sqlite'
+
+
+def open_store(path, backend=None, **kwargs):
+    '''
+    Opens the page store at path
+    backend is 'files' (one file per page) or 'segments' (compressed segment files);
+        by default an existing segment store is detected and 'files' used otherwise
+    '''
+    if backend is None:
+        backend = 'segments' if os.path.isfile(os.path.join(path, INDEX)) else 'files'
+    if backend == 'files':
+        return FilePageStore(path)
+    if backend == 'segments':
+        return SegmentPageStore(path, **kwargs)
+    raise ValueError(f'unknown page store backend {backend}')
+
+
+class FilePageStore:
+    '''
+    Page store keeping one file per page in a directory (the original repository layout)
+    '''
+    backend = 'files'
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def reset(self):
+        '''
+        Deletes every page
+        '''
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.mkdir(self.path)
+
+    def writer(self, key):
+        '''
+        Returns a writable binary file for key; the page replaces key when the writer
+            is closed, or is dropped if discard() was called first
+        '''
+        return FileWriter(os.path.join(self.path, key))
+
+    def put(self, key, data):
+        with self.writer(key) as f:
+            f.write(data)
+
+    def open(self, key):
+        return open(os.path.join(self.path, key), 'rb')
+
+    def get(self, key):
+        with self.open(key) as f:
+            return f.read()
+
+    def keys(self):
+        return [name for name in os.listdir(self.path) if not name.endswith('.part')]
+
+    def delete(self, key):
+        try:
+            os.remove(os.path.join(self.path, key))
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, key):
+        return os.path.isfile(os.path.join(self.path, key))
+
+    def version(self):
+        '''
+        Digest of the keys, sizes and modification times of the pages; changes
+            whenever a page is added, removed or rewritten
+        '''
+        digest = hashlib.blake2b(digest_size=16)
+        for key in sorted(self.keys()):
+            stat = os.stat(os.path.join(self.path, key))
+            digest.update(f'{key}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def close(self):
+        pass
+
+
+class FileWriter(io.FileIO):
+    def __init__(self, path):
+        self.target = path
+        self.discarded = False
+        super().__init__(f'{path}.part', 'wb')
+
+    def discard(self):
+        self.discarded = True
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.discard()
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        if self.discarded:
+            os.remove(f'{self.target}.part')
+        else:
+            os.replace(f'{self.target}.part', self.target)
+
+
+class SegmentWriter(io.BytesIO):
+    def __init__(self, store, key):
+        super().__init__()
+        self.store = store
+        self.key = key
+        self.discarded = False
+
+    def discard(self):
+        self.discarded = True
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.discard()
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        if not self.discarded:
+            self.store.put(self.key, self.getvalue())
+        super().close()
+
+
+class SegmentPageStore:
+    '''
+    Page store appending compressed records to a few large segment files
+    Each distinct body is stored once: pages are indexed by key -> sha256 digest,
+        digests by (segment, offset, length) in index.sqlite
+    A record is a header line b'PAGE <digest> <length>' followed by the compressed
+        body, similar to a WARC record, so segments can be scanned without the index
+    Segments are rotated once they exceed segment_size bytes
+    compression is 'gzip' or 'zstd' (needs the zstandard package)
+    Safe to share between threads; other processes can open the same store to read
+    '''
+    backend = 'segments'
+
+    def __init__(self, path, compression='gzip', segment_size=1 << 30):
+        self.path = path
+        self.compression = compression
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.segment = None
+        self.readers = {}
+        if compression == 'zstd':
+            import zstandard
+            self.compressor = zstandard.ZstdCompressor()
+            self.decompressor = zstandard.ZstdDecompressor()
+        elif compression != 'gzip':
+            raise ValueError(f'unknown compression {compression}')
+        os.makedirs(path, exist_ok=True)
+        self.connect()
+
+    def connect(self):
+        self.conn = sqlite3.connect(os.path.join(self.path, INDEX), check_same_thread=False)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, digest TEXT)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS bodies (digest TEXT PRIMARY KEY, segment INTEGER, '
+                              'offset INTEGER, length INTEGER, compression TEXT)')
+
+    def reset(self):
+        self.close()
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.mkdir(self.path)
+        self.connect()
+
+    def segment_path(self, number):
+        return os.path.join(self.path, f'segment-{number:05d}.seg')
+
+    def compress(self, data):
+        if self.compression == 'zstd':
+            return self.compressor.compress(data)
+        return gzip.compress(data, compresslevel=6)
+
+    def decompress(self, data, compression):
+        if compression == 'zstd':
+            return self.decompressor.decompress(data)
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+    def current_segment(self):
+        '''
+        Returns (number, file) of the segment to append to, rotating full segments
+        '''
+        if self.segment is None:
+            number = self.conn.execute('SELECT MAX(segment) FROM bodies').fetchone()[0] or 1
+            self.segment = (number, open(self.segment_path(number), 'ab'))
+        number, f = self.segment
+        if f.tell() >= self.segment_size:
+            f.close()
+            number += 1
+            self.segment = (number, open(self.segment_path(number), 'ab'))
+        return self.segment
+
+    def writer(self, key):
+        return SegmentWriter(self, key)
+
+    def put(self, key, data):
+        '''
+        Stores data under key; a body already in the store is only indexed again
+        '''
+        digest = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            known = self.conn.execute('SELECT 1 FROM bodies WHERE digest = ?', (digest,)).fetchone()
+            with self.conn:
+                if not known:
+                    record = self.compress(data)
+                    number, f = self.current_segment()
+                    f.write(f'PAGE {digest} {len(record)}\n'.encode('ascii'))
+                    offset = f.tell()
+                    f.write(record)
+                    f.flush()
+                    self.conn.execute('INSERT INTO bodies VALUES (?, ?, ?, ?, ?)',
+                                      (digest, number, offset, len(record), self.compression))
+                self.conn.execute('INSERT OR REPLACE INTO pages VALUES (?, ?)', (key, digest))
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute('SELECT b.segment, b.offset, b.length, b.compression FROM pages p '
+                                    'JOIN bodies b ON p.digest = b.digest WHERE p.key = ?', (key,)).fetchone()
+            if row is None:
+                raise KeyError(key)
+            number, offset, length, compression = row
+            if number not in self.readers:
+                self.readers[number] = open(self.segment_path(number), 'rb')
+            f = self.readers[number]
+            f.seek(offset)
+            record = f.read(length)
+        return self.decompress(record, compression)
+
+    def open(self, key):
+        return io.BytesIO(self.get(key))
+
+    def keys(self):
+        with self.lock:
+            return [key for key, in self.conn.execute('SELECT key FROM pages')]
+
+    def delete(self, key):
+        '''
+        Removes key from the index; its body stays in the segment (other pages may share it)
+        '''
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM pages WHERE key = ?', (key,))
+
+    def __contains__(self, key):
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM pages WHERE key = ?', (key,)).fetchone() is not None
+
+    def version(self):
+        '''
+        Digest of the keys and body digests of the pages; changes whenever a
+            page is added, removed or rewritten with a different body
+        '''
+        digest = hashlib.blake2b(digest_size=16)
+        with self.lock:
+            for key, body in self.conn.execute('SELECT key, digest FROM pages ORDER BY key'):
+                digest.update(f'{key}\0{body}\n'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def stats(self):
+        '''
+        Number of pages, distinct bodies and bytes on disk
+        '''
+        with self.lock:
+            pages = self.conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+            bodies, size = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(length), 0) FROM bodies').fetchone()
+        return {'pages': pages, 'bodies': bodies, 'bytes': size}
+
+    def close(self):
+        if self.segment is not None:
+            self.segment[1].close()
+            self.segment = None
+        for f in self.readers.values():
+            f.close()
+        self.readers = {}
+        self.conn.close()
@@ -0,0 +1,201 @@
+import heapq
+import threading
+import time
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+
+
+class HostScheduler:
+    '''
+    Per host politeness scheduling
+    Instead of sleeping for the crawl delay before every request, each host
+        has a next allowed time. A request reserves the next slot and the
+        host becomes ready again crawl_delay seconds later
+    Ready hosts are kept in a heap ordered by next allowed time
+    '''
+    def __init__(self, default_delay=.5):
+        self.default_delay = default_delay
+        self.delays = {}
+        self.next_allowed = {}
+        self.ready = []
+        self.lock = threading.Lock()
+
+    def set_delay(self, host, delay):
+        '''
+        Sets the crawl delay for host (e.g. from robots.txt)
+        '''
+        with self.lock:
+            self.delays[host] = delay
+
+    def delay(self, host):
+        return self.delays.get(host, self.default_delay)
+
+    def reserve(self, host, now=None):
+        '''
+        Reserves the next request slot for host
+        Returns the number of seconds until the request may be sent
+        '''
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            start = max(now, self.next_allowed.get(host, now))
+            self.next_allowed[host] = start + self.delays.get(host, self.default_delay)
+        return start - now
+
+    def push(self, host):
+        '''
+        Marks host as having work; it is returned by pop once its next allowed time is reached
+        '''
+        with self.lock:
+            heapq.heappush(self.ready, (self.next_allowed.get(host, 0), host))
+
+    def peek(self):
+        '''
+        Returns (next allowed time, host) of the earliest host, or None
+        '''
+        with self.lock:
+            return self.ready[0] if self.ready else None
+
+    def pop(self):
+        with self.lock:
+            return heapq.heappop(self.ready)
+
+    def __len__(self):
+        return len(self.ready)
+
+    def ready_at(self, host):
+        '''
+        Returns the next allowed time of host
+        '''
+        with self.lock:
+            return self.next_allowed.get(host, 0)
+
+
+# responses asking the crawler to slow down; their request may be retried
+RETRY_STATUSES = (429, 503)
+
+
+def parse_retry_after(value, now=None):
+    '''
+    Seconds to wait given a Retry-After header (delay seconds or an HTTP date),
+        or None if there is no valid one
+    '''
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    now = time.time() if now is None else now
+    return max(0.0, moment.timestamp() - now)
+
+
+class Throttled(Exception):
+    '''
+    Raised for a response in RETRY_STATUSES (see AutoThrottle.retry)
+    '''
+    def __init__(self, status, retry_after=None):
+        super().__init__(f'throttled with status {status}')
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AutoThrottle(HostScheduler):
+    '''
+    HostScheduler whose per host delays adapt to the responses, like Scrapy's AutoThrottle
+    The delay set with set_delay (the robots.txt Crawl-delay) is the host's floor;
+        after each response observe() moves the delay halfway towards
+        latency / target_concurrency, so on average target_concurrency requests
+        are open per host: fast hosts are crawled at the floor, slow ones are
+        spaced by their latency. Errors never lower the delay
+    A 429 or 503 doubles the delay (exponential backoff, up to max_delay) and,
+        with Retry-After, holds the host until then
+    retry() decides if a throttled request is retried: at most max_retries times
+        per url, and per host at most min_retries + retry_ratio * requests retries
+        in total (the retry budget), so a host that keeps refusing is not hammered;
+        a Retry-After longer than max_delay is not waited for (the host is held
+        max_delay)
+    '''
+    def __init__(self, default_delay=.5, target_concurrency=1.0, max_delay=60.0, max_retries=3,
+                 retry_ratio=.1, min_retries=10):
+        super().__init__(default_delay)
+        self.target_concurrency = target_concurrency
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.retry_ratio = retry_ratio
+        self.min_retries = min_retries
+        self.floors = {}
+        self.started = {}
+        self.requests = {}
+        self.retries = {}
+
+    def set_delay(self, host, delay):
+        '''
+        Sets the floor of host's delay (e.g. from robots.txt)
+        Until the first floor is known (e.g. for the robots.txt request itself)
+            the host is spaced by the default delay; the first floor replaces it
+        '''
+        with self.lock:
+            if host not in self.floors:
+                self.delays[host] = delay
+                if host in self.started:
+                    self.next_allowed[host] = min(self.next_allowed[host], self.started[host] + delay)
+            self.floors[host] = delay
+            self.delays[host] = max(self.delays[host], delay)
+
+    def reserve(self, host, now=None):
+        now = time.monotonic() if now is None else now
+        wait = super().reserve(host, now)
+        with self.lock:
+            self.started[host] = now + wait
+        return wait
+
+    def floor(self, host):
+        return self.floors.get(host, self.default_delay)
+
+    def observe(self, host, latency, status=None):
+        '''
+        Adapts host's delay to a response that took latency seconds
+        status None is a failed request
+        '''
+        with self.lock:
+            floor = self.floors.get(host, self.default_delay)
+            delay = self.delays.get(host, floor)
+            self.requests[host] = self.requests.get(host, 0) + 1
+            if status in RETRY_STATUSES:
+                delay = max(delay, floor, .1) * 2
+            else:
+                target = (delay + latency / self.target_concurrency) / 2
+                if status is not None and status < 400 or target > delay:
+                    delay = target
+            self.delays[host] = min(max(delay, floor), max(self.max_delay, floor))
+
+    def hold(self, host, seconds, now=None):
+        '''
+        Sends no request to host for seconds (at most max_delay)
+        '''
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            until = now + min(seconds, self.max_delay)
+            self.next_allowed[host] = max(self.next_allowed.get(host, now), until)
+
+    def retry(self, host, attempt, retry_after=None):
+        '''
+        Returns True if a request to host throttled for the attempt-th time
+            (from 0) may be retried, taking it from the host's retry budget;
+            with retry_after, host is held until then
+        '''
+        if retry_after is not None:
+            self.hold(host, retry_after)
+        with self.lock:
+            if attempt >= self.max_retries or retry_after is not None and retry_after > self.max_delay:
+                return False
+            retries = self.retries.get(host, 0)
+            if retries >= self.min_retries + self.retry_ratio * self.requests.get(host, 0):
+                return False
+            self.retries[host] = retries + 1
+            return True
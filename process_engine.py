@@ -0,0 +1,355 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+from multiprocessing.pool import ThreadPool
+from urllib.parse import urlsplit
+
+from budget import AtomicInt, PageBudget
+from frontier import FingerprintSet, Frontier, fingerprint, normalize_url
+from http_pool import ConnectionPool
+from metrics import Metrics
+from page_store import open_store
+from politeness import AutoThrottle
+from robots_cache import RobotsCache
+
+
+def partition(url, partitions):
+    '''
+    Number of the partition owning url's host
+    '''
+    return fingerprint(urlsplit(url).netloc) % partitions
+
+
+class QueueTransport:
+    '''
+    Carries links between the partitions of one machine: a multiprocessing queue
+        per partition, and shared memory counters
+    Any transport with the same methods can be given to ProcessCrawlEngine,
+        e.g. one sending links and counters to partitions on other nodes:
+        send(partition, links)       queues a list of (url, depth) for partition
+        receive(partition, timeout)  a list of links sent to partition, [] after
+                                     timeout seconds (None waits, 0 does not)
+        atomic_int(value)            an AtomicInt seen by every partition
+        page_budget(limit, used)     a PageBudget shared by every partition
+    '''
+    def __init__(self, partitions, context=None):
+        self.context = context or multiprocessing.get_context('spawn')
+        self.inboxes = [self.context.Queue() for _ in range(partitions)]
+
+    def send(self, partition, links):
+        self.inboxes[partition].put(links)
+
+    def receive(self, partition, timeout=None):
+        try:
+            if timeout == 0:
+                return self.inboxes[partition].get_nowait()
+            return self.inboxes[partition].get(timeout=timeout)
+        except queue.Empty:
+            return []
+
+    def atomic_int(self, value):
+        return AtomicInt.shared(value, self.context)
+
+    def page_budget(self, limit, used):
+        return PageBudget.shared(limit, used, self.context)
+
+
+class PartitionFrontier:
+    '''
+    Frontier of one partition: links to hosts the partition owns are queued in
+        its own Frontier, other links are collected per owner and sent by flush()
+    outstanding counts the links queued or in transit in every partition and
+        the pages being crawled; the crawl is over when it drops to 0
+    '''
+    def __init__(self, frontier, number, partitions, transport, outstanding):
+        self.frontier = frontier
+        self.number = number
+        self.partitions = partitions
+        self.transport = transport
+        self.outstanding = outstanding
+        self.sent = FingerprintSet()
+        self.outbox = {}
+
+    def add(self, url, priority=0):
+        try:
+            url = normalize_url(url)
+        except ValueError:
+            return None
+        if not url.startswith(('http://', 'https://')):
+            return None
+        owner = partition(url, self.partitions)
+        if owner == self.number:
+            if self.frontier.add(url, priority) is None:
+                return None
+            self.outstanding.add()
+            return url
+        if self.frontier.accept and not self.frontier.accept(url):
+            return None
+        if not self.sent.add(fingerprint(url)):
+            return None
+        self.outbox.setdefault(owner, []).append((url, priority))
+        return url
+
+    def add_all(self, urls, priority=0):
+        for url in urls:
+            self.add(url, priority)
+
+    def flush(self):
+        for owner, links in self.outbox.items():
+            self.outstanding.add(len(links))
+            self.transport.send(owner, links)
+        self.outbox = {}
+
+    def receive(self, links):
+        '''
+        Queues links sent by other partitions; links seen before are dropped
+        '''
+        for url, priority in links:
+            if self.frontier.add(url, priority) is None:
+                self.outstanding.add(-1)
+
+    def pending(self):
+        return self.frontier.pending()
+
+    def __len__(self):
+        return len(self.frontier)
+
+    def __bool__(self):
+        return bool(self.frontier)
+
+
+class PartitionCheckpoint:
+    '''
+    Takes the place of the crawler's CrawlCheckpoint in a worker: each save sends
+        the partition's changes since the last one (new files and near duplicates,
+        hosts visited, the frontier's journal and the urls taken but not crawled
+        yet) to the parent, which saves them in the crawl's checkpoint
+        (see ProcessCrawlEngine.save_partition)
+    '''
+    def __init__(self, number, results, crawler):
+        self.number = number
+        self.results = results
+        self.saved_files = len(crawler.repo_files)
+        self.saved_duplicates = len(crawler.duplicates)
+        self.saved_robots = set(crawler.visited_robots)
+
+    def save(self, crawler):
+        changes, seen = crawler.frontier.frontier.take_journal()
+        visited_robots = crawler.visited_robots - self.saved_robots
+        self.results.put(('checkpoint', {
+            'number': self.number,
+            'repo_files': dict(itertools.islice(crawler.repo_files.items(), self.saved_files, None)),
+            'duplicates': dict(itertools.islice(crawler.duplicates.items(), self.saved_duplicates, None)),
+            'visited_robots': visited_robots,
+            'changes': changes,
+            'seen': seen,
+            'taken': crawler.unprocessed_urls(),
+        }))
+        self.saved_files = len(crawler.repo_files)
+        self.saved_duplicates = len(crawler.duplicates)
+        self.saved_robots |= visited_robots
+
+
+def crawl_partition(crawler, number, partitions, threads, transport, budget, file_numbers, outstanding, robots,
+                    results, checkpoint):
+    '''
+    Runs in a worker process: crawls the hosts of partition number with the
+        crawler's own fetch, politeness and storage code, as the threaded engine
+        does (a batch of urls from the frontier, one thread per host), then sends
+        back what it found (see ProcessCrawlEngine.merge)
+    With checkpoint, the crawler's periodic checkpoints go to the parent
+        (see PartitionCheckpoint), the last one just before the results
+    '''
+    known = set(crawler.repo_files)
+    crawler.lock = threading.RLock()
+    crawler.metrics = Metrics()
+    crawler.pool = ConnectionPool(**crawler.pool_options)
+    crawler.robots = RobotsCache(None, ttl=crawler.robots_ttl)
+    crawler.robots.restore(robots)
+    crawler.throttle = AutoThrottle(**crawler.throttle_options)
+    crawler.store = open_store(crawler.repo, 'files')
+    crawler.checkpoint = PartitionCheckpoint(number, results, crawler) if checkpoint else None
+    crawler.near_index = None
+    if crawler.near_duplicates is not None:
+        from near_duplicates import SimHashIndex
+        crawler.near_index = SimHashIndex(crawler.near_duplicates)
+    crawler.budget = budget
+    crawler.file_numbers = file_numbers
+    frontier = Frontier(max_queued=crawler.max_queued, accept=crawler.check_link)
+    if checkpoint:
+        frontier.start_journal()
+    crawler.frontier = PartitionFrontier(frontier, number, partitions, transport, outstanding)
+    crawler.domain_dict = {}
+
+    def crawl_host(host):
+        for url, depth in crawler.domain_dict[host]:
+            if budget.exhausted():
+                return
+            try:
+                crawler.process_url(url, depth)
+            finally:
+                with crawler.lock:
+                    crawler.frontier.flush()
+                outstanding.add(-1)
+
+    pool = ThreadPool(threads)
+    while not budget.exhausted():
+        crawler.frontier.receive(transport.receive(number, 0 if crawler.frontier else 0.05))
+        if not crawler.frontier:
+            if outstanding.value == 0:
+                break
+            continue
+        crawler.domain_dict = frontier.pop_batch(crawler.batch_size)
+        pool.map(crawl_host, list(crawler.domain_dict))
+    pool.close()
+    pool.join()
+
+    crawler.pool.close()
+    crawler.store.close()
+    crawler.save_checkpoint()
+    results.put(('done', {
+        'number': number,
+        'repo_files': {url: entry for url, entry in crawler.repo_files.items() if url not in known},
+        'duplicates': crawler.duplicates,
+        'visited_robots': crawler.visited_robots,
+        'robots': crawler.robots.dump(),
+        'metrics': crawler.metrics.dump(),
+        'pending': crawler.frontier.pending() + crawler.unprocessed_urls(),
+        'seen': list(frontier.seen),
+    }))
+
+
+class ProcessCrawlEngine:
+    '''
+    Multi-process fetch engine for WebCrawler
+    Hosts are hash partitioned across workers processes (all cores by default).
+        Each worker owns its hosts' frontier, robots.txt rules and politeness, and
+        crawls them with the crawler's threaded code (threads per worker); links to
+        hosts of other partitions are routed to their owner through the transport
+        (by default QueueTransport, one queue per worker)
+    The num_pages budget is a PageBudget shared by the workers, so together
+        they store exactly num_pages pages
+    Every checkpoint_every pages of a worker, its changes are merged into the
+        crawler and saved in its checkpoint (see save_partition); links in transit
+        between workers are not checkpointed
+    When the workers finish, their files, robots, metrics and unfinished
+        frontiers are merged into the crawler, which checkpoints them as usual
+    Pages are written by the workers directly, so the repository must use the
+        'files' backend; near duplicates are only found within a partition
+    '''
+    def __init__(self, crawler, workers=None, threads=8, transport=None):
+        self.crawler = crawler
+        self.workers = workers or os.cpu_count() or 1
+        self.threads = threads
+        self.transport = transport or QueueTransport(self.workers)
+
+    def run(self):
+        crawler = self.crawler
+        if crawler.store.backend != 'files':
+            raise ValueError("the processes engine needs the 'files' repository backend")
+        transport = self.transport
+        budget = transport.page_budget(crawler.num_pages, crawler.file_count)
+        file_numbers = transport.atomic_int(crawler.file_number)
+        outstanding = transport.atomic_int(0)
+        context = getattr(transport, 'context', multiprocessing.get_context('spawn'))
+        results = context.Queue()
+
+        # the workers own the links; the crawler's frontier keeps the seen urls
+        links = [crawler.frontier.pop() for _ in range(len(crawler.frontier))] + crawler.unprocessed_urls()
+        crawler.domain_dict = {}
+        if crawler.frontier.mark_seen(crawler.seed) and crawler.seed not in crawler.repo_files:
+            links.append((crawler.seed, 0))
+        self.route(links, outstanding)
+
+        robots = crawler.robots.dump()
+        processes = [context.Process(target=crawl_partition,
+                                     args=(crawler, number, self.workers, self.threads, transport, budget,
+                                           file_numbers, outstanding, robots, results, crawler.checkpoint is not None))
+                     for number in range(self.workers)]
+        for process in processes:
+            process.start()
+        found = []
+        while len(found) < len(processes):
+            try:
+                kind, result = results.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+            if kind == 'checkpoint':
+                self.save_partition(result, file_numbers)
+            else:
+                found.append(result)
+        # links still in transit belong to the frontier; reading them also lets
+        # the workers' queue feeders finish so the workers can exit
+        leftover = []
+        while any(process.is_alive() for process in processes):
+            leftover += self.drain()
+            for process in processes:
+                process.join(.05)
+        leftover += self.drain()
+        crawler.domain_dict = {}
+        self.merge(sorted(found, key=lambda result: result['number']), leftover)
+        crawler.file_number = file_numbers.value
+        crawler.file_count = budget.used
+
+    def save_partition(self, state, file_numbers):
+        '''
+        Merges a worker's changes since its last checkpoint (see PartitionCheckpoint)
+            into the crawler and saves its checkpoint
+        The worker's urls taken but not crawled yet stand in domain_dict until the next one
+        '''
+        crawler = self.crawler
+        with crawler.lock:
+            crawler.repo_files.update(state['repo_files'])
+            crawler.file_count += len(state['repo_files'])
+            crawler.file_number = file_numbers.value
+            crawler.duplicates.update(state['duplicates'])
+            crawler.visited_robots.update(state['visited_robots'])
+            for fp in state['seen']:
+                crawler.frontier.seen.add(fp)
+            crawler.domain_dict[state['number']] = state['taken']
+            crawler.checkpoint.save(crawler, state['changes'])
+
+    def route(self, links, outstanding):
+        batches = {}
+        for url, depth in links:
+            batches.setdefault(partition(normalize_url(url), self.workers), []).append((url, depth))
+        for number, batch in batches.items():
+            outstanding.add(len(batch))
+            self.transport.send(number, batch)
+
+    def drain(self):
+        links = []
+        for number in range(self.workers):
+            while True:
+                batch = self.transport.receive(number, 0)
+                if not batch:
+                    break
+                links += batch
+        return links
+
+    def merge(self, found, leftover):
+        '''
+        Adds the workers' results to the crawler: new files in file number order,
+            near duplicates, robots, metrics and the links not crawled yet
+        '''
+        crawler = self.crawler
+        files = {}
+        for result in found:
+            files.update(result['repo_files'])
+            crawler.duplicates.update(result['duplicates'])
+            crawler.visited_robots.update(result['visited_robots'])
+            crawler.robots.restore(result['robots'])
+            crawler.metrics.merge(result['metrics'])
+            for fp in result['seen']:
+                crawler.frontier.seen.add(fp)
+        for url, entry in sorted(files.items(), key=lambda item: int(item[1]['filename'].split('.')[0])):
+            crawler.repo_files[url] = entry
+        for result in found:
+            for url, depth in result['pending']:
+                crawler.frontier.requeue(url, depth)
+        for url, depth in leftover:
+            crawler.frontier.add(url, depth)
@@ -0,0 +1,139 @@
+import csv
+import json
+import os
+from collections import Counter
+from html import escape
+
+columns = ('url', 'file', 'status', 'links', 'images')
+header = '<table><tr><td>Live URL</td><td>File</td><td>Status</td><td># Links</td><td># Images</td></tr>\n'
+
+
+def html_row(row):
+    url = escape(row['url'].rstrip('/'), quote=True)
+    return (f'<tr><td><a href="{url}">{url}</a></td><td><a href="{escape(row["file"], quote=True)}">'
+            f'{escape(row["url"])}</a></td><td>{row["status"]}</td><td>{row["links"]}</td>'
+            f'<td>{row["images"]}</td></tr>\n')
+
+
+def page_path(path, page):
+    '''
+    Path of page number page (from 1) of a paginated html report: report.html,
+        report-2.html, report-3.html...
+    '''
+    if page == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}-{page}{ext}'
+
+
+class CrawlReport:
+    '''
+    Report of the pages a WebCrawler stored (its repo_files), one row per page:
+        url, file (in the repository), status, links and images
+    Rows are generated from repo_files and written to disk one at a time, so
+        writing a report does not build it in memory:
+        write_html   html table, split in pages of page_size rows linked to each
+                     other (report.html, report-2.html...) if page_size is given
+        write_csv    csv with a header line
+        write_jsonl  one json object per line
+    display() renders only a summary and the first rows in a notebook
+    '''
+    writers = ('html', 'csv', 'jsonl')
+
+    def __init__(self, repo_files, repo='repository'):
+        self.repo_files = repo_files
+        self.repo = repo
+
+    def rows(self):
+        for url, entry in self.repo_files.items():
+            yield {'url': url, 'file': f'{self.repo}/{entry["filename"]}', 'status': entry.get('status'),
+                   'links': entry.get('links', 0), 'images': entry.get('images', 0)}
+
+    def write(self, path='report.html', formats=('html',), page_size=None):
+        '''
+        Writes the report in each of formats, next to path with the format's extension
+        Returns the paths written
+        '''
+        root = os.path.splitext(path)[0]
+        paths = []
+        for fmt in formats:
+            if fmt not in self.writers:
+                raise ValueError(f'unknown report format {fmt!r}, expected one of {self.writers}')
+            if fmt == 'html':
+                paths += self.write_html(f'{root}.html', page_size)
+            else:
+                paths.append(getattr(self, f'write_{fmt}')(f'{root}.{fmt}'))
+        return paths
+
+    def write_html(self, path='report.html', page_size=None):
+        '''
+        Returns the paths of the pages written
+        '''
+        pages = max(1, -(-len(self.repo_files) // page_size)) if page_size else 1
+        paths = []
+        rows = self.rows()
+        for page in range(1, pages + 1):
+            paths.append(page_path(path, page))
+            with open(paths[-1], 'w', encoding='utf-8') as f:
+                f.write('<html><body>\n')
+                if pages > 1:
+                    f.write(self.navigation(path, page, pages))
+                f.write(header)
+                for count, row in enumerate(rows, 1):
+                    f.write(html_row(row))
+                    if page < pages and count == page_size:
+                        break
+                f.write('</table>\n</body></html>\n')
+        return paths
+
+    def navigation(self, path, page, pages):
+        links = [f'Page {page} of {pages}']
+        if page > 1:
+            links.append(f'<a href="{os.path.basename(page_path(path, page - 1))}">previous</a>')
+        if page < pages:
+            links.append(f'<a href="{os.path.basename(page_path(path, page + 1))}">next</a>')
+        return f'<p>{" | ".join(links)}</p>\n'
+
+    def write_csv(self, path='report.csv'):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(self.rows())
+        return path
+
+    def write_jsonl(self, path='report.jsonl'):
+        with open(path, 'w', encoding='utf-8') as f:
+            for row in self.rows():
+                f.write(json.dumps(row) + '\n')
+        return path
+
+    def summary(self):
+        '''
+        Pages, pages per status, and total links and images
+        '''
+        statuses = Counter()
+        links = images = 0
+        for row in self.rows():
+            statuses[row['status']] += 1
+            links += row['links'] or 0
+            images += row['images'] or 0
+        return {'pages': sum(statuses.values()), 'statuses': dict(statuses), 'links': links, 'images': images}
+
+    def display(self, rows=20):
+        '''
+        For jupyter notebook, displays the summary and a table of the first rows pages
+        '''
+        from IPython.display import HTML, display
+
+        summary = self.summary()
+        statuses = ', '.join(f'{status}: {count}' for status, count in sorted(summary['statuses'].items(), key=str))
+        parts = [f'<p>{summary["pages"]} pages ({statuses}), {summary["links"]} links, '
+                 f'{summary["images"]} images</p>', header]
+        for count, row in enumerate(self.rows()):
+            if count == rows:
+                break
+            parts.append(html_row(row))
+        parts.append('</table>')
+        if summary['pages'] > rows:
+            parts.append(f'<p>First {rows} of {summary["pages"]} pages, see the written report for all</p>')
+        display(HTML(''.join(parts)))
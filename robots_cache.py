@@ -0,0 +1,206 @@
+import json
+import os
+import re
+import threading
+import time
+
+
+class RobotsRules:
+    '''
+    Compiled Allow/Disallow rules, crawl delay and sitemaps of one robots.txt
+    Matching follows the robots exclusion standard: the longest matching rule
+        wins and Allow wins a tie. Plain prefixes are matched by walking a
+        character trie once over the path; rules with * or $ are compiled to regexes
+    '''
+    def __init__(self, allow=(), disallow=(), crawl_delay=None, sitemaps=()):
+        self.allow = list(allow)
+        self.disallow = list(disallow)
+        self.crawl_delay = crawl_delay
+        self.sitemaps = list(sitemaps)
+        self.compile()
+
+    @classmethod
+    def parse(cls, text, agent='*'):
+        '''
+        Parses robots.txt text, using the group for agent (falling back to the * group)
+        '''
+        groups = {}
+        sitemaps = []
+        agents = []
+        in_rules = False
+        for line in text.splitlines():
+            line = line.split('#', 1)[0].strip()
+            if ':' not in line:
+                continue
+            field, value = line.split(':', 1)
+            field, value = field.strip().lower(), value.strip()
+            if field == 'user-agent':
+                if in_rules:
+                    agents = []
+                    in_rules = False
+                agents.append(value.lower())
+                for name in agents:
+                    groups.setdefault(name, {'allow': [], 'disallow': [], 'crawl-delay': None})
+            elif field == 'sitemap':
+                sitemaps.append(value)
+            elif field in ('allow', 'disallow', 'crawl-delay'):
+                in_rules = True
+                for name in agents:
+                    if field == 'crawl-delay':
+                        try:
+                            groups[name][field] = float(value)
+                        except ValueError:
+                            pass
+                    elif value:
+                        groups[name][field].append(value)
+
+        group = groups.get(agent.lower()) or groups.get('*') or {'allow': [], 'disallow': [], 'crawl-delay': None}
+        return cls(group['allow'], group['disallow'], group['crawl-delay'], sitemaps)
+
+    def compile(self):
+        self.trie = {}
+        self.patterns = []
+        for allowed, rules in ((True, self.allow), (False, self.disallow)):
+            for rule in rules:
+                if '*' in rule or rule.endswith('$'):
+                    regex = re.escape(rule).replace(r'\*', '.*')
+                    if regex.endswith(r'\$'):
+                        regex = regex[:-2] + '$'
+                    self.patterns.append((len(rule), allowed, re.compile(regex)))
+                else:
+                    node = self.trie
+                    for char in rule:
+                        node = node.setdefault(char, {})
+                    # Allow wins a tie, so it is never overwritten by an equal Disallow
+                    node[None] = node.get(None, False) or allowed
+
+    def match(self, path):
+        '''
+        Returns (length, allowed) of the longest rule matching path, or None
+        '''
+        best = None
+        node = self.trie
+        for depth, char in enumerate(path):
+            if None in node:
+                best = (depth, node[None])
+            node = node.get(char)
+            if node is None:
+                break
+        else:
+            if None in node:
+                best = (len(path), node[None])
+        for length, allowed, regex in self.patterns:
+            if regex.match(path) and (best is None or length > best[0] or (length == best[0] and allowed)):
+                best = (length, allowed)
+        return best
+
+    def allowed(self, path):
+        best = self.match(path or '/')
+        return best is None or best[1]
+
+    def as_dict(self):
+        return {'allow': self.allow, 'disallow': self.disallow,
+                'crawl_delay': self.crawl_delay, 'sitemaps': self.sitemaps}
+
+
+class RobotsCache:
+    '''
+    Thread safe robots.txt cache keyed by scheme://host
+    Entries expire after ttl seconds (retry_ttl for robots that could not be fetched)
+    If path is given the cache is loaded from and saved to that json file,
+        so a restarted crawl does not fetch robots.txt again
+    '''
+    def __init__(self, path=None, ttl=24 * 60 * 60, retry_ttl=5 * 60, agent='*'):
+        self.path = path
+        self.ttl = ttl
+        self.retry_ttl = retry_ttl
+        self.agent = agent
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.host_locks = {}
+        if path and os.path.isfile(path):
+            self.load()
+
+    def lookup(self, base_url):
+        '''
+        Returns the cached RobotsRules for base_url, or None if missing or expired
+        '''
+        with self.lock:
+            entry = self.entries.get(base_url)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[0]
+
+    def store(self, base_url, text=None, ok=True):
+        '''
+        Parses and caches robots.txt text for base_url
+        text None means there is no robots.txt (allow everything); ok False
+            means the fetch failed and the host should be retried after retry_ttl
+        '''
+        rules = RobotsRules.parse(text, self.agent) if text else RobotsRules()
+        expires = time.time() + (self.ttl if ok else self.retry_ttl)
+        with self.lock:
+            self.entries[base_url] = (rules, expires)
+        return rules
+
+    def get(self, base_url, fetch):
+        '''
+        Returns the RobotsRules for base_url, calling fetch(base_url) on a miss
+        fetch returns (text, ok) as taken by store
+        Only one thread fetches a given host at a time
+        '''
+        rules = self.lookup(base_url)
+        if rules is not None:
+            return rules
+        with self.lock:
+            host_lock = self.host_locks.setdefault(base_url, threading.Lock())
+        with host_lock:
+            rules = self.lookup(base_url)
+            if rules is None:
+                rules = self.store(base_url, *fetch(base_url))
+        return rules
+
+    def allowed(self, base_url, path):
+        '''
+        Returns False only if base_url's cached rules disallow path
+        '''
+        rules = self.lookup(base_url)
+        return rules is None or rules.allowed(path)
+
+    def __contains__(self, base_url):
+        return self.lookup(base_url) is not None
+
+    def dump(self):
+        '''
+        Returns the cache as a json serializable dict
+        '''
+        with self.lock:
+            return {base_url: dict(rules.as_dict(), expires=expires)
+                    for base_url, (rules, expires) in self.entries.items()}
+
+    def restore(self, data):
+        '''
+        Adds the unexpired entries of a dict made by dump
+        '''
+        now = time.time()
+        with self.lock:
+            for base_url, entry in data.items():
+                if entry['expires'] > now:
+                    rules = RobotsRules(entry['allow'], entry['disallow'], entry['crawl_delay'], entry['sitemaps'])
+                    self.entries[base_url] = (rules, entry['expires'])
+
+    def load(self):
+        with open(self.path) as f:
+            self.restore(json.load(f))
+
+    def save(self):
+        '''
+        Atomically writes the cache to path
+        '''
+        if not self.path:
+            return
+        data = self.dump()
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
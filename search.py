@@ -0,0 +1,173 @@
+import heapq
+import math
+from collections import Counter
+import numpy as np
+from analyze import word_re
+from indexer import Indexer
+
+
+class Searcher:
+    '''
+    BM25 ranked keyword queries over the index built by Indexer
+    Top-k is found with MaxScore pruning, term at a time: query terms are scored in
+        decreasing order of their score upper bound; once the upper bounds of the
+        terms left sum to less than the k-th best partial score (the threshold),
+        no new document can enter the top k, so only the current candidates are
+        scored and candidates that cannot reach the threshold are dropped
+    Postings are read block by block (see indexer.SegmentBuilder): a block whose
+        best score plus the bounds of the terms left cannot reach the threshold
+        brings in no new document, so it is only decoded if it holds a candidate,
+        and a candidate is dropped without decoding if even the best score of its
+        block cannot lift it to the threshold; once no candidate is left the
+        remaining terms are not read at all
+    The threshold is carried from segment to segment in a heap of the best k results
+    Document frequencies and lengths count live documents only, so deleted
+        documents do not change the scores
+    '''
+    def __init__(self, path='index', k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.index = Indexer(path)
+        self.segments = self.index.segments
+        self.docs = sum(int(segment.live.sum()) for segment in self.segments)
+        total = sum(int(np.asarray(segment.lengths)[segment.live].sum()) for segment in self.segments)
+        self.avgdl = total / self.docs if self.docs else 1.0
+
+    def idf(self, df):
+        return math.log(1 + (self.docs - df + 0.5) / (df + 0.5))
+
+    def bm25(self, idf, tfs, lengths):
+        tfs = tfs.astype(np.float64)
+        return idf * tfs * (self.k1 + 1) / (tfs + self.k1 * (1 - self.b + self.b * lengths / self.avgdl))
+
+    def query_terms(self, query):
+        '''
+        Returns {term: (weight, {segment number: dictionary entry})} for the query terms found in the index
+        weight is the term's idf times its count in the query
+        '''
+        terms = {}
+        for term, count in Counter(word_re.findall(query.lower())).items():
+            entries = {}
+            for number, segment in enumerate(self.segments):
+                entry = segment.lookup(term)
+                if entry is not None:
+                    entries[number] = entry
+            df = sum(self.live_df(self.segments[number], entry) for number, entry in entries.items())
+            if df:
+                terms[term] = (self.idf(df) * count, entries)
+        return terms
+
+    @staticmethod
+    def live_df(segment, entry):
+        if not segment.deleted:
+            return int(entry['df'])
+        docs, _ = segment.postings(entry)
+        return int(segment.live[docs].sum())
+
+    def search(self, query, k=10, prune=True):
+        '''
+        Returns the k best (url, score) pairs for query; the file key stands in for an unknown url
+        With prune False every posting is scored (for checking the pruned results)
+        '''
+        if k <= 0:
+            return []
+        terms = self.query_terms(query)
+        heap = []
+        for number, segment in enumerate(self.segments):
+            lists = [(weight, entries[number]) for weight, entries in terms.values() if number in entries]
+            if not lists:
+                continue
+            threshold = heap[0][0] if len(heap) == k else 0.0
+            docs, scores = self.search_segment(segment, lists, k, threshold if prune else None)
+            for doc, score in zip(docs.tolist(), scores.tolist()):
+                item = (score, -number, -doc)
+                if len(heap) < k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+        results = []
+        for score, number, doc in sorted(heap, reverse=True):
+            key, url = self.segments[-number].docs[-doc]
+            results.append((url or key, score))
+        return results
+
+    def upper_bound(self, weight, entry):
+        # BM25 grows with tf and shrinks with document length
+        return float(self.bm25(weight, np.array([entry['max_tf']]), np.array([entry['min_length']]))[0])
+
+    def score_blocks(self, segment, weight, entry, docs, scores, remaining, threshold, bounds):
+        '''
+        Adds the term's scores from the posting blocks that matter: blocks whose
+            best score (bounds) plus remaining (the bound of the terms after this one)
+            reaches threshold may bring in new documents, other blocks are only decoded
+            for the candidates docs that can still reach threshold
+        Returns the candidates and their scores
+        '''
+        skips = segment.blocks(entry)
+        block = np.searchsorted(skips['last_doc'], docs)
+        inside = block < len(skips)
+        block = np.minimum(block, len(skips) - 1)
+        keep = scores + np.where(inside, bounds[block], 0.0) + remaining >= threshold
+        docs, scores, block, inside = docs[keep], scores[keep], block[keep], inside[keep]
+        opening = bounds + remaining >= threshold
+        numbers = np.union1d(np.flatnonzero(opening), block[inside])
+        if not len(numbers):
+            return docs, scores
+        postings, tfs = segment.block_postings(entry, numbers)
+        live = segment.live[postings]
+        if not opening[numbers].all():
+            # postings of blocks read only for the candidates are not new documents
+            live &= opening[np.searchsorted(skips['last_doc'], postings)] | np.isin(postings, docs)
+        postings, tfs = postings[live], tfs[live]
+        term_scores = self.bm25(weight, tfs, np.asarray(segment.lengths)[postings])
+        if not len(docs):
+            return postings, term_scores
+        docs, inverse = np.unique(np.concatenate((docs, postings)), return_inverse=True)
+        return docs, np.bincount(inverse, np.concatenate((scores, term_scores)), minlength=len(docs))
+
+    @staticmethod
+    def kth_score(scores, k, threshold):
+        if len(scores) < k:
+            return threshold
+        return max(threshold, float(np.partition(scores, len(scores) - k)[len(scores) - k]))
+
+    def search_segment(self, segment, lists, k, threshold):
+        '''
+        Top k candidates (local doc ids, scores) of one segment
+        threshold is the k-th best score found so far, or None to score exhaustively
+        '''
+        lists = sorted(((self.upper_bound(weight, entry), weight, entry) for weight, entry in lists),
+                       key=lambda item: item[0], reverse=True)
+        docs = np.zeros(0, dtype=np.int64)
+        scores = np.zeros(0, dtype=np.float64)
+        for i, (bound, weight, entry) in enumerate(lists):
+            # upper bound of the score still to come from the terms after this one
+            remaining = sum(bound for bound, _, _ in lists[i + 1:])
+            if threshold is None:
+                postings, tfs = segment.postings(entry)
+                live = segment.live[postings]
+                postings, tfs = postings[live], tfs[live]
+                term_scores = self.bm25(weight, tfs, np.asarray(segment.lengths)[postings])
+                docs, inverse = np.unique(np.concatenate((docs, postings)), return_inverse=True)
+                scores = np.bincount(inverse, np.concatenate((scores, term_scores)), minlength=len(docs))
+                continue
+            if not len(docs) and bound + remaining < threshold:
+                # no document can reach the threshold any more: the other lists are not read
+                break
+            skips = segment.blocks(entry)
+            bounds = self.bm25(weight, skips['max_tf'], skips['min_length'].astype(np.float64))
+            docs, scores = self.score_blocks(segment, weight, entry, docs, scores, remaining, threshold, bounds)
+            threshold = self.kth_score(scores, k, threshold)
+            keep = scores + remaining >= threshold
+            docs, scores = docs[keep], scores[keep]
+        if len(scores) > k:
+            top = np.argpartition(scores, len(scores) - k)[len(scores) - k:]
+            docs, scores = docs[top], scores[top]
+        return docs, scores
+
+
+def search(query, k=10, path='index'):
+    '''
+    Returns the k best (url, score) pairs for query from the index at path
+    '''
+    return Searcher(path).search(query, k)
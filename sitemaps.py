@@ -0,0 +1,194 @@
+import gzip
+import heapq
+import io
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+from urllib.parse import urljoin, urlsplit
+from xml.etree.ElementTree import ParseError, iterparse
+
+import requests
+
+# limits of one sitemap file (sitemaps.org)
+MAX_BYTES = 50 * 1024 * 1024
+MAX_ENTRIES = 50000
+
+
+class SitemapError(Exception):
+    pass
+
+
+class LimitedReader(io.RawIOBase):
+    '''
+    Binary stream reading at most max_bytes from raw (raises SitemapError beyond)
+    '''
+    def __init__(self, raw, max_bytes=MAX_BYTES):
+        self.raw = raw
+        self.max_bytes = max_bytes
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.raw.read(len(buffer))
+        self.count += len(data)
+        if self.count > self.max_bytes:
+            raise SitemapError(f'sitemap larger than {self.max_bytes} bytes')
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def open_sitemap(raw, max_bytes=MAX_BYTES):
+    '''
+    Buffered binary stream of a sitemap body, gunzipped if it is gzip data
+        (a .xml.gz file, whatever its Content-Type); max_bytes bounds both the
+        compressed and the uncompressed size
+    '''
+    stream = io.BufferedReader(LimitedReader(raw, max_bytes))
+    if stream.peek(2)[:2] == b'\x1f\x8b':
+        stream = io.BufferedReader(LimitedReader(gzip.GzipFile(fileobj=stream), max_bytes))
+    return stream
+
+
+def parse_lastmod(text):
+    '''
+    POSIX timestamp of a W3C datetime (2004, 2004-12, 2004-12-23, 2004-12-23T18:00:15+00:00...),
+        or None if text is not one
+    '''
+    text = (text or '').strip()
+    try:
+        if len(text) == 4:
+            moment = datetime(int(text), 1, 1)
+        elif len(text) == 7:
+            moment = datetime(int(text[:4]), int(text[5:7]), 1)
+        else:
+            moment = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def iter_sitemap(stream, max_entries=MAX_ENTRIES):
+    '''
+    Yields (kind, loc, lastmod) for the entries of a sitemap read from a binary
+        stream: kind is 'url' in a urlset and 'sitemap' in a sitemap index,
+        lastmod a timestamp or None
+    The XML is parsed incrementally and each entry dropped once read, so memory
+        does not grow with the sitemap; a plain text sitemap (one url per line)
+        is read line by line
+    '''
+    start = stream.peek(64)[:64].lstrip(b'\xef\xbb\xbf \t\r\n')
+    if start and not start.startswith(b'<'):
+        for count, line in enumerate(stream):
+            if count >= max_entries:
+                return
+            # the first line may start with a byte order mark
+            loc = line.decode('utf-8-sig' if count == 0 else 'utf-8', 'replace').strip()
+            if loc:
+                yield 'url', loc, None
+        return
+    root = None
+    count = 0
+    for event, element in iterparse(stream, events=('start', 'end')):
+        if root is None:
+            root = element
+            continue
+        if event != 'end':
+            continue
+        kind = element.tag.rsplit('}', 1)[-1]
+        if kind not in ('url', 'sitemap'):
+            continue
+        loc = lastmod = None
+        for child in element:
+            name = child.tag.rsplit('}', 1)[-1]
+            if name == 'loc':
+                loc = (child.text or '').strip()
+            elif name == 'lastmod':
+                lastmod = parse_lastmod(child.text)
+        root.clear()
+        if loc:
+            yield kind, loc, lastmod
+            count += 1
+            if count >= max_entries:
+                return
+
+
+class SitemapReader:
+    '''
+    Discovers the urls of a host from its sitemaps
+    Starts from the sitemaps listed in the host's robots.txt (or /sitemap.xml)
+        and follows sitemap indexes breadth first, reading at most max_sitemaps
+        files; each is streamed from the pool and parsed incrementally (gzip
+        included), waiting delay seconds between requests
+    Only urls of the host that its robots rules allow are kept
+    '''
+    def __init__(self, pool, delay=0, max_sitemaps=100, max_bytes=MAX_BYTES, metrics=None):
+        self.pool = pool
+        self.delay = delay
+        self.max_sitemaps = max_sitemaps
+        self.max_bytes = max_bytes
+        self.metrics = metrics
+        self.errors = 0
+
+    def urls(self, base_url, rules):
+        '''
+        Yields (url, lastmod) for the allowed urls of base_url's sitemaps
+        '''
+        queue = deque(urljoin(base_url, sitemap) for sitemap in rules.sitemaps or ['/sitemap.xml'])
+        seen = set(queue)
+        fetched = 0
+        while queue and fetched < self.max_sitemaps:
+            sitemap = queue.popleft()
+            if fetched and self.delay:
+                time.sleep(self.delay)
+            fetched += 1
+            for kind, loc, lastmod in self.read(sitemap):
+                loc = urljoin(sitemap, loc)
+                if kind == 'sitemap':
+                    if loc not in seen:
+                        seen.add(loc)
+                        queue.append(loc)
+                    continue
+                parts = urlsplit(loc)
+                if f'{parts.scheme}://{parts.netloc}' != base_url:
+                    continue
+                if rules.allowed(parts.path + (f'?{parts.query}' if parts.query else '')):
+                    yield loc, lastmod
+
+    def read(self, sitemap):
+        '''
+        Yields the entries of one sitemap; a sitemap that cannot be fetched or
+            parsed ends early and is counted in errors
+        '''
+        try:
+            with self.pool.get(sitemap, stream=True) as r:
+                if r.status_code >= 400:
+                    self.error()
+                    return
+                r.raw.decode_content = True
+                self.count('sitemaps_fetched')
+                yield from iter_sitemap(open_sitemap(r.raw, self.max_bytes))
+        except (requests.RequestException, ParseError, SitemapError, OSError, EOFError, zlib.error):
+            self.error()
+
+    def newest(self, base_url, rules, limit):
+        '''
+        The limit allowed urls with the latest lastmod (undated ones last), newest first
+            and in sitemap order among equal dates
+        Only limit entries are held while the sitemaps are read
+        '''
+        entries = ((lastmod if lastmod is not None else float('-inf'), -number, url)
+                   for number, (url, lastmod) in enumerate(self.urls(base_url, rules)))
+        return [url for _, _, url in heapq.nlargest(limit, entries)]
+
+    def error(self):
+        self.errors += 1
+        self.count('sitemap_errors')
+
+    def count(self, name):
+        if self.metrics is not None:
+            self.metrics.inc(name)
@@ -0,0 +1,84 @@
+import io
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from analyze import Analyze, count_stream, word_re
+from page_store import open_store
+
+TEXT = ('Zipf’s law: the_word Ünïcödé straße 42 x42 42x — 東京 タワー, naïve café… '
+        'FOO foo Foo, line\nbreak\ttab, snake_case_words and 😀emoji😀 between').encode('utf-8')
+
+
+def expected_counts(data):
+    return Counter(word_re.findall(data.decode('utf-8', 'replace').lower()))
+
+
+@pytest.mark.parametrize('size', list(range(1, 17)) + [31, 64, 1 << 20])
+def test_count_stream_chunk_sizes(size):
+    assert count_stream(io.BytesIO(TEXT), Counter(), size) == expected_counts(TEXT)
+
+
+def test_count_stream_invalid_utf8():
+    data = b'abc\xffdef gh\xe2\x82 ij' + TEXT[:-1]
+    for size in range(1, 9):
+        assert count_stream(io.BytesIO(data), Counter(), size) == expected_counts(data)
+
+
+def test_count_stream_random_text():
+    rng = random.Random(1)
+    words = ['a', 'bc', 'déf', '東京', '_', 'x1', '😀']
+    data = ''.join(rng.choice(words) + rng.choice(' ,.\n') * rng.randint(0, 2) for _ in range(2000)).encode('utf-8')
+    for size in (1, 2, 3, 5, 7, 100):
+        assert count_stream(io.BytesIO(data), Counter(), size) == expected_counts(data)
+
+
+@pytest.fixture
+def processed(tmp_path):
+    rng = random.Random(2)
+    words = [f'w{i}' for i in range(500)]
+    weights = [1 / (i + 1) for i in range(500)]
+    store = open_store(str(tmp_path / 'processed'), 'files')
+    texts = {f'{i}.html': ' '.join(rng.choices(words, weights, k=rng.randint(1, 200))) for i in range(60)}
+    for key, text in texts.items():
+        store.put(key, text.encode('utf-8'))
+    store.close()
+    return str(tmp_path / 'processed'), texts
+
+
+def test_analyze_counts(processed):
+    repo, texts = processed
+    analysis = Analyze(repo, cache=None)
+    counts = sum((expected_counts(text.encode('utf-8')) for text in texts.values()), Counter())
+    assert analysis.counter == counts
+    assert analysis.total_words == sum(counts.values())
+    assert analysis.frequencies.tolist() == sorted(counts.values(), reverse=True)
+    assert [counts[word] for word in analysis.most_frequent_words] == analysis.frequencies[:100].tolist()
+
+
+def test_analyze_workers_match_serial(processed):
+    repo, _ = processed
+    serial = Analyze(repo, cache=None)
+    for workers, shards in ((2, None), (3, 7)):
+        parallel = Analyze(repo, workers=workers, shards=shards, cache=None)
+        assert parallel.counter == serial.counter
+        assert parallel.most_frequent_words == serial.most_frequent_words
+        assert np.array_equal(parallel.frequencies, serial.frequencies)
+
+
+def test_analyze_cache(processed, tmp_path):
+    repo, _ = processed
+    cache = str(tmp_path / 'stats.npz')
+    first = Analyze(repo, cache=cache)
+    cached = Analyze(repo, cache=cache)
+    assert not cached.counter
+    assert cached.most_frequent_words == first.most_frequent_words
+    assert np.array_equal(cached.frequencies, first.frequencies) and np.allclose(cached.fit, first.fit)
+
+    store = open_store(repo, 'files')
+    store.put('new.html', b'w0 w0 w0')
+    store.close()
+    changed = Analyze(repo, cache=cache)
+    assert changed.counter and changed.total_words == first.total_words + 3
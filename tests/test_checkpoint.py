@@ -0,0 +1,138 @@
+import random
+from types import SimpleNamespace
+
+from checkpoint import CrawlCheckpoint
+from frontier import Frontier
+from robots_cache import RobotsCache
+
+
+def new_crawler():
+    crawler = SimpleNamespace(repo_files={}, previous_files={}, duplicates={}, visited_robots=set(), file_count=0,
+                              file_number=0, seed='https://a.com/', num_pages=100, domain='', taken=[],
+                              robots=RobotsCache(), frontier=Frontier())
+    crawler.unprocessed_urls = lambda: crawler.taken
+    return crawler
+
+
+def crawl_steps(crawler, rng, steps):
+    '''
+    Queues, pops and crawls urls at random, as a crawl would between saves
+    '''
+    for _ in range(steps):
+        if rng.random() < 0.6 or not crawler.frontier:
+            crawler.frontier.add(f'https://{rng.choice("abc")}.com/{rng.randrange(300)}', rng.randrange(3))
+        else:
+            url, priority = crawler.frontier.pop()
+            if rng.random() < 0.2:
+                crawler.taken.append((url, priority))
+            else:
+                crawler.repo_files[url] = {'filename': f'{crawler.file_number}.html', 'status': 200}
+                crawler.file_number += 1
+                if rng.random() < 0.1:
+                    crawler.duplicates[f'{url}?copy'] = url
+    crawler.visited_robots.add(f'https://{rng.choice("abc")}.com')
+
+
+def expected_pending(crawler):
+    # urls taken but not crawled are queued again
+    return sorted(crawler.frontier.pending() + crawler.taken)
+
+
+def restored(path):
+    crawler = new_crawler()
+    checkpoint = CrawlCheckpoint(path)
+    checkpoint.load(crawler)
+    checkpoint.close()
+    return crawler
+
+
+def test_incremental_saves_restore_the_crawl(tmp_path):
+    rng = random.Random(1)
+    path = str(tmp_path / 'state.sqlite')
+    crawler = new_crawler()
+    checkpoint = CrawlCheckpoint(path)
+    checkpoint.reset(crawler.frontier)
+    crawler.robots.store('https://a.com', 'User-agent: *\nDisallow: /private')
+    for _ in range(30):
+        crawler.taken = []
+        crawl_steps(crawler, rng, 50)
+        checkpoint.save(crawler)
+        back = restored(path)
+        assert back.repo_files == crawler.repo_files and list(back.repo_files) == list(crawler.repo_files)
+        assert back.duplicates == crawler.duplicates and back.visited_robots == crawler.visited_robots
+        assert back.file_count == len(crawler.repo_files) and back.file_number == crawler.file_number
+        assert sorted(back.frontier.pending()) == expected_pending(crawler)
+        assert set(back.frontier.seen) == set(crawler.frontier.seen)
+        assert not back.robots.allowed('https://a.com', '/private')
+    checkpoint.close()
+
+
+def test_resumed_crawl_keeps_saving_changes(tmp_path):
+    rng = random.Random(2)
+    path = str(tmp_path / 'state.sqlite')
+    crawler = new_crawler()
+    checkpoint = CrawlCheckpoint(path)
+    checkpoint.reset(crawler.frontier)
+    crawl_steps(crawler, rng, 200)
+    crawler.taken = [crawler.frontier.pop() for _ in range(3)]
+    checkpoint.save(crawler)
+    checkpoint.close()
+
+    crawler = new_crawler()
+    checkpoint = CrawlCheckpoint(path)
+    checkpoint.load(crawler)
+    for _ in range(5):
+        crawl_steps(crawler, rng, 50)
+        checkpoint.save(crawler)
+    back = restored(path)
+    assert sorted(back.frontier.pending()) == expected_pending(crawler)
+    assert set(back.frontier.seen) == set(crawler.frontier.seen)
+    assert back.repo_files == crawler.repo_files
+    checkpoint.close()
+
+
+def test_first_save_of_a_filled_frontier_is_full(tmp_path):
+    path = str(tmp_path / 'state.sqlite')
+    crawler = new_crawler()
+    crawl_steps(crawler, random.Random(3), 100)
+    checkpoint = CrawlCheckpoint(path)
+    checkpoint.reset(crawler.frontier)
+    checkpoint.save(crawler)
+    crawl_steps(crawler, random.Random(4), 100)
+    checkpoint.save(crawler)
+    assert sorted(restored(path).frontier.pending()) == expected_pending(crawler)
+    checkpoint.close()
+
+
+def test_recrawl_keeps_previous_files(tmp_path):
+    path = str(tmp_path / 'state.sqlite')
+    crawler = new_crawler()
+    checkpoint = CrawlCheckpoint(path)
+    checkpoint.reset(crawler.frontier)
+    crawl_steps(crawler, random.Random(5), 200)
+    checkpoint.save(crawler)
+    files = dict(crawler.repo_files)
+
+    crawler = new_crawler()
+    checkpoint.reset(crawler.frontier, previous=True)
+    assert checkpoint.load_previous() == files and not checkpoint.load_files()
+    url = next(iter(files))
+    crawler.repo_files[url] = dict(files[url], status=304)
+    checkpoint.save(crawler)
+    back = restored(path)
+    assert back.previous_files == files and back.repo_files == crawler.repo_files
+    checkpoint.clear_previous()
+    assert restored(path).previous_files == {}
+    checkpoint.close()
+
+
+def test_changes_journaled_elsewhere(tmp_path):
+    # the processes engine saves the frontier changes its workers send
+    path = str(tmp_path / 'state.sqlite')
+    crawler = new_crawler()
+    checkpoint = CrawlCheckpoint(path)
+    checkpoint.reset(crawler.frontier)
+    checkpoint.save(crawler, {'https://a.com/1': 0, 'https://b.com/1': 1})
+    checkpoint.save(crawler, {'https://a.com/1': None, 'https://a.com/2': 2})
+    assert sorted(restored(path).frontier.pending()) == [('https://a.com/2', 2), ('https://b.com/1', 1)]
+    checkpoint.close()
@@ -0,0 +1,80 @@
+import glob
+import os
+import random
+
+import pytest
+from bs4 import BeautifulSoup, FeatureNotFound
+
+from content_processor import ContentProcessor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def is_page(path):
+    # the *_processed samples are cleaned text, which the multipass cleaner cannot take
+    with open(path, 'rb') as f:
+        content = f.read()
+    return b'<title' in content and b'<body' in content
+
+
+SAMPLES = [path for path in sorted(glob.glob(os.path.join(ROOT, 'analysis', '*.html'))) if is_page(path)]
+TAGS = ['div', 'p', 'span', 'b', 'pre', 'textarea', 'section', 'script', 'noscript', 'nav', 'aside', 'video',
+        'footer', 'form', 'input']
+TEXTS = ['', ' ', '\n', '  \n ', '\t', '\r\n', 'word', ' a b ', 'x\n', '<!-- comment -->', ' </span> ']
+
+
+def available(parser):
+    try:
+        BeautifulSoup('', parser)
+    except FeatureNotFound:
+        return False
+    return True
+
+
+PARSERS = [parser for parser in ('html.parser', 'lxml') if available(parser)]
+
+
+def random_html(rng, depth):
+    '''
+    Nested blacklisted and kept tags, delete and content div ids and whitespace
+        only text, with end tags that the parser may ignore
+    '''
+    html = []
+    for _ in range(rng.randint(0, 4)):
+        if depth == 0 or rng.random() < 0.4:
+            html.append(rng.choice(TEXTS))
+            continue
+        name = rng.choice(TAGS)
+        attrs = ' class="c" style="s"'
+        if name == 'div' and rng.random() < 0.4:
+            attrs += f' id="{rng.choice(["delete", "content", "main-text", "other"])}"'
+        if name == 'input':
+            html.append(f'<input{attrs}>')
+        else:
+            html.append(f'<{name}{attrs}>{random_html(rng, depth - 1)}</{name}>')
+    return ''.join(html)
+
+
+def both_cleaned(parser, html):
+    processor = ContentProcessor(parser=parser)
+    single = processor.clean_html(BeautifulSoup(html, parser))
+    multipass = processor.clean_html_multipass(BeautifulSoup(html, parser))
+    return str(single), str(multipass)
+
+
+@pytest.mark.parametrize('parser', PARSERS)
+@pytest.mark.parametrize('sample', SAMPLES, ids=os.path.basename)
+def test_samples_match_multipass(parser, sample):
+    with open(sample, 'rb') as f:
+        html = f.read().decode('utf-8', 'replace')
+    single, multipass = both_cleaned(parser, html)
+    assert single == multipass
+
+
+@pytest.mark.parametrize('parser', PARSERS)
+def test_generated_trees_match_multipass(parser):
+    rng = random.Random(1)
+    for _ in range(2000):
+        html = f'<html><head><title>t</title></head><body>{random_html(rng, 4)}</body></html>'
+        single, multipass = both_cleaned(parser, html)
+        assert single == multipass, html
@@ -0,0 +1,166 @@
+import io
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from analyze import word_re
+from indexer import BLOCK, Indexer, decode_varints, encode_varints, interleave_blocks, split_blocks
+from page_store import open_store
+
+
+def random_texts(rng, count, vocabulary=200):
+    words = [f'w{i}' for i in range(vocabulary)]
+    weights = [1 / (i + 1) for i in range(vocabulary)]
+    return {f'{i}.html': ' '.join(rng.choices(words, weights, k=rng.randint(1, 300)))
+            for i in range(count)}
+
+
+def add_texts(indexer, texts):
+    for key, text in texts.items():
+        indexer.add_document(key, f'https://example.com/{key}', io.BytesIO(text.encode('utf-8')))
+    indexer.flush()
+
+
+def indexed_counts(path):
+    '''
+    {key: Counter of terms} of the live documents, read back from the segments on disk
+    '''
+    counts = {}
+    for segment in Indexer(str(path)).segments:
+        docs = {}
+        for term, _, postings, tfs in segment.iter_terms():
+            for doc, tf in zip(postings.tolist(), tfs.tolist()):
+                docs.setdefault(doc, Counter())[term] = tf
+        for doc in np.flatnonzero(segment.live).tolist():
+            key = segment.docs[doc][0]
+            assert key not in counts
+            counts[key] = docs.get(doc, Counter())
+            assert int(segment.lengths[doc]) == sum(counts[key].values())
+    return counts
+
+
+def word_counts(texts):
+    return {key: Counter(word_re.findall(text.lower())) for key, text in texts.items()}
+
+
+@pytest.mark.parametrize('values', [[], [0], [127, 128, 255, 16383, 16384], [2 ** 32 - 1, 2 ** 32, 2 ** 52]])
+def test_varints_round_trip(values):
+    data, sizes = encode_varints(values)
+    assert sizes.sum() == len(data)
+    assert decode_varints(data).tolist() == values
+
+
+def test_varints_random():
+    rng = np.random.default_rng(1)
+    values = rng.integers(0, 2 ** 40, 5000) >> rng.integers(0, 40, 5000)
+    data, sizes = encode_varints(values)
+    assert sizes.tolist() == [max(1, -(-int(value).bit_length() // 7)) for value in values]
+    assert np.array_equal(decode_varints(data), values)
+
+
+@pytest.mark.parametrize('df', [0, 1, BLOCK - 1, BLOCK, BLOCK + 1, 3 * BLOCK + 5])
+def test_blocks_round_trip(df):
+    deltas, tfs = np.arange(df), np.arange(df) + 1000
+    values = interleave_blocks(deltas, tfs)
+    assert values[:min(df, BLOCK)].tolist() == deltas[:BLOCK].tolist()
+    split = split_blocks(values, df)
+    assert np.array_equal(split[0], deltas) and np.array_equal(split[1], tfs)
+
+
+def test_postings_match_word_counts(tmp_path):
+    texts = random_texts(random.Random(1), 700)
+    texts['words.html'] = 'Über über_alles ÜBER 42 x42 42x naïve Naïve'
+    add_texts(Indexer(str(tmp_path), batch_docs=250, merge_factor=100), texts)
+    assert indexed_counts(tmp_path) == word_counts(texts)
+
+
+def test_dictionary_lookup(tmp_path):
+    texts = random_texts(random.Random(2), 300)
+    add_texts(Indexer(str(tmp_path)), texts)
+    segment = Indexer(str(tmp_path)).segments[0]
+    counts = word_counts(texts)
+    keys = [key for key, _ in segment.docs]
+    for term in ('w0', 'w7', 'w199'):
+        entry = segment.lookup(term)
+        docs, tfs = segment.postings(entry)
+        expected = {key: count[term] for key, count in counts.items() if term in count}
+        assert {keys[doc]: tf for doc, tf in zip(docs.tolist(), tfs.tolist())} == expected
+        assert int(entry['df']) == len(expected) and int(entry['max_tf']) == max(expected.values())
+    assert segment.lookup('missing') is None
+    assert segment.lookup('') is None
+
+
+def test_block_skips_and_postings(tmp_path):
+    add_texts(Indexer(str(tmp_path)), random_texts(random.Random(3), 1000, vocabulary=50))
+    segment = Indexer(str(tmp_path)).segments[0]
+    rng = np.random.default_rng(3)
+    lengths = np.asarray(segment.lengths)
+    checked = 0
+    for entry in segment.entries:
+        docs, tfs = segment.postings(entry)
+        skips = segment.blocks(entry)
+        assert len(skips) == -(-len(docs) // BLOCK)
+        for number, skip in enumerate(skips):
+            block = slice(number * BLOCK, (number + 1) * BLOCK)
+            assert skip['last_doc'] == docs[block][-1]
+            assert skip['max_tf'] == tfs[block].max()
+            assert skip['min_length'] == lengths[docs[block]].min()
+        for size in {1, len(skips) // 2, len(skips)}:
+            numbers = np.sort(rng.choice(len(skips), size, replace=False))
+            block = np.isin(np.arange(len(docs)) // BLOCK, numbers)
+            chosen_docs, chosen_tfs = segment.block_postings(entry, numbers)
+            assert np.array_equal(chosen_docs, docs[block]) and np.array_equal(chosen_tfs, tfs[block])
+            checked += len(skips) > 2
+    assert checked
+
+
+def test_replaced_documents(tmp_path):
+    rng = random.Random(4)
+    texts = random_texts(rng, 300)
+    indexer = Indexer(str(tmp_path), batch_docs=100, merge_factor=100)
+    add_texts(indexer, texts)
+    replaced = {key: text for key, text in random_texts(rng, 300).items() if rng.random() < 0.3}
+    replaced['new.html'] = 'a document not indexed before'
+    add_texts(indexer, replaced)
+    texts.update(replaced)
+    deleted = sum(len(segment.deleted) for segment in indexer.segments)
+    assert deleted == len(replaced) - 1
+    assert indexer.stats()['docs'] == len(texts)
+    assert indexed_counts(tmp_path) == word_counts(texts)
+
+    indexer.merge()
+    assert len(indexer.segments) == 1 and not indexer.segments[0].deleted
+    assert sorted(path.suffix for path in tmp_path.iterdir()) == ['.dict', '.docs', '.json', '.lens', '.post',
+                                                                  '.skip', '.terms']
+    assert indexed_counts(tmp_path) == word_counts(texts)
+
+
+def test_document_replaced_within_a_batch(tmp_path):
+    indexer = Indexer(str(tmp_path))
+    indexer.add_document('a.html', None, io.BytesIO(b'old words'))
+    add_texts(indexer, {'a.html': 'new words', 'b.html': 'other'})
+    assert indexed_counts(tmp_path) == word_counts({'a.html': 'new words', 'b.html': 'other'})
+
+
+def test_maybe_merge(tmp_path):
+    texts = random_texts(random.Random(5), 95)
+    indexer = Indexer(str(tmp_path), batch_docs=10, merge_factor=3)
+    add_texts(indexer, texts)
+    assert len(indexer.segments) < 3
+    assert [len(segment) for segment in indexer.segments] == sorted((len(segment) for segment in indexer.segments),
+                                                                  reverse=True)
+    assert indexed_counts(tmp_path) == word_counts(texts)
+
+
+def test_index_repository(tmp_path):
+    store = open_store(str(tmp_path / 'processed'), 'files')
+    for key, text in (('1.html', 'one page'), ('2.html', 'two pages'), ('3.html', 'three')):
+        store.put(key, text.encode('utf-8'))
+    store.close()
+    indexer = Indexer(str(tmp_path / 'index'))
+    indexer.index_repository(str(tmp_path / 'processed'), urls={'1.html': 'https://example.com/'},
+                             keys=['2.html', '1.html'])
+    assert Indexer(str(tmp_path / 'index')).segments[0].docs == [['1.html', 'https://example.com/'],
+                                                                ['2.html', None]]
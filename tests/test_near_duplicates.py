@@ -0,0 +1,87 @@
+import random
+
+import pytest
+
+from near_duplicates import MIN_WORDS, SimHashIndex, hamming, shingle_hashes, simhash, word_re
+
+
+def random_words(rng, count):
+    return [f'w{rng.randrange(5000)}' for _ in range(count)]
+
+
+def test_simhash_is_bitwise_majority():
+    rng = random.Random(1)
+    for count in (MIN_WORDS, 21, 100, 1000):
+        text = ' '.join(random_words(rng, count))
+        shingles = set(shingle_hashes(word_re.findall(text)).tolist())
+        expected = sum(1 << bit for bit in range(64)
+                       if 2 * sum(shingle >> bit & 1 for shingle in shingles) > len(shingles))
+        assert simhash(text) == expected
+
+
+def test_simhash_distances():
+    rng = random.Random(2)
+    words = random_words(rng, 500)
+    edited = list(words)
+    edited[250] = 'changed'
+    assert simhash(' '.join(words)) == simhash(' '.join(words).upper())
+    assert hamming(simhash(' '.join(words)), simhash(' '.join(edited))) <= 3
+    assert hamming(simhash(' '.join(words)), simhash(' '.join(random_words(rng, 500)))) > 10
+    assert simhash(' '.join(words[:MIN_WORDS - 1])) is None
+
+
+@pytest.mark.parametrize('max_distance', [0, 1, 3, 6])
+def test_index_matches_linear_scan(max_distance):
+    rng = random.Random(max_distance)
+    index = SimHashIndex(max_distance)
+    stored = {}
+    for key in range(1000):
+        signature = rng.getrandbits(64)
+        index.add(signature, key)
+        stored[key] = signature
+    signatures = list(stored.values())
+    for _ in range(500):
+        signature = rng.choice(signatures)
+        for bit in rng.sample(range(64), rng.randint(0, max_distance + 2)):
+            signature ^= 1 << bit
+        found = index.find(signature)
+        near = [key for key, other in stored.items() if hamming(other, signature) <= max_distance]
+        if near:
+            assert found is not None and hamming(stored[found], signature) <= max_distance
+        else:
+            assert found is None
+    assert index.comparisons < 500 * len(stored) / 10
+
+
+@pytest.mark.parametrize('max_distance', [15, 20, 40, 63])
+def test_large_distances_find_every_near_signature(max_distance):
+    rng = random.Random(max_distance)
+    index = SimHashIndex(max_distance)
+    assert len(index.bands) == max_distance + 1
+    assert sum(bin(mask).count('1') for _, mask in index.bands) == 64
+    stored = {key: rng.getrandbits(64) for key in range(200)}
+    for key, signature in stored.items():
+        index.add(signature, key)
+    for _ in range(200):
+        signature = rng.choice(list(stored.values()))
+        for bit in rng.sample(range(64), rng.randint(max_distance - 2, min(64, max_distance + 2))):
+            signature ^= 1 << bit
+        found = index.find(signature)
+        if any(hamming(other, signature) <= max_distance for other in stored.values()):
+            assert found is not None and hamming(stored[found], signature) <= max_distance
+        else:
+            assert found is None
+
+
+@pytest.mark.parametrize('max_distance', [-1, 64])
+def test_distance_out_of_range(max_distance):
+    with pytest.raises(ValueError):
+        SimHashIndex(max_distance)
+
+
+def test_check_adds_only_originals():
+    index = SimHashIndex(3)
+    assert index.check(0b1011, 'a') is None
+    assert index.check(0b1000, 'b') == 'a'
+    assert index.check(0b1111 << 20, 'c') is None
+    assert len(index) == 2 and index.find(0b1000) == 'a'
@@ -0,0 +1,101 @@
+import random
+import time
+
+import pytest
+
+from noise_evaluator import NoiseEvaluator, diff_similarity, edit_distance, myers_diff, token_scores, tokenize
+
+
+def lcs_length(a, b):
+    '''
+    Longest common subsequence by dynamic programming
+    '''
+    row = [0] * (len(b) + 1)
+    for x in a:
+        previous = 0
+        for j, y in enumerate(b, 1):
+            previous, row[j] = row[j], previous + 1 if x == y else max(row[j], row[j - 1])
+    return row[-1]
+
+
+def random_pairs(count, seed=1):
+    rng = random.Random(seed)
+    for _ in range(count):
+        a = rng.choices('abcd', k=rng.randint(0, 40))
+        # b is often an edited copy of a, so both small and large distances occur
+        b = [x for x in a if rng.random() < 0.8] if rng.random() < 0.5 else rng.choices('abcd', k=rng.randint(0, 40))
+        yield a, b
+
+
+def test_edit_distance_matches_lcs():
+    for a, b in random_pairs(500):
+        assert edit_distance(a, b) == len(a) + len(b) - 2 * lcs_length(a, b)
+
+
+def test_edit_distance_max_d():
+    a, b = list('abcabba'), list('cbabac')
+    d = len(a) + len(b) - 2 * lcs_length(a, b)
+    assert edit_distance(a, b, max_d=d) == d
+    assert edit_distance(a, b, max_d=d - 1) is None
+    assert edit_distance([], [], max_d=0) == 0
+
+
+def test_diff_similarity_matches_lcs():
+    rng = random.Random(2)
+    for a, b in random_pairs(500, seed=3):
+        prefix, suffix = rng.choices('xy', k=rng.randint(0, 5)), rng.choices('xy', k=rng.randint(0, 5))
+        a, b = prefix + a + suffix, prefix + b + suffix
+        similarity, exact = diff_similarity(a, b)
+        assert exact
+        expected = 2 * lcs_length(a, b) / (len(a) + len(b)) if a or b else 1.0
+        assert similarity == pytest.approx(expected)
+
+
+def test_diff_similarity_lower_bound():
+    for a, b in random_pairs(200, seed=4):
+        similarity, exact = diff_similarity(a, b, max_d=2)
+        expected = 2 * lcs_length(a, b) / (len(a) + len(b)) if a or b else 1.0
+        if exact:
+            assert similarity == pytest.approx(expected)
+        else:
+            assert 0 <= similarity <= expected
+
+
+def test_myers_diff_bound_grows_to_lcs():
+    for a, b in random_pairs(200, seed=5):
+        lcs = lcs_length(a, b)
+        d = len(a) + len(b) - 2 * lcs
+        bounds = [myers_diff(a, b, max_d) for max_d in range(d + 1)]
+        assert all(distance is None for distance, _ in bounds[:-1]) and bounds[-1] == (d, lcs)
+        matches = [bound for _, bound in bounds]
+        assert matches == sorted(matches) and all(0 <= bound <= lcs for bound in matches)
+
+
+def test_diff_similarity_of_large_different_texts():
+    rng = random.Random(6)
+    words = [f'w{i}' for i in range(50)]
+    a, b = rng.choices(words, k=20000), rng.choices(words, k=20000)
+    st = time.perf_counter()
+    similarity, exact = diff_similarity(a, b, max_d=200)
+    # O((N + M) max_d), where a quadratic LCS would take minutes
+    assert time.perf_counter() - st < 5
+    assert not exact and 0 < similarity < 1
+    assert diff_similarity(a, b, max_d=400)[0] >= similarity
+
+
+def test_token_scores():
+    assert token_scores(tokenize('the cat the hat'), tokenize('The cat sat')) == pytest.approx((0.5, 2 / 3, 4 / 7))
+    assert token_scores([], ['a']) == (0.0, 0.0, 0.0)
+
+
+def test_evaluate_with_workers():
+    pages = [(f'{i}.html', f'<html><body><div><p>page {i} words here</p></div></body></html>'.encode('utf-8'),
+              f'page {i} words') for i in range(6)]
+    serial = NoiseEvaluator()
+    summary = serial.evaluate(pages)
+    assert set(summary) == {'div', 'bte'} and all(entry['pages'] == 6 for entry in summary.values())
+    parallel = NoiseEvaluator(workers=2)
+    parallel.evaluate(pages)
+    scores = ('cleaner', 'page', 'precision', 'recall', 'f1', 'similarity', 'exact')
+    assert ([[result[key] for key in scores] for result in parallel.results] ==
+            [[result[key] for key in scores] for result in serial.results])
@@ -0,0 +1,86 @@
+import glob
+import gzip
+import os
+import random
+
+import pytest
+
+from page_store import FilePageStore, SegmentPageStore, open_store
+
+
+def random_pages(seed, count):
+    rng = random.Random(seed)
+    return {f'{i}.html': bytes(rng.choices(b'<abc> \n', k=rng.randint(0, 5000))) for i in range(count)}
+
+
+def test_segment_round_trip(tmp_path):
+    path = str(tmp_path / 'repo')
+    pages = random_pages(1, 50)
+    store = SegmentPageStore(path, segment_size=20000)
+    for key, data in pages.items():
+        store.put(key, data)
+    with store.writer('written.html') as f:
+        f.write(b'<p>in ')
+        f.write(b'parts</p>')
+    pages['written.html'] = b'<p>in parts</p>'
+    assert {key: store.get(key) for key in store.keys()} == pages
+    store.close()
+
+    # rotated into several segments, found again by open_store
+    assert len(glob.glob(os.path.join(path, '*.seg'))) > 1
+    store = open_store(path)
+    assert store.backend == 'segments' and sorted(store.keys()) == sorted(pages)
+    assert all(store.open(key).read() == data for key, data in pages.items())
+    store.close()
+
+
+def test_segment_records_are_gzip(tmp_path):
+    path = str(tmp_path / 'repo')
+    store = SegmentPageStore(path)
+    store.put('a.html', b'<html>a</html>')
+    store.close()
+    with open(os.path.join(path, 'segment-00001.seg'), 'rb') as f:
+        header = f.readline().split()
+        assert header[0] == b'PAGE'
+        assert gzip.decompress(f.read(int(header[2]))) == b'<html>a</html>'
+
+
+def test_duplicate_bodies_stored_once(tmp_path):
+    store = SegmentPageStore(str(tmp_path / 'repo'))
+    body = b'<html>' + b'same page ' * 1000 + b'</html>'
+    store.put('1.html', body)
+    size = store.stats()['bytes']
+    for i in range(2, 6):
+        store.put(f'{i}.html', body)
+    store.put('other.html', b'<html>other</html>')
+    assert store.stats()['pages'] == 6 and store.stats()['bodies'] == 2
+    assert size < store.stats()['bytes'] < 2 * size
+    assert all(store.get(f'{i}.html') == body for i in range(1, 6))
+    # deleting one page keeps the body of the others
+    store.delete('1.html')
+    assert '1.html' not in store and store.get('2.html') == body
+    with pytest.raises(KeyError):
+        store.get('1.html')
+    store.close()
+
+
+def test_version_follows_changes(tmp_path):
+    store = SegmentPageStore(str(tmp_path / 'repo'))
+    store.put('a.html', b'a')
+    version = store.version()
+    store.put('a.html', b'a')
+    assert store.version() == version
+    store.put('a.html', b'b')
+    assert store.version() != version
+    store.close()
+
+
+def test_discarded_writers(tmp_path):
+    for store in (FilePageStore(str(tmp_path / 'files')), SegmentPageStore(str(tmp_path / 'segments'))):
+        with store.writer('kept.html') as f:
+            f.write(b'kept')
+        with store.writer('dropped.html') as f:
+            f.write(b'dropped')
+            f.discard()
+        assert store.keys() == ['kept.html'] and store.get('kept.html') == b'kept'
+        store.close()
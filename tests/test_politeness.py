@@ -0,0 +1,117 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+from politeness import AutoThrottle, HostScheduler, parse_retry_after
+
+
+def test_reserve_spaces_requests():
+    scheduler = HostScheduler(default_delay=1.0)
+    scheduler.set_delay('b', 3.0)
+    assert scheduler.reserve('a', now=10) == 0
+    assert scheduler.reserve('a', now=10) == 1.0
+    assert scheduler.reserve('a', now=10.5) == 1.5
+    assert scheduler.reserve('b', now=10) == 0 and scheduler.ready_at('b') == 13.0
+
+
+@pytest.mark.parametrize('latency, target_concurrency, expected', [
+    (2.0, 1.0, 2.0),
+    (2.0, 4.0, .5),
+    # a host faster than its floor is crawled at the floor
+    (.01, 1.0, .25),
+])
+def test_delay_converges_to_latency_per_target_concurrency(latency, target_concurrency, expected):
+    throttle = AutoThrottle(default_delay=1.0, target_concurrency=target_concurrency)
+    throttle.set_delay('a', .25)
+    for _ in range(30):
+        throttle.observe('a', latency, 200)
+    assert throttle.delay('a') == pytest.approx(expected)
+
+
+def test_delay_moves_halfway_per_response():
+    throttle = AutoThrottle(target_concurrency=2.0)
+    throttle.set_delay('a', 1.0)
+    throttle.observe('a', 6.0, 200)
+    assert throttle.delay('a') == 2.0
+    throttle.observe('a', 0.0, 200)
+    assert throttle.delay('a') == 1.0
+
+
+@pytest.mark.parametrize('status', [None, 404, 500, 429, 503])
+def test_errors_never_lower_the_delay(status):
+    throttle = AutoThrottle(max_delay=100.0)
+    throttle.set_delay('a', .1)
+    throttle.observe('a', 10.0, 200)
+    delay = throttle.delay('a')
+    for latency in (0.0, 1.0, 5.0, 0.0):
+        throttle.observe('a', latency, status)
+        assert throttle.delay('a') >= delay
+        delay = throttle.delay('a')
+
+
+def test_throttled_responses_back_off_up_to_max_delay():
+    throttle = AutoThrottle(max_delay=5.0)
+    throttle.set_delay('a', .5)
+    delays = []
+    for _ in range(6):
+        throttle.observe('a', 0.0, 429)
+        delays.append(throttle.delay('a'))
+    assert delays == [1.0, 2.0, 4.0, 5.0, 5.0, 5.0]
+    # a floor above max_delay is still kept
+    throttle.set_delay('b', 10.0)
+    throttle.observe('b', 0.0, 503)
+    assert throttle.delay('b') == 10.0
+
+
+def test_first_floor_replaces_the_default_delay():
+    throttle = AutoThrottle(default_delay=5.0)
+    assert throttle.reserve('a', now=0) == 0 and throttle.ready_at('a') == 5.0
+    throttle.set_delay('a', 1.0)
+    assert throttle.delay('a') == 1.0 and throttle.ready_at('a') == 1.0
+    throttle.observe('a', 4.0, 200)
+    throttle.set_delay('a', 2.0)
+    assert throttle.delay('a') == 2.5 and throttle.floor('a') == 2.0
+
+
+def test_parse_retry_after():
+    now = time.time()
+    assert parse_retry_after('120') == 120.0
+    assert parse_retry_after(' 0 ') == 0.0
+    assert parse_retry_after(formatdate(now + 90, usegmt=True), now) == pytest.approx(90, abs=1)
+    assert parse_retry_after(formatdate(now - 90, usegmt=True), now) == 0.0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00', 1445412480 - 60) == 60.0
+    for value in (None, '', 'soon', '-5', '1.5'):
+        assert parse_retry_after(value) is None
+
+
+def test_retry_after_is_capped_at_max_delay():
+    throttle = AutoThrottle(max_delay=30.0)
+    now = time.monotonic()
+    assert throttle.retry('a', 0, retry_after=10.0)
+    assert throttle.ready_at('a') == pytest.approx(now + 10.0, abs=1)
+    # too long to wait for: not retried, and the host is held max_delay only
+    assert not throttle.retry('b', 0, retry_after=3600.0)
+    assert throttle.ready_at('b') == pytest.approx(now + 30.0, abs=1)
+    throttle.hold('c', 3600.0, now=now)
+    assert throttle.ready_at('c') == now + 30.0
+    # a hold never brings the next allowed time forward
+    throttle.hold('c', 1.0, now=now)
+    assert throttle.ready_at('c') == now + 30.0
+
+
+def test_retries_per_url():
+    throttle = AutoThrottle(max_retries=2)
+    assert throttle.retry('a', 0) and throttle.retry('a', 1)
+    assert not throttle.retry('a', 2)
+
+
+def test_retry_budget_runs_out():
+    throttle = AutoThrottle(max_retries=10, min_retries=2, retry_ratio=.5)
+    assert [throttle.retry('a', 0) for _ in range(3)] == [True, True, False]
+    # every response observed adds retry_ratio retries to the host's budget
+    for _ in range(4):
+        throttle.observe('a', .1, 429)
+    assert [throttle.retry('a', 0) for _ in range(3)] == [True, True, False]
+    # the budget is per host
+    assert throttle.retry('b', 0)
@@ -0,0 +1,85 @@
+import contextlib
+import io
+import multiprocessing
+import os
+import random
+
+from budget import AtomicInt
+from frontier import Frontier
+from process_engine import PartitionFrontier, QueueTransport, partition
+
+
+def random_urls(rng, count):
+    hosts = [f'host{i}.com' for i in range(20)] + ['host0.com:8080', '127.0.0.1:9001', '[::1]:9002']
+    return [f'{rng.choice(["http", "https"])}://{rng.choice(hosts)}/{rng.randrange(50)}' for _ in range(count)]
+
+
+def test_partition_by_host():
+    rng = random.Random(1)
+    owners = {}
+    for url in random_urls(rng, 2000):
+        host = url.split('/')[2]
+        assert owners.setdefault(host, partition(url, 4)) == partition(url, 4)
+    assert set(owners.values()) == {0, 1, 2, 3}
+    assert all(partition(url, 1) == 0 for url in random_urls(rng, 10))
+
+
+def test_links_routed_to_the_host_owner():
+    partitions = 3
+    transport = QueueTransport(partitions)
+    outstanding = AtomicInt()
+    frontiers = [PartitionFrontier(Frontier(), number, partitions, transport, outstanding)
+                 for number in range(partitions)]
+    rng = random.Random(2)
+    urls = random_urls(rng, 500)
+    for url in urls:
+        rng.choice(frontiers).add(url)
+    for frontier in frontiers:
+        frontier.flush()
+    for number, frontier in enumerate(frontiers):
+        # a queue hands over what was sent through a feeder thread, so wait a little
+        while links := transport.receive(number, .2):
+            frontier.receive(links)
+    # every url is queued once, in the partition owning its host
+    queued = [[url for url, _ in frontier.pending()] for frontier in frontiers]
+    assert sorted(url for owned in queued for url in owned) == sorted(set(urls))
+    for number, owned in enumerate(queued):
+        assert all(partition(url, partitions) == number for url in owned)
+    assert outstanding.value == len(set(urls))
+
+
+def fetch_pages(budget, stored):
+    # what a worker does for each url: reserve, then store or give the page back
+    rng = random.Random(os.getpid())
+    while budget.reserve():
+        if rng.random() < 0.3:
+            budget.release()
+        else:
+            stored.add()
+            budget.commit()
+
+
+def test_page_budget_shared_by_processes():
+    transport = QueueTransport(4)
+    budget = transport.page_budget(500, 20)
+    stored = transport.atomic_int(0)
+    processes = [transport.context.Process(target=fetch_pages, args=(budget, stored)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert budget.used == 500 and stored.value == 480 and budget.exhausted()
+
+
+def test_processes_crawl_stores_num_pages(tmp_path, monkeypatch):
+    from benchmarks.synthetic_web import SyntheticWeb
+    from web_crawler import WebCrawler
+
+    monkeypatch.chdir(tmp_path)
+    with SyntheticWeb(hosts=6, pages=30, page_size=2000) as web, contextlib.redirect_stdout(io.StringIO()):
+        crawler = WebCrawler(seed=web.seed_url, num_pages=40, domain='', engine='processes', workers=3,
+                             report=None, display_rows=0)
+    filenames = [entry['filename'] for entry in crawler.repo_files.values()]
+    assert crawler.file_count == len(crawler.repo_files) == 40
+    assert sorted(filenames) == sorted(os.listdir('repository')) and len(set(filenames)) == 40
+    assert multiprocessing.active_children() == []
@@ -0,0 +1,120 @@
+import random
+import re
+import threading
+import time
+
+import pytest
+
+from robots_cache import RobotsCache, RobotsRules
+
+
+def reference_allowed(allow, disallow, path):
+    '''
+    Tries every rule: the longest matching rule wins, Allow wins a tie
+    '''
+    best = None
+    for allowed, rules in ((True, allow), (False, disallow)):
+        for rule in rules:
+            anchored = rule.endswith('$')
+            pattern = ''.join('.*' if char == '*' else re.escape(char) for char in rule.rstrip('$'))
+            if re.fullmatch(pattern + ('' if anchored else '.*'), path, re.DOTALL):
+                if best is None or len(rule) > best[0] or (len(rule) == best[0] and allowed):
+                    best = (len(rule), allowed)
+    return best is None or best[1]
+
+
+@pytest.mark.parametrize('allow, disallow, path, allowed', [
+    (['/p'], ['/'], '/page', True),
+    (['/folder'], ['/folder'], '/folder/page', True),
+    (['/page'], ['/*.htm'], '/page.htm', False),
+    (['/$'], ['/'], '/', True),
+    (['/$'], ['/'], '/page.htm', False),
+    ([], ['/fish*.php'], '/fishheads/catfish.php?parameters', False),
+    ([], ['/*.php$'], '/filename.php?parameters', True),
+    ([], ['/private/'], '/private', True),
+    ([], ['/'], '', False),
+    ([], [], '/anything', True),
+])
+def test_longest_match(allow, disallow, path, allowed):
+    assert RobotsRules(allow, disallow).allowed(path) is allowed
+
+
+def test_matches_every_rule_tried():
+    rng = random.Random(1)
+    for _ in range(300):
+        rules = [['/' + ''.join(rng.choices('ab/*', [4, 4, 2, 1], k=rng.randint(0, 5))) + rng.choice(['', '', '$'])
+                  for _ in range(rng.randint(0, 6))] for _ in range(2)]
+        robots = RobotsRules(*rules)
+        for _ in range(20):
+            path = '/' + ''.join(rng.choices('ab/.', k=rng.randint(0, 8)))
+            assert robots.allowed(path) == reference_allowed(*rules, path), (rules, path)
+
+
+def test_parse_groups():
+    text = '''
+        # comment
+        User-agent: other
+        Disallow: /other
+
+        User-agent: MyBot
+        User-agent: friend
+        Allow: /public   # inline comment
+        Disallow: /
+        Crawl-delay: 2.5
+
+        User-agent: *
+        Disallow: /private
+        Crawl-delay: not a number
+        Sitemap: https://example.com/sitemap.xml
+    '''
+    mine = RobotsRules.parse(text, 'mybot')
+    assert (mine.allow, mine.disallow, mine.crawl_delay) == (['/public'], ['/'], 2.5)
+    assert RobotsRules.parse(text, 'friend').allow == ['/public']
+    other = RobotsRules.parse(text, 'unknown')
+    assert (other.disallow, other.crawl_delay) == (['/private'], None)
+    assert other.sitemaps == mine.sitemaps == ['https://example.com/sitemap.xml']
+    assert not other.allowed('/private/page') and other.allowed('/public')
+    assert RobotsRules.parse('Disallow: /x').allowed('/x')
+
+
+def test_cache_expiry():
+    cache = RobotsCache(ttl=60, retry_ttl=-1)
+    cache.store('https://a.com', 'User-agent: *\nDisallow: /x')
+    cache.store('https://b.com', None, ok=False)
+    assert 'https://a.com' in cache and 'https://b.com' not in cache
+    assert not cache.allowed('https://a.com', '/x/y') and cache.allowed('https://a.com', '/y')
+    # rules that are not cached (or have expired) allow everything
+    assert cache.allowed('https://c.com', '/x')
+
+
+def test_cache_persistence(tmp_path):
+    path = str(tmp_path / 'robots.json')
+    cache = RobotsCache(path)
+    cache.store('https://a.com', 'User-agent: *\nDisallow: /x\nCrawl-delay: 3\nSitemap: https://a.com/s.xml')
+    cache.store('https://b.com', None)
+    cache.entries['https://old.com'] = (RobotsRules(), time.time() - 1)
+    cache.save()
+    restored = RobotsCache(path)
+    assert set(restored.entries) == {'https://a.com', 'https://b.com'}
+    rules = restored.lookup('https://a.com')
+    assert (rules.disallow, rules.crawl_delay, rules.sitemaps) == (['/x'], 3.0, ['https://a.com/s.xml'])
+    assert not restored.allowed('https://a.com', '/x')
+
+
+def test_get_fetches_each_host_once():
+    cache = RobotsCache()
+    calls = []
+
+    def fetch(base_url):
+        calls.append(base_url)
+        time.sleep(0.01)
+        return 'User-agent: *\nDisallow: /x', True
+
+    threads = [threading.Thread(target=cache.get, args=(f'https://{host}.com', fetch))
+               for host in 'abab' * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(calls) == ['https://a.com', 'https://b.com']
+    assert cache.get('https://a.com', fetch).disallow == ['/x'] and len(calls) == 2
@@ -0,0 +1,100 @@
+import io
+import math
+import random
+from collections import Counter
+
+import pytest
+
+from analyze import word_re
+from indexer import Indexer
+from search import Searcher
+
+
+def brute_force(counts, query, k=10, k1=1.2, b=0.75):
+    '''
+    Best k BM25 scores of query over documents, computed directly from their word counts
+    '''
+    avgdl = sum(sum(count.values()) for count in counts) / len(counts)
+    scores = Counter()
+    for term, times in Counter(word_re.findall(query.lower())).items():
+        df = sum(term in count for count in counts)
+        idf = math.log(1 + (len(counts) - df + 0.5) / (df + 0.5))
+        for doc, count in enumerate(counts):
+            if term in count:
+                length = sum(count.values())
+                scores[doc] += times * idf * count[term] * (k1 + 1) / (
+                    count[term] + k1 * (1 - b + b * length / avgdl))
+    return sorted(scores.values(), reverse=True)[:k]
+
+
+def random_text(rng, words, weights):
+    return ' '.join(rng.choices(words, weights, k=rng.randint(5, 400)))
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    '''
+    An index of 600 documents in segments of 50, a quarter of them indexed again
+        (so their first copies are deleted), and the texts of the live documents
+    '''
+    rng = random.Random(1)
+    words = [f'w{i}' for i in range(300)]
+    weights = [1 / (i + 1) for i in range(300)]
+    texts = {}
+    indexer = Indexer(str(tmp_path), batch_docs=50, merge_factor=100)
+    for i in list(range(600)) + rng.sample(range(600), 150):
+        texts[f'{i}.html'] = random_text(rng, words, weights)
+        indexer.add_document(f'{i}.html', None, io.BytesIO(texts[f'{i}.html'].encode('utf-8')))
+    indexer.flush()
+    queries = [' '.join(rng.choices(words, weights, k=rng.randint(1, 4))) for _ in range(200)]
+    return indexer, texts, queries
+
+
+def check_scores(path, texts, queries, k=10):
+    searcher = Searcher(str(path))
+    counts = [Counter(word_re.findall(text.lower())) for text in texts.values()]
+    for query in queries:
+        expected = brute_force(counts, query, k)
+        for prune in (True, False):
+            assert [score for _, score in searcher.search(query, k, prune=prune)] == pytest.approx(expected)
+
+
+def test_scores_match_brute_force(tmp_path, corpus):
+    indexer, texts, queries = corpus
+    assert len(indexer.segments) > 10 and any(segment.deleted for segment in indexer.segments)
+    check_scores(tmp_path, texts, queries)
+    check_scores(tmp_path, texts, queries[:20], k=300)
+
+
+def test_scores_after_merge(tmp_path, corpus):
+    indexer, texts, queries = corpus
+    indexer.merge()
+    check_scores(tmp_path, texts, queries)
+
+
+def test_pruned_results_are_exhaustive_results(tmp_path, corpus):
+    _, _, queries = corpus
+    searcher = Searcher(str(tmp_path))
+    for query in queries:
+        assert searcher.search(query, 5) == searcher.search(query, 5, prune=False)
+
+
+def test_deleted_documents_do_not_count(tmp_path):
+    indexer = Indexer(str(tmp_path))
+    indexer.add_document('a.html', 'https://example.com/a', io.BytesIO(b'zebra apple'))
+    indexer.add_document('b.html', 'https://example.com/b', io.BytesIO(b'apple pie'))
+    indexer.flush()
+    indexer.add_document('a.html', 'https://example.com/a', io.BytesIO(b'apple'))
+    indexer.flush()
+    searcher = Searcher(str(tmp_path))
+    assert searcher.docs == 2
+    assert searcher.search('zebra') == []
+    assert searcher.query_terms('zebra apple').keys() == {'apple'}
+    assert [url for url, _ in searcher.search('apple')] == ['https://example.com/a', 'https://example.com/b']
+
+
+def test_no_results_asked(tmp_path, corpus):
+    _, _, queries = corpus
+    searcher = Searcher(str(tmp_path))
+    for k in (0, -1):
+        assert searcher.search(queries[0], k) == [] and searcher.search(queries[0], k, prune=False) == []
@@ -0,0 +1,125 @@
+import gzip
+import io
+import random
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from robots_cache import RobotsRules
+from sitemaps import SitemapReader, iter_sitemap, open_sitemap, parse_lastmod
+
+BASE = 'https://a.com'
+NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+class FakePool:
+    '''
+    Answers get() from a dict of url -> body, 404 for other urls
+    '''
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.requested = []
+
+    def get(self, url, stream=False):
+        self.requested.append(url)
+        body = self.bodies.get(url)
+        raw = io.BytesIO(body or b'')
+        raw.decode_content = False
+        response = SimpleNamespace(status_code=200 if body is not None else 404, raw=raw)
+        return Response(response)
+
+
+class Response:
+    def __init__(self, response):
+        self.response = response
+
+    def __enter__(self):
+        return self.response
+
+    def __exit__(self, *exc):
+        return False
+
+
+def urlset(entries):
+    rows = ''.join(f'<url><loc>{loc}</loc>' + (f'<lastmod>{lastmod}</lastmod>' if lastmod else '') + '</url>'
+                   for loc, lastmod in entries)
+    return f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="{NS}">{rows}</urlset>'.encode('utf-8')
+
+
+def sitemap_index(locs):
+    rows = ''.join(f'<sitemap><loc>{loc}</loc><lastmod>2024-01-01</lastmod></sitemap>' for loc in locs)
+    return f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex xmlns="{NS}">{rows}</sitemapindex>'.encode('utf-8')
+
+
+def random_entries(rng, count, start):
+    entries = []
+    for i in range(start, start + count):
+        day = rng.choice([None, f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+                          f'2023-{rng.randint(1, 12):02d}-01T10:00:00+02:00', '2022'])
+        entries.append((f'{BASE}/{rng.choice(["p", "private"])}/{i}', day))
+    return entries
+
+
+def test_gzipped_index_gives_the_newest_urls():
+    rng = random.Random(1)
+    first, second = random_entries(rng, 300, 0), random_entries(rng, 300, 300)
+    foreign = [('https://b.com/p/1', '2030-01-01'), ('http://a.com/p/2', '2030-01-01')]
+    pool = FakePool({
+        f'{BASE}/sitemap_index.xml.gz': gzip.compress(sitemap_index([
+            f'{BASE}/sitemap-1.xml.gz', '/sitemap-2.xml', f'{BASE}/missing.xml', f'{BASE}/sitemap-1.xml.gz'])),
+        f'{BASE}/sitemap-1.xml.gz': gzip.compress(urlset(first + foreign)),
+        f'{BASE}/sitemap-2.xml': urlset(second),
+    })
+    rules = RobotsRules(disallow=['/private'], sitemaps=['/sitemap_index.xml.gz'])
+    reader = SitemapReader(pool)
+    newest = reader.newest(BASE, rules, 50)
+
+    allowed = [(url, parse_lastmod(lastmod)) for url, lastmod in first + second if '/private/' not in url]
+    expected = sorted(enumerate(allowed), key=lambda item: (
+        -(item[1][1] if item[1][1] is not None else float('-inf')), item[0]))
+    assert newest == [url for _, (url, _) in expected[:50]]
+    # each sitemap is read once, and the missing one counted as an error
+    assert sorted(pool.requested) == sorted(set(pool.requested)) and len(pool.requested) == 4
+    assert reader.errors == 1
+
+
+def test_newest_puts_undated_urls_last():
+    pool = FakePool({f'{BASE}/sitemap.xml': urlset([
+        (f'{BASE}/1', None), (f'{BASE}/2', '2020-05-01'), (f'{BASE}/3', None), (f'{BASE}/4', '2021')])})
+    assert SitemapReader(pool).newest(BASE, RobotsRules(), 3) == [f'{BASE}/4', f'{BASE}/2', f'{BASE}/1']
+
+
+def test_max_sitemaps():
+    pool = FakePool({
+        f'{BASE}/sitemap.xml': sitemap_index([f'{BASE}/s{i}.xml' for i in range(10)]),
+        **{f'{BASE}/s{i}.xml': urlset([(f'{BASE}/{i}', None)]) for i in range(10)},
+    })
+    urls = [url for url, _ in SitemapReader(pool, max_sitemaps=4).urls(BASE, RobotsRules())]
+    assert urls == [f'{BASE}/0', f'{BASE}/1', f'{BASE}/2'] and len(pool.requested) == 4
+
+
+def test_text_sitemap_and_size_limit():
+    stream = open_sitemap(io.BytesIO(gzip.compress(b'\xef\xbb\xbfhttps://a.com/1\n\nhttps://a.com/2\n')))
+    assert list(iter_sitemap(stream)) == [('url', 'https://a.com/1', None), ('url', 'https://a.com/2', None)]
+    # a small gzip file that expands beyond max_bytes is not read
+    bomb = gzip.compress(urlset([(f'{BASE}/{i}', None) for i in range(2000)]))
+    pool = FakePool({f'{BASE}/sitemap.xml': bomb})
+    reader = SitemapReader(pool, max_bytes=len(bomb) * 2)
+    assert len(list(reader.urls(BASE, RobotsRules()))) < 2000 and reader.errors == 1
+
+
+@pytest.mark.parametrize('text, moment', [
+    ('2004', datetime(2004, 1, 1, tzinfo=timezone.utc)),
+    ('2004-12', datetime(2004, 12, 1, tzinfo=timezone.utc)),
+    ('2004-12-23', datetime(2004, 12, 23, tzinfo=timezone.utc)),
+    ('2004-12-23T18:00:15Z', datetime(2004, 12, 23, 18, 0, 15, tzinfo=timezone.utc)),
+    (' 2004-12-23T18:00:15+01:00 ', datetime(2004, 12, 23, 17, 0, 15, tzinfo=timezone.utc)),
+])
+def test_parse_lastmod(text, moment):
+    assert parse_lastmod(text) == moment.timestamp()
+
+
+@pytest.mark.parametrize('text', [None, '', 'yesterday', '2004-13', '20041'])
+def test_parse_lastmod_invalid(text):
+    assert parse_lastmod(text) is None
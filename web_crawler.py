@@ -1,17 +1,24 @@
 import csv
-import os
-import shutil
+import hashlib
+import itertools
 import requests
 import time
-import fnmatch
 import sys
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup
 from queue import Queue
-from IPython.display import display, HTML
-import time
 from multiprocessing.pool import ThreadPool
 import threading
+from budget import AtomicInt, PageBudget
+from http_pool import ConnectionPool
+from robots_cache import RobotsCache
+from politeness import AutoThrottle, RETRY_STATUSES, Throttled, parse_retry_after
+from link_extractor import LinkExtractor, resolve_link
+from frontier import Frontier
+from checkpoint import CrawlCheckpoint
+from page_store import open_store
+from metrics import Metrics
+from sitemaps import SitemapReader
+from report import CrawlReport
 
 class CSVInputError(Exception):
     pass
@@ -24,9 +31,79 @@ class WebCrawler:
     Can be initialized with a csv file containing one 2 or 3 length line OR
         with kwargs
     Params: seed, num_pages, domain
+    engine selects how pages are fetched:
+        'serial' (default), 'threaded' (same as threaded=True) or 'async'
+        'async' keeps up to max_in_flight requests open across hosts
+        'processes' partitions the hosts across workers processes, links between
+        partitions going through transport (see process_engine.ProcessCrawlEngine)
+    Every fetch reserves a page of the num_pages budget first (see budget.PageBudget),
+        so concurrent fetches never store more than num_pages pages
+    All fetches go through one keep-alive ConnectionPool, limited by
+        max_connections overall and max_connections_per_host per host
+        (see http_pool.ConnectionPool for timeout and compression)
+    robots.txt rules are cached per host for robots_ttl seconds and, if robots_cache
+        is given, kept in that json file (by default only in memory)
+    Requests to a host are spaced by an adaptive delay (see politeness.AutoThrottle):
+        never below its robots.txt Crawl-delay (.5 if none), growing with its
+        latency beyond target_concurrency requests at a time, backing off
+        exponentially (up to max_delay) on 429 and 503 and waiting for Retry-After;
+        such requests are retried up to max_retries times within a per host budget
+    Found links wait in a Frontier (normalized, deduplicated, shallowest first)
+        holding at most max_queued urls; batch_size urls are crawled per round
+    If checkpoint is given, crawl state is saved to that database (see checkpoint.CrawlCheckpoint)
+        every checkpoint_every pages and when the crawl ends; resume and recrawl need it
+        With resume=True the crawl continues from the last checkpoint instead of
+        clearing the repository, without fetching stored pages again
+    With recrawl=True the repository of the last crawl is kept and its pages are
+        requested conditionally (ETag/Last-Modified); pages that are not modified
+        or whose content digest is unchanged are not rewritten. changed_files()
+        lists the files to pass to ContentProcessor.process_repository. Pages of
+        the last crawl that are not requested again stay in repo_files, unchanged
+    Pages are kept in a page store (see page_store): repo_backend 'files' is one
+        file per page, 'segments' compressed segment files; None keeps the backend
+        of an existing repository
+    Time spent per stage (robots_fetch, politeness_sleep, http_fetch, http_read,
+        disk_write, link_parse, page) and counters are kept in metrics (see metrics.Metrics)
+        and, if metrics is given, written to that file (.prom for Prometheus text, json otherwise)
+        when the crawl ends and, if metrics_every is given, every metrics_every seconds
+    With near_duplicates set to a number of bits, a page whose text SimHash is within
+        that Hamming distance of a stored page's (see near_duplicates) is not stored
+        and does not count towards num_pages; its links are still followed and
+        duplicates maps it to the url of the page it duplicates
+        (duplicate_summary() gives the dedup rate and the time saved)
+    With sitemap_urls > 0 the sitemaps of every new host (from its robots.txt,
+        following sitemap indexes, at most max_sitemaps files) seed the frontier
+        with up to sitemap_urls of its urls that robots.txt allows, most recently
+        modified first (see sitemaps.SitemapReader)
+    When the crawl ends a report of the stored pages is written once to report
+        (in each of report_formats: 'html', 'csv', 'jsonl'; html split in pages of
+        report_page_size rows if given) and a summary with the first display_rows
+        rows is displayed (see report.CrawlReport; display_rows=0 displays nothing,
+        so IPython is not needed)
     '''
-    def __init__(self, csv_path=None, threaded=False, **kwargs):
-        self.threaded = threaded
+    engines = ('serial', 'threaded', 'async', 'processes')
+
+    def __init__(self, csv_path=None, threaded=False, engine=None, max_in_flight=1000, workers=None, transport=None,
+                 max_connections=100, max_connections_per_host=8, timeout=(5, 30), compression=True,
+                 robots_cache=None, robots_ttl=24 * 60 * 60,
+                 max_queued=1000000, batch_size=1000,
+                 checkpoint=None, checkpoint_every=100, resume=False, recrawl=False,
+                 repo_backend=None, metrics=None, metrics_every=None, near_duplicates=None,
+                 sitemap_urls=0, max_sitemaps=100, report='report.html', report_formats=('html',),
+                 report_page_size=None, display_rows=20, target_concurrency=1.0, max_delay=60.0, max_retries=3,
+                 **kwargs):
+        if engine is None:
+            engine = 'threaded' if threaded else 'serial'
+        if engine not in self.engines:
+            raise InputError(f'engine must be one of {", ".join(self.engines)}')
+        if (resume or recrawl) and not checkpoint:
+            raise InputError('resume and recrawl need a checkpoint')
+        self.engine = engine
+        self.threaded = engine == 'threaded'
+        self.max_in_flight = max_in_flight
+        self.workers = workers
+        self.transport = transport
+        self.metrics = Metrics()
         if csv_path:
             seed, num_pages, domain = self.get_csv_input(csv_path)
         else:
@@ -35,21 +112,100 @@ class WebCrawler:
 
         self.seed, self.num_pages, self.domain = seed, num_pages, domain
         self.repo_files = {}
+        self.previous_files = {}
+        self.duplicates = {}
+        self.near_duplicates = near_duplicates
+        self.near_index = None
+        if near_duplicates is not None:
+            from near_duplicates import SimHashIndex
+            self.near_index = SimHashIndex(near_duplicates)
         self.file_count = 0
-        self.main_link_queue = set()
+        self.file_number = 0
+        self.max_queued = max_queued
+        self.frontier = Frontier(max_queued=max_queued, accept=self.check_link)
+        self.batch_size = batch_size
+        self.sitemap_urls = sitemap_urls
+        self.max_sitemaps = max_sitemaps
+        self.report = report
+        self.report_formats = report_formats
+        self.report_page_size = report_page_size
+        self.display_rows = display_rows
         self.domain_dict = {}
         self.visited_robots = set()
+        self.robots_ttl = robots_ttl
+        self.robots = RobotsCache(robots_cache, ttl=robots_ttl)
+        self.pool_options = {'max_connections': max_connections, 'max_per_host': max_connections_per_host,
+                             'timeout': timeout, 'compression': compression}
+        self.pool = ConnectionPool(**self.pool_options)
+        self.throttle_options = {'target_concurrency': target_concurrency, 'max_delay': max_delay,
+                                 'max_retries': max_retries}
+        self.throttle = AutoThrottle(**self.throttle_options)
+        self.lock = threading.RLock()
+        self.checkpoint = CrawlCheckpoint(checkpoint) if checkpoint else None
+        self.checkpoint_every = checkpoint_every
+        self.repo = 'repository'
+        self.store = open_store(self.repo, repo_backend)
+
+        if metrics and metrics_every:
+            self.metrics.export_every(metrics, metrics_every)
+
+        resumed = resume and self.load_checkpoint()
+        if recrawl and not resumed:
+            self.initialize_recrawl()
+        elif not resumed:
+            self.initialize_repo()
+        self.budget = PageBudget(self.num_pages, self.file_count)
+        if self.engine == 'async':
+            from async_engine import AsyncCrawlEngine
+            AsyncCrawlEngine(self, max_in_flight=self.max_in_flight).run()
+        elif self.engine == 'processes':
+            from process_engine import ProcessCrawlEngine
+            ProcessCrawlEngine(self, workers=self.workers, transport=self.transport).run()
+        else:
+            if not resumed:
+                self.initialize_seed()
+            self.process_main_link_queue()
+        self.pool.close()
+        self.robots.save()
+        self.keep_unvisited_files()
+        self.save_checkpoint()
+        if self.checkpoint:
+            if self.previous_files:
+                self.checkpoint.clear_previous()
+            self.checkpoint.close()
+        if self.report:
+            self.output()
+        if self.display_rows:
+            self.display()
+        self.store.close()
+        self.metrics.stop_export()
+        if metrics:
+            self.metrics.write(metrics)
+
+    def __getstate__(self):
+        # connections, locks, open files and the transport stay in this process
+        # (see process_engine.crawl_partition)
+        skip = ('pool', 'lock', 'store', 'checkpoint', 'metrics', 'robots', 'frontier', 'near_index',
+                'budget', 'file_numbers', 'transport', 'throttle')
+        return {key: value for key, value in self.__dict__.items() if key not in skip}
+
+    @property
+    def file_number(self):
+        '''
+        Number of the last file added; file numbers are taken atomically from file_numbers
+        '''
+        return self.file_numbers.value
 
-        self.initialize_repo()
-        self.initialize_seed()
-        self.process_main_link_queue()
+    @file_number.setter
+    def file_number(self, value):
+        self.file_numbers = AtomicInt(value)
 
     def get_csv_input(self, csv_path):
         '''
         Gets input from csv file
         Checks that input is correct length
+        Without a domain column, urls of any domain are crawled (domain '')
         '''
-        st = time.time()
         with open(csv_path, newline='') as csvfile:
             reader = csv.reader(csvfile, delimiter=',')
 
@@ -59,11 +215,9 @@ class WebCrawler:
 
             if len(file_input) == 2:
                 seed, num_pages = file_input
-                domain = None
+                domain = ''
             elif len(file_input) == 3:
                 seed, num_pages, domain = file_input
-            e = time.time() - st
-            # print(f'get_csv_input took {e}')
             return seed, num_pages, domain
 
     def get_kwarg_input(self, kwargs):
@@ -71,12 +225,9 @@ class WebCrawler:
         Gets input from kwargs
         Checks for all applicable inputs
         '''
-        st = time.time()
         for kw in ['seed', 'num_pages', 'domain']:
             if kw not in kwargs:
                 raise(InputError('kwargs must include seed, num_pages, and domain'))
-        e = time.time() - st
-        # print(f'get_kwarg_input took {e}')
         return kwargs['seed'], kwargs['num_pages'], kwargs['domain']
 
     def validate_input(self, seed, num_pages, domain):
@@ -85,7 +236,6 @@ class WebCrawler:
             that num_pages is int (and coerces it),
             that seed is a valid url
         '''
-        st = time.time()
         if not isinstance(seed, str):
             raise InputError('seed input must be a string')
         if not isinstance(domain, str):
@@ -98,183 +248,234 @@ class WebCrawler:
         seed_parse = urlparse(seed)
         if not (seed_parse.scheme and seed_parse.netloc):
             raise InputError("Seed input is invalid url")
-        e = time.time() - st
-        # print(f'validate_input took {e}')
         return num_pages
 
     def initialize_repo(self):
         '''
-        If repository exists from previous run, it is deleted
+        If repository exists from previous run, it is deleted (and its checkpoint cleared)
         Creates repository
         '''
-        st = time.time()
-        self.repo = 'repository'
-        if os.path.isdir(self.repo):
-            shutil.rmtree(self.repo)
-        os.mkdir(self.repo)
-        e = time.time() - st
-        # print(f'initialize_repo took {e}')
+        self.store.reset()
+        if self.checkpoint:
+            self.checkpoint.reset(self.frontier)
+
+    def initialize_recrawl(self):
+        '''
+        Keeps the repository of the last crawl and loads its repo_files from the
+            checkpoint as previous_files, used for conditional requests
+        The checkpoint keeps them until the recrawl ends (see keep_unvisited_files)
+        New files are numbered after the highest numbered file in the repository
+        '''
+        if self.checkpoint and self.checkpoint.exists():
+            self.checkpoint.reset(self.frontier, previous=True)
+            self.previous_files = self.checkpoint.load_previous()
+        numbers = [int(name.split('.')[0]) for name in self.store.keys() if name.split('.')[0].isdigit()]
+        self.file_number = max(numbers, default=0)
+
+    def keep_unvisited_files(self):
+        '''
+        Adds the pages of the last crawl that a recrawl did not request again to
+            repo_files, unchanged, so their files stay tracked with their metadata
+        '''
+        for url, entry in self.previous_files.items():
+            if url not in self.repo_files and url not in self.duplicates:
+                self.repo_files[url] = dict(entry, changed=False)
+
+    def load_checkpoint(self):
+        '''
+        Restores repo_files, file_count, the frontier and robots from the checkpoint
+            and deletes the pages stored after its last save
+        Returns False if there is no checkpoint to resume from
+        '''
+        if not (self.checkpoint and self.checkpoint.exists()):
+            return False
+        self.checkpoint.load(self)
+        # pages written after the last save (e.g. by another worker of the processes
+        # engine) are not in the checkpoint; they are crawled again
+        tracked = {entry['filename'] for files in (self.repo_files, self.previous_files) for entry in files.values()}
+        for name in self.store.keys():
+            if name.split('.')[0].isdigit() and name not in tracked:
+                self.store.delete(name)
+        if self.near_index is not None:
+            for url, entry in self.repo_files.items():
+                if entry.get('simhash') is not None:
+                    self.near_index.add(entry['simhash'], url)
+        return True
+
+    def save_checkpoint(self):
+        if self.checkpoint:
+            with self.lock:
+                self.checkpoint.save(self)
+
+    def unprocessed_urls(self):
+        '''
+        (url, depth) pairs taken from the frontier into domain_dict but not crawled yet
+        '''
+        return [(url, depth) for entries in list(self.domain_dict.values())
+                for url, depth in list(entries) if url not in self.repo_files]
 
     def initialize_seed(self):
         '''
         Calls process url on seed url
         '''
-        st = time.time()
+        self.frontier.mark_seen(self.seed)
         self.process_url(self.seed)
-        e = time.time() - st
-        # print(f'initialize_seed took {e}')
 
-    def process_url(self, url):
+    def process_url(self, url, depth=0):
         '''
         Checks if a robot exists for url
-        Checks if the url is in the domain input
-        Gets url and adds file to repository
-        Finds links from file and adds them to main_link_queue
+        Checks if the url is in the domain input and allowed by the robot
+        Reserves a page of the budget, then gets url and adds file to repository,
+            adding its links to the frontier
         '''
-        st = time.time()
-        crawl_delay = self.check_for_robot(url)
-        parsed_url = urlparse(url)
-        add_to_repo = self.check_domain(parsed_url.netloc)
-        if add_to_repo:
-            time.sleep(crawl_delay)
-            added = self.add_file_to_repo(url)
-            if added:
-                self.find_links(url)
-        e = time.time() - st
-        # print(f'process_url took {e}')
+        with self.metrics.timer('page'):
+            self.check_for_robot(url)
+            parsed_url = urlparse(url)
+            add_to_repo = self.check_domain(parsed_url.netloc) and self.check_robot_allowed(url)
+            if add_to_repo and self.budget.reserve():
+                stored = False
+                try:
+                    stored = self.fetch_politely(f'{parsed_url.scheme}://{parsed_url.netloc}', url, depth)
+                finally:
+                    if stored:
+                        self.budget.commit()
+                    else:
+                        self.budget.release()
+
+    def fetch_politely(self, host, url, depth=0):
+        '''
+        Waits for host's next request slot (see politeness.AutoThrottle), then adds
+            url to the repository
+        A request throttled by the host (429, 503) is retried while the throttle allows
+        Returns True if a file was added
+        '''
+        for attempt in itertools.count():
+            wait = self.throttle.reserve(host)
+            with self.metrics.timer('politeness_sleep'):
+                time.sleep(wait)
+            try:
+                return self.add_file_to_repo(url, depth)
+            except Throttled as e:
+                if not self.throttle.retry(host, attempt, e.retry_after):
+                    self.metrics.inc('retries_exhausted')
+                    return False
+                self.metrics.inc('retries')
 
     def worker(self, domain):
 
-        for url in self.domain_dict[domain]:
+        for url, depth in self.domain_dict[domain]:
             # print('{}: {}'.format(threading.current_thread().name, url))
-            if self.check_file_count_no_display():
-                self.process_url(url)
+            if self.check_file_count():
+                self.process_url(url, depth)
             else:
                 return
 
     def process_main_link_queue(self):
         '''
-        process entire main_link_queue into a dictionary organized by domain (domain_dict)
+        Crawls the frontier until it is empty or the file_count has been met
+        Each round pops up to batch_size urls from the frontier into a dictionary
+            organized by domain (domain_dict)
         Per domain, calls process_url on each url
-        Recurses if there are still urls in main_link_queue and the file_count has not been met
         '''
 
-        st = time.time()
-        while bool(self.main_link_queue):
-            link = self.main_link_queue.pop()
-
-            parsed_link = urlparse(link)
-            if parsed_link.netloc not in self.domain_dict and link not in self.repo_files and self.check_domain(parsed_link.netloc):
-                self.domain_dict[parsed_link.netloc] = set()
-                self.domain_dict[parsed_link.netloc].add(link)
-            elif parsed_link.netloc in self.domain_dict and link not in self.repo_files and self.check_domain(parsed_link.netloc):
-                self.domain_dict[parsed_link.netloc].add(link)
-
         if self.threaded:
-
             pool = ThreadPool(8)
 
-            pool.map(self.worker, (self.domain_dict.keys()))
+        while self.frontier and self.check_file_count():
+            self.domain_dict = self.frontier.pop_batch(self.batch_size)
+
+            if self.threaded:
+                pool.map(self.worker, (self.domain_dict.keys()))
+            else:
+                for domain in self.domain_dict:
+                    for url, depth in self.domain_dict[domain]:
+                        if self.check_file_count():
+                            self.process_url(url, depth)
+                        else:
+                            return
 
+        if self.threaded:
             pool.close()
             pool.join()
 
-
-        else:
-            for domain in self.domain_dict:
-                for url in self.domain_dict[domain]:
-                    if self.check_file_count():
-                        self.process_url(url)
-                    else:
-                        return
-
-        if bool(self.main_link_queue) and self.check_file_count():
-            self.process_main_link_queue()
-        e = time.time() - st
-        # print(f'process_main_link_queue took {e}')
-
     def check_for_robot(self, url):
         '''
-        Checks if the robot has been visited for the url
-        If not, gets the robot.txt file for the url's domain
-            Finds disallowed urls
-            Finds sitemap, if any
-            Removes disallowed urls from sitemap urls
-            Finds crawl delay, if any and sets it
-        TODO: case where site does not have robots.txt
-        TODO: save crawl_delay for visited robots
-        TODO: follow sub sitemaps to valid urls (case: reddit)
-        '''
-        st = time.time()
+        Gets the robots.txt rules for the url's host from the robots cache
+            (fetching robots.txt on a miss) and marks the robot as visited
+        The crawl delay is the floor of the host's delay in the throttle
+        The first visit of a host seeds the frontier from its sitemaps (see seed_sitemaps)
+        Returns the robot's crawl delay, or .5 if it has none
+        '''
         parsed_url = urlparse(url)
         base_url = f'{parsed_url.scheme}://{parsed_url.netloc}'
-        crawl_delay = .5
-        if base_url not in self.visited_robots:
-            robots = f'{base_url}/robots.txt'
-            rst = time.time()
-            r = requests.get(robots)
-            e = time.time() - rst
-            # print(f'request (in check for robot) took {e}')
-            tmp = {}
-            text = [line.decode('utf-8') for line in r.iter_lines()]
-
-            for i,line in enumerate(text):
-                if 'user-agent' in line.lower():
-                    tmp[line.lower()] = i
-                elif 'Sitemap' in line:
-                    tmp[line] = i
-                # print(line)
-
-            # print(tmp)
+        rules = self.robots.get(base_url, self.fetch_robot)
+        crawl_delay = rules.crawl_delay or .5
+        with self.lock:
+            first_visit = base_url not in self.visited_robots
+            self.visited_robots.add(base_url)
+        self.throttle.set_delay(base_url, crawl_delay)
+        if first_visit and self.sitemap_urls:
+            self.seed_sitemaps(base_url, rules)
+        return crawl_delay
 
-            try:
-                user_line = tmp['user-agent: *']
-                others = sorted(list(set(tmp.values()) - set([user_line])))
-                end_user = others[0] if others else None
-
-                user_agent = {'Disallow': [], 'Crawl-delay': None}
-                for i,line in enumerate(text):
-                    if i < user_line:
-                        pass
-                    elif i > end_user:
-                        pass
-                    elif 'Disallow' in line:
-                        ext = line.split(' ')[1]
-                        user_agent['Disallow'].append(f'{base_url}{ext}')
-                    elif 'Crawl-delay' in line:
-                        user_agent['Crawl-delay'] = int(line.split(' ')[1])
-
-                # sitemaps = [key.split(' ')[1] for key in tmp.keys() if 'Sitemap' in key]
-                # sitemap_urls = []
-                # sst = time.time()
-                # for sitemap in sitemaps:
-                #     sr = requests.get(sitemap)
-                #     time.sleep(1)
-                #     sr.encoding = 'utf-8'
-                #     soup = BeautifulSoup(sr.text, 'html5lib')
-                #     locs = soup.find_all("loc")
-                #     sitemap_urls += [t.text for t in locs]
-                # e = time.time() - sst
-                # print(f'sitemaps took {e}')
-
-                # sitemap_urls = set(sitemap_urls)
-
-                # for disallowed in user_agent['Disallow']:
-                #     filtered = fnmatch.filter(sitemap_urls, disallowed)
-                #     sitemap_urls = sitemap_urls - set(filtered)
-
-                # self.main_link_queue |= sitemap_urls
-
-                self.visited_robots.add(base_url)
-
-                if user_agent['Crawl-delay']:
-                    crawl_delay = user_agent['Crawl-delay']
-
-                time.sleep(.5)
-            except:
-                pass
+    def seed_sitemaps(self, base_url, rules):
+        '''
+        Adds up to sitemap_urls urls from base_url's sitemaps to the frontier,
+            most recently modified first, one level below the seed
+        '''
+        self.add_sitemap_urls(self.read_sitemaps(base_url, rules))
 
-        return crawl_delay
+    def read_sitemaps(self, base_url, rules):
+        '''
+        Returns up to sitemap_urls urls from base_url's sitemaps, most recently modified first
+        The requests take slots of the host in the throttle, like its pages
+        '''
+        reader = SitemapReader(self.pool, delay=self.throttle.delay(base_url), max_sitemaps=self.max_sitemaps,
+                               metrics=self.metrics)
+        with self.metrics.timer('sitemaps'):
+            time.sleep(self.throttle.reserve(base_url))
+            urls = reader.newest(base_url, rules, self.sitemap_urls)
+        # the next page waits a delay after the last sitemap request
+        self.throttle.reserve(base_url)
+        return urls
+
+    def add_sitemap_urls(self, urls):
+        with self.lock:
+            for url in urls:
+                if self.frontier.add(url, 1):
+                    self.metrics.inc('sitemap_urls')
+
+    def fetch_robot(self, base_url):
+        '''
+        Gets the robots.txt file for base_url for the robots cache
+        Returns (text, ok): a missing robots.txt allows everything,
+            a failed request or server error is retried once the cache entry expires
+        The request takes the host's first slot in the throttle
+        '''
+        self.metrics.inc('robots_fetched')
+        self.throttle.reserve(base_url)
+        st = time.perf_counter()
+        try:
+            with self.metrics.timer('robots_fetch'):
+                r = self.pool.get(f'{base_url}/robots.txt')
+        except requests.RequestException:
+            self.throttle.observe(base_url, time.perf_counter() - st)
+            self.metrics.inc('request_errors')
+            return None, False
+        self.throttle.observe(base_url, time.perf_counter() - st, r.status_code)
+        if r.status_code >= 500:
+            return None, False
+        if r.status_code >= 400:
+            return None, True
+        return r.content.decode('utf-8', 'replace'), True
+
+    def check_robot_allowed(self, url):
+        '''
+        Returns False if the url's robots.txt disallows it
+        '''
+        parsed_url = urlparse(url)
+        path = parsed_url.path + (f'?{parsed_url.query}' if parsed_url.query else '')
+        return self.robots.allowed(f'{parsed_url.scheme}://{parsed_url.netloc}', path)
 
     def check_domain(self, domain):
         '''
@@ -286,123 +487,273 @@ class WebCrawler:
             return domain == self.domain
         return True
 
+    def check_link(self, url):
+        '''
+        Decides if a found (normalized) link may enter the frontier
+        '''
+        return (url not in self.repo_files and url not in self.duplicates
+                and self.check_domain(urlparse(url).netloc))
+
     def check_ext(self, url):
         s = url.split('.')
         if s:
             return s[-1] not in ['mp4', 'jpg', 'png']
         return False
 
-    def add_file_to_repo(self, url):
+    def add_file_to_repo(self, url, depth=0):
         '''
         Gets the url and saves filename and status in repo_files
-        Saves file in repository
-        TODO: error handling for request and file save
-        '''
-        st = time.time()
-        if url not in self.repo_files and self.check_ext(url):
-            r = requests.get(url)
-            # print(dir(r))
-            # print(r.headers)
-            # print(r.apparent_encoding)
-            # print()
-            if 'Content-Type' in r.headers and'text/html' in r.headers['Content-Type']:
-                self.file_count += 1
-                self.repo_files[url] = {'filename': f'{self.file_count}.html', 'status': r.status_code}
-                with open(os.path.join(self.repo, self.repo_files[url]['filename']), 'wb') as f:
-                    f.write(r.content)
-                return True
-        e = time.time() - st
-        # print(f'add_file_to_repo took {e}')
+        Streams the response into the repository, finding links on the way (see save_file)
+        When recrawling, the request is conditional and a 304 reuses the stored file
+        Failed requests are skipped; the response time and status go to the throttle,
+            and a 429 or 503 raises politeness.Throttled (see fetch_politely)
+        Returns True if a file was added
+        TODO: error handling for file save
+        '''
+        if url not in self.repo_files and url not in self.duplicates and self.check_ext(url):
+            parsed_url = urlparse(url)
+            host = f'{parsed_url.scheme}://{parsed_url.netloc}'
+            st = time.perf_counter()
+            try:
+                with self.metrics.timer('http_fetch'):
+                    r = self.pool.get(url, stream=True, headers=self.conditional_headers(url))
+            except requests.RequestException:
+                self.throttle.observe(host, time.perf_counter() - st)
+                self.metrics.inc('request_errors')
+                return False
+            self.throttle.observe(host, time.perf_counter() - st, r.status_code)
+            try:
+                with r:
+                    if r.status_code in RETRY_STATUSES:
+                        self.metrics.inc('throttled')
+                        raise Throttled(r.status_code, parse_retry_after(r.headers.get('Retry-After')))
+                    if r.status_code == 304 and url in self.previous_files:
+                        self.reuse_file(url, depth)
+                        return True
+                    if 'Content-Type' in r.headers and'text/html' in r.headers['Content-Type']:
+                        return self.save_file(url, r.status_code, r.iter_content(64 * 1024), depth, r.headers)
+            except requests.RequestException:
+                self.metrics.inc('request_errors')
+                return False
         return False
 
+    def conditional_headers(self, url):
+        '''
+        If-None-Match/If-Modified-Since headers from the url's entry in the last crawl
+        '''
+        previous = self.previous_files.get(url, {})
+        headers = {}
+        if previous.get('etag'):
+            headers['If-None-Match'] = previous['etag']
+        if previous.get('last_modified'):
+            headers['If-Modified-Since'] = previous['last_modified']
+        return headers
+
+    def next_file(self, url, status, depth):
+        '''
+        Counts a new file and returns its repo_files entry
+        A url stored by the last crawl keeps its filename
+        '''
+        with self.lock:
+            self.file_count += 1
+            previous = self.previous_files.get(url)
+            if previous:
+                filename = previous['filename']
+            else:
+                filename = f'{self.file_numbers.add()}.html'
+        return {'filename': filename, 'status': status, 'depth': depth}
+
+    def save_file(self, url, status, chunks, depth=0, headers=None):
+        '''
+        Saves filename, status, crawl depth, ETag, Last-Modified and content digest
+            in repo_files and writes chunks (an iterable of bytes) to repository
+        Each chunk is also fed to a LinkExtractor, so links and images are found
+            in the same pass: links go to the frontier, counts to repo_files
+        The file is only replaced if its digest differs from the last crawl's,
+            and is not stored if it is a near duplicate (see check_duplicate)
+        Returns False for a near duplicate
+        '''
+        headers = headers or {}
+        entry = self.next_file(url, status, depth)
+        extractor = LinkExtractor(url, collect_text=self.near_index is not None)
+        original = None
+        digest = hashlib.sha256()
+        clock = time.perf_counter
+        read = write = parse = 0.0
+        size = 0
+        chunks = iter(chunks)
+        with self.store.writer(entry['filename']) as f:
+            while True:
+                st = clock()
+                chunk = next(chunks, None)
+                read += clock() - st
+                if chunk is None:
+                    break
+                size += len(chunk)
+                st = clock()
+                f.write(chunk)
+                digest.update(chunk)
+                write += clock() - st
+                st = clock()
+                extractor.feed_bytes(chunk)
+                parse += clock() - st
+            if self.near_index is not None:
+                st = clock()
+                extractor.finish()
+                parse += clock() - st
+                original = self.check_duplicate(url, entry, extractor.text())
+                if original is not None:
+                    f.discard()
+            entry['etag'] = headers.get('ETag')
+            entry['last_modified'] = headers.get('Last-Modified')
+            entry['digest'] = digest.hexdigest()
+            previous = self.previous_files.get(url)
+            entry['changed'] = previous is None or previous.get('digest') != entry['digest']
+            if not entry['changed'] and original is None:
+                f.discard()
+                self.metrics.inc('unchanged')
+            st = clock()
+        self.metrics.observe('http_read', read)
+        self.metrics.observe('disk_write', write + clock() - st)
+        self.metrics.inc('bytes', size)
+        if original is not None:
+            self.record_duplicate(url, original, entry, extractor, parse, size)
+            return False
+        self.record_file(url, entry, extractor, parse)
+        return True
+
+    def check_duplicate(self, url, entry, text):
+        '''
+        Looks for a stored page within near_duplicates bits of the SimHash of text
+        Returns the url of that page, or None after keeping the signature in
+            entry and the index (pages with too little text are not checked)
+        '''
+        from near_duplicates import simhash
+
+        with self.metrics.timer('near_duplicates'):
+            signature = simhash(text)
+            if signature is None:
+                return None
+            original = self.near_index.check(signature, url)
+            if original is None:
+                entry['simhash'] = signature
+            return original
+
+    def record_duplicate(self, url, original, entry, extractor, parse, size):
+        '''
+        Records a near duplicate page that was not stored and adds its links to the frontier
+        It gives back its place in the num_pages budget
+        '''
+        self.metrics.observe('link_parse', parse)
+        self.metrics.inc('duplicates')
+        self.metrics.inc('duplicate_bytes', size)
+        with self.lock:
+            self.file_count -= 1
+            self.duplicates[url] = original
+            self.frontier.add_all(extractor.links, entry['depth'] + 1)
+
+    def reuse_file(self, url, depth=0):
+        '''
+        Keeps the last crawl's file for a url that was not modified
+        Links are found by reading the stored file
+        '''
+        entry = self.next_file(url, self.previous_files[url]['status'], depth)
+        for key in ('etag', 'last_modified', 'digest', 'simhash'):
+            entry[key] = self.previous_files[url].get(key)
+        if self.near_index is not None and entry['simhash'] is not None:
+            self.near_index.add(entry['simhash'], url)
+        entry['changed'] = False
+        self.metrics.inc('not_modified')
+        extractor = LinkExtractor(url)
+        st = time.perf_counter()
+        with self.store.open(entry['filename']) as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                extractor.feed_bytes(chunk)
+        self.record_file(url, entry, extractor, time.perf_counter() - st)
+
+    def record_file(self, url, entry, extractor, parse=0.0):
+        '''
+        Adds a saved file to repo_files and its links to the frontier
+        parse is the time already spent feeding the extractor
+        '''
+        st = time.perf_counter()
+        extractor.finish()
+        self.metrics.observe('link_parse', parse + time.perf_counter() - st)
+        self.metrics.inc('pages')
+        entry['links'] = extractor.link_count
+        entry['images'] = extractor.image_count
+        with self.lock:
+            self.repo_files[url] = entry
+            self.frontier.add_all(extractor.links, entry['depth'] + 1)
+            if self.checkpoint_every and len(self.repo_files) % self.checkpoint_every == 0:
+                self.save_checkpoint()
+
+    def changed_files(self):
+        '''
+        Filenames of the pages that are new or changed since the last crawl
+        '''
+        return [entry['filename'] for entry in self.repo_files.values() if entry.get('changed', True)]
+
+    def duplicate_summary(self, pages_per_sec=None):
+        '''
+        Near duplicate detection results: pages fetched, duplicates skipped, dedup rate,
+            bytes not stored, seconds spent on signatures and lookups, and the seconds saved
+            by not writing the duplicates (at the mean disk_write time of a page)
+        With pages_per_sec, the processing throughput of the stored pages (e.g.
+            ContentProcessor.pages_per_sec), the processing time saved is added
+        '''
+        snapshot = self.metrics.snapshot()
+        duplicates = len(self.duplicates)
+        pages = len(self.repo_files) + duplicates
+        timers = snapshot['timers']
+        saved = duplicates * timers.get('disk_write', {}).get('mean', 0.0)
+        if pages_per_sec:
+            saved += duplicates / pages_per_sec
+        return {'pages': pages, 'duplicates': duplicates, 'dedup_rate': duplicates / pages if pages else 0.0,
+                'duplicate_bytes': snapshot['counters'].get('duplicate_bytes', 0),
+                'detection_seconds': timers.get('near_duplicates', {}).get('sum', 0.0),
+                'seconds_saved': saved}
+
     def find_links(self, url):
         '''
         Opens a url's file and finds all links within, and all images
-        Saves links to main_link_queue and images to url's repo_files entry
+        Saves links to the frontier and images to url's repo_files entry
+        The crawl itself finds links while saving (save_file); this rereads a saved page
         '''
-        st = time.time()
-        with open(os.path.join(self.repo, self.repo_files[url]['filename']), 'r', encoding='utf-8') as f:
-            soup = BeautifulSoup(f, 'html.parser')
+        from bs4 import BeautifulSoup
+
+        with self.store.open(self.repo_files[url]['filename']) as f:
+            soup = BeautifulSoup(f.read().decode('utf-8'), 'html.parser')
             links = soup.find_all('a')
             self.repo_files[url]['links'] = 0
             for link in links:
                 try:
-                    parsed_url = urlparse(link['href'])
-                    if parsed_url.scheme and parsed_url.netloc:
-                        link_url = f'{parsed_url.scheme}://{parsed_url.netloc}{parsed_url.path}'
-                    else:
-                        parsed_host_url = urlparse(url)
-                        link_url = f'{parsed_host_url.scheme}://{parsed_host_url.netloc}{parsed_url.path}'
+                    link_url = resolve_link(url, link['href'])
                     self.repo_files[url]['links'] += 1
-                    self.main_link_queue.add(link_url)
+                    self.frontier.add(link_url, self.repo_files[url].get('depth', 0) + 1)
                 except KeyError as e: # <a> tag without href
                     pass
 
             images = soup.find_all('img')
             self.repo_files[url]['images'] = len(images)
-        e = time.time() - st
-        # print(f'find_links took {e}')
-
-    def check_file_count_no_display(self):
-        if self.file_count >= self.num_pages:
-            return False
-        return True
 
     def check_file_count(self):
         '''
         Checks if added files is equal to or greater than the input num_pages
-        Displays the files if so and returns a False boolean to indicate that crawling should stop
+        Returns a False boolean if so to indicate that crawling should stop
+            (the report is written once, when the crawl ends)
         '''
-        st = time.time()
-        if self.file_count >= self.num_pages:
-            self.display()
-            self.output()
-            e = time.time() - st
-            # print(f'check_file_count took {e}')
-            return False
-        e = time.time() - st
-        # print(f'check_file_count took {e}')
-        return True
+        return self.file_count < self.num_pages
 
     def display(self):
         '''
-        For jupyter notebook, displays a table of all files in repo
-        '''
-        st = time.time()
-        html = '<table><tr><td>Live URL</td><td>File</td><td>Status</td><td># Links</td><td># Images</td></tr>'
-        for key in self.repo_files:
-            skey = key.rstrip('/')
-            status = self.repo_files[key]['status']
-            filename = self.repo_files[key]['filename']
-            filename = f'repository/{filename}'
-            links = self.repo_files[key]['links']
-            images = self.repo_files[key]['images']
-            html += f'<tr><td><a href={skey}>{skey}<td><a href={filename}>{key}</a></td><td>{status}</td><td>{links}</td><td>{images}</td></tr>'
-        html += '</table>'
-        display(HTML(html))
-        e = time.time() - st
-        # print(f'display took {e}')
+        For jupyter notebook, displays a summary and the first display_rows files in repo
+        '''
+        CrawlReport(self.repo_files, self.repo).display(self.display_rows)
 
     def output(self):
-
-        html = '<html><body><table><tr><td>Live URL</td><td>File</td><td>Status</td><td># Links</td><td># Images</td></tr>'
-        for key in self.repo_files:
-            skey = key.rstrip('/')
-            status = self.repo_files[key]['status']
-            filename = self.repo_files[key]['filename']
-            filename = f'repository/{filename}'
-            links = self.repo_files[key]['links']
-            images = self.repo_files[key]['images']
-            html += f'<tr><td><a href={skey}>{skey}<td><a href={filename}>{key}</a></td><td>{status}</td><td>{links}</td><td>{images}</td></tr>'
-        html += '</table></body></html>'
-        with open('report.html', 'w') as f:
-            f.write(html)
-
-
-
-
-
-
-
-
-
+        '''
+        Writes the report of all files in repo to report, streaming it row by row
+        Returns the paths written
+        '''
+        return CrawlReport(self.repo_files, self.repo).write(self.report, self.report_formats, self.report_page_size)